@@ -0,0 +1,124 @@
+"""
+End-to-end crawl benchmark against the local fake biji API.
+
+    python benchmarks/bench_crawl.py --notes 20000 --pipeline mongita --threads 16
+
+Starts `fake_biji_server` in a child process (so its memory is not counted),
+crawls it with `BijiNotesSpider` or the asyncio engine into the chosen
+pipeline, and reports notes/sec, details/sec and peak RSS.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_biji_server import add_server_arguments, make_token, serve, server_config_from_args
+
+PIPELINES = {
+    "none": [],
+    "mongita": ["crawler.pipelines.mongita_pipeline.MongitaPipeline"],
+    "sqlite": ["crawler.pipelines.sqlite_pipeline.SqlitePipeline"],
+    "jsonl": ["crawler.pipelines.notes_jsonl_pipeline.NotesJsonlPipeline"],
+    "mongita-write-behind": ["crawler.pipelines.write_behind_pipeline.WriteBehindMongitaPipeline"],
+    "jsonl-write-behind": ["crawler.pipelines.write_behind_pipeline.WriteBehindJsonlPipeline"],
+    "sqlite-write-behind": ["crawler.pipelines.write_behind_pipeline.WriteBehindSqlitePipeline"],
+}
+COUNTING_PIPELINE = "benchmarks.pipelines.CountingPipeline"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    add_server_arguments(parser)
+    parser.add_argument("--engine", choices=["feapder", "asyncio"], default="feapder")
+    parser.add_argument("--pipeline", choices=sorted(PIPELINES), default="mongita")
+    parser.add_argument("--threads", type=int, default=16, help="feapder worker threads")
+    parser.add_argument("--concurrency", type=int, default=64, help="asyncio detail workers")
+    parser.add_argument("--limit", type=int, default=100, help="notes page size")
+    parser.add_argument("--out-dir", default="", help="storage directory (default: a temp dir)")
+    parser.add_argument("--json", action="store_true", help="print the result as one JSON line")
+    parser.add_argument("--verbose", action="store_true", help="keep crawler INFO logs")
+    args = parser.parse_args()
+
+    config = server_config_from_args(args)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(config,), kwargs={"ready": ready}, daemon=True)
+    server.start()
+    base_url = ready.get(timeout=30)
+
+    out_dir = Path(args.out_dir or tempfile.mkdtemp(prefix="biji-bench-"))
+    os.environ.update(
+        {
+            "LOG_LEVEL": "INFO" if args.verbose else "WARNING",
+            "BIJI_API_BASE": base_url,
+            "BIJI_AUTH_API_BASE": base_url,
+            "BIJI_BEARER_TOKEN": make_token(ttl=config.token_ttl),
+            "BIJI_REFRESH_TOKEN": "fake-refresh-token",
+            "BIJI_LIMIT": str(args.limit),
+            "BIJI_THREAD_COUNT": str(args.threads),
+            "BIJI_INCREMENTAL": "0",
+            "BIJI_MONGITA_DIR": str(out_dir / "mongita"),
+            "BIJI_STORAGE": "sqlite" if args.pipeline.startswith("sqlite") else "mongita",
+            "BIJI_SQLITE_PATH": str(out_dir / "biji.sqlite3"),
+            "BIJI_EXPORT_PATH": str(out_dir / "notes.jsonl"),
+        }
+    )
+
+    # Imported late so feapder picks up LOG_LEVEL.
+    import feapder.setting as setting
+
+    from benchmarks.pipelines import CountingPipeline
+
+    setting.ITEM_PIPELINES = [*PIPELINES[args.pipeline], COUNTING_PIPELINE]
+    CountingPipeline.reset()
+
+    started = time.perf_counter()
+    try:
+        if args.engine == "asyncio":
+            from crawler.async_engine import AsyncBijiCrawler, load_pipelines
+
+            AsyncBijiCrawler(pipelines=load_pipelines(setting.ITEM_PIPELINES), concurrency=args.concurrency).start()
+        else:
+            from crawler.spiders.biji_notes_spider import BijiNotesSpider
+
+            spider = BijiNotesSpider()
+            spider.start()
+            spider.join()
+    finally:
+        server.terminate()
+    elapsed = time.perf_counter() - started
+
+    notes = CountingPipeline.counts.get("note", 0)
+    details = CountingPipeline.counts.get("link_detail", 0)
+    result = {
+        "engine": args.engine,
+        "pipeline": args.pipeline,
+        "corpus_notes": args.notes,
+        "notes": notes,
+        "details": details,
+        "seconds": round(elapsed, 3),
+        "notes_per_sec": round(notes / elapsed, 1),
+        "details_per_sec": round(details / elapsed, 1),
+        # ru_maxrss is KiB on Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key:>16}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,516 @@
+"""
+Micro-benchmarks for the parsing, rendering and storage hot paths.
+
+    python benchmarks/bench_micro.py                      # compare with the baseline
+    python benchmarks/bench_micro.py --check              # exit 1 on regressions
+    python benchmarks/bench_micro.py --update-baseline    # rewrite baseline_micro.json
+
+Fixtures are generated from `SyntheticCorpus` (seed 0) at 1k, 10k and 100k
+notes. Storage cases that are quadratic in the current Mongita upsert are
+capped at 10k unless `--full` is given.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.synthetic import CorpusConfig, SyntheticCorpus
+from crawler.biji_detail_logic import parse_link_detail
+from crawler.biji_notes_logic import parse_notes_page
+from crawler.crawl_session import detail_item, note_item
+from crawler.detail_index import note_version
+from crawler.jsonl_segments import SegmentPolicy
+from crawler.markdown_export import MarkdownExportOptions, export_markdown_from_records, render_link_markdown
+from crawler.mongita_io import NoteIdIndex, open_mongita, upsert_by_note_id
+from crawler.pipelines.mongita_pipeline import MongitaConfig, MongitaPipeline
+from crawler.pipelines.notes_jsonl_pipeline import NotesJsonlPipeline
+from crawler.pipelines.sqlite_pipeline import SqlitePipeline
+from crawler.sqlite_store import SqliteStore
+from crawler.storage import DetailLookup, MongitaStore
+from scripts.migrate_jsonl_to_mongita import migrate_jsonl, migrate_jsonl_compacted
+
+BASELINE_PATH = Path(__file__).with_name("baseline_micro.json")
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+PAGE_SIZE = 100
+# feapder's ITEM_UPLOAD_BATCH_MAX_SIZE.
+BATCH_SIZE = 1000
+
+
+@dataclass
+class Fixture:
+    size: int
+    note_pages: List[Dict[str, Any]]
+    detail_payloads: List[Dict[str, Any]]
+    note_items: List[Dict[str, Any]]
+    detail_items: List[Dict[str, Any]]
+    jsonl_path: Path
+
+    @property
+    def details_by_note_id(self) -> Dict[str, Dict[str, Any]]:
+        return {d["note_id"]: d for d in self.detail_items}
+
+
+def build_fixture(size: int, workdir: Path) -> Fixture:
+    corpus = SyntheticCorpus(CorpusConfig(notes=size, link_ratio=0.3, content_size=1000, seed=0))
+    note_pages, detail_payloads, note_items, detail_items = [], [], [], []
+    for start in range(0, size, PAGE_SIZE):
+        notes = [corpus.note(i) for i in range(start, min(start + PAGE_SIZE, size))]
+        note_pages.append({"h": {"c": 0}, "c": {"list": notes}})
+        for note in notes:
+            note_items.append(note_item(note))
+            detail = corpus.link_detail(note["id"])
+            if detail is not None:
+                payload = {"h": {"c": 0}, "c": detail}
+                detail_payloads.append(payload)
+                detail_items.append(detail_item(note["id"], parse_link_detail(payload), note_version(note)))
+
+    jsonl_path = workdir / f"notes-{size}.jsonl"
+    with jsonl_path.open("w", encoding="utf-8") as f:
+        for item in [*note_items, *detail_items]:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return Fixture(size, note_pages, detail_payloads, note_items, detail_items, jsonl_path)
+
+
+def _batches(items: List[Dict[str, Any]]):
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start : start + BATCH_SIZE]
+
+
+# Each case prepares untimed state in a fresh `workdir` and returns the timed
+# callable, which returns how many records it processed.
+Prepare = Callable[[Fixture, Path], Callable[[], int]]
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    prepare: Prepare
+    max_size: int | None = None
+
+
+def _parse_notes_page(fx: Fixture, workdir: Path):
+    def run():
+        return sum(len(parse_notes_page(page, limit=PAGE_SIZE).notes) for page in fx.note_pages)
+
+    return run
+
+
+def _parse_link_detail(fx: Fixture, workdir: Path):
+    def run():
+        for payload in fx.detail_payloads:
+            parse_link_detail(payload)
+        return len(fx.detail_payloads)
+
+    return run
+
+
+def _render_link_markdown(fx: Fixture, workdir: Path):
+    details = fx.details_by_note_id
+
+    def run():
+        for note in fx.note_items:
+            render_link_markdown(note=note, detail=details.get(note["note_id"]))
+        return len(fx.note_items)
+
+    return run
+
+
+def _export_markdown(fx: Fixture, workdir: Path):
+    details = fx.details_by_note_id
+    options = MarkdownExportOptions(out_dir=workdir / "md")
+
+    def run():
+        return len(export_markdown_from_records(notes=fx.note_items, details_by_note_id=details, options=options))
+
+    return run
+
+
+def _export_markdown_parallel(fx: Fixture, workdir: Path):
+    # One worker per CPU; on a single core this measures the pool overhead.
+    details = fx.details_by_note_id
+    options = MarkdownExportOptions(out_dir=workdir / "md", workers=max(os.cpu_count() or 1, 2))
+
+    def run():
+        return len(export_markdown_from_records(notes=fx.note_items, details_by_note_id=details, options=options))
+
+    return run
+
+
+def _export_markdown_streaming(fx: Fixture, workdir: Path):
+    # What scripts/export_mongita_to_markdown.py does: a notes cursor plus per-note detail lookups.
+    store = SqliteStore(workdir / "biji.sqlite3")
+    for batch in _batches(fx.note_items):
+        store.upsert_notes(batch)
+    for batch in _batches(fx.detail_items):
+        store.upsert_details(batch)
+    options = MarkdownExportOptions(out_dir=workdir / "md")
+
+    def run():
+        return len(
+            export_markdown_from_records(notes=store.iter_notes(), details_by_note_id=DetailLookup(store), options=options)
+        )
+
+    return run
+
+
+def _export_markdown_streaming_mongita(fx: Fixture, workdir: Path):
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+    store = MongitaStore(cols)
+    for batch in _batches(fx.note_items):
+        store.upsert_notes(batch)
+    for batch in _batches(fx.detail_items):
+        store.upsert_details(batch)
+    options = MarkdownExportOptions(out_dir=workdir / "md")
+
+    def run():
+        # A fresh store, as the export script opens one: no note_id map or cached documents yet.
+        store = MongitaStore(open_mongita(workdir / "mongita", "biji", "notes", "details", "misc"))
+        return len(
+            export_markdown_from_records(notes=store.iter_notes(), details_by_note_id=DetailLookup(store), options=options)
+        )
+
+    return run
+
+
+def _export_markdown_incremental(fx: Fixture, workdir: Path):
+    # A re-export with nothing changed since the last one.
+    details = fx.details_by_note_id
+    options = MarkdownExportOptions(out_dir=workdir / "md", incremental=True)
+    export_markdown_from_records(notes=fx.note_items, details_by_note_id=details, options=options)
+
+    def run():
+        export_markdown_from_records(notes=fx.note_items, details_by_note_id=details, options=options)
+        return len(details)
+
+    return run
+
+
+def _mongita_pipeline(fx: Fixture, workdir: Path):
+    pipeline = MongitaPipeline(MongitaConfig(workdir / "mongita", "biji", "notes", "details", "misc"))
+    items = [*fx.note_items, *fx.detail_items]
+
+    def run():
+        for batch in _batches(items):
+            pipeline.save_items("item", batch)
+        pipeline.close()
+        return len(items)
+
+    return run
+
+
+def _mongita_pipeline_resync(fx: Fixture, workdir: Path):
+    # Second sync of identical data: every document is already stored.
+    config = MongitaConfig(workdir / "mongita", "biji", "notes", "details", "misc")
+    items = [*fx.note_items, *fx.detail_items]
+    first = MongitaPipeline(config)
+    for batch in _batches(items):
+        first.save_items("item", batch)
+    pipeline = MongitaPipeline(config)
+
+    def run():
+        for batch in _batches(items):
+            pipeline.save_items("item", batch)
+        pipeline.close()
+        return len(items)
+
+    return run
+
+
+def _sqlite_pipeline(fx: Fixture, workdir: Path):
+    pipeline = SqlitePipeline(workdir / "biji.sqlite3")
+    items = [*fx.note_items, *fx.detail_items]
+
+    def run():
+        for batch in _batches(items):
+            pipeline.save_items("item", batch)
+        pipeline.close()
+        return len(items)
+
+    return run
+
+
+def _sqlite_pipeline_resync(fx: Fixture, workdir: Path):
+    items = [*fx.note_items, *fx.detail_items]
+    first = SqlitePipeline(workdir / "biji.sqlite3")
+    for batch in _batches(items):
+        first.save_items("item", batch)
+    first.close()
+    pipeline = SqlitePipeline(workdir / "biji.sqlite3")
+
+    def run():
+        for batch in _batches(items):
+            pipeline.save_items("item", batch)
+        pipeline.close()
+        return len(items)
+
+    return run
+
+
+def _sqlite_iter_notes(fx: Fixture, workdir: Path):
+    store = SqliteStore(workdir / "biji.sqlite3")
+    for batch in _batches(fx.note_items):
+        store.upsert_notes(batch)
+
+    def run():
+        return sum(1 for _ in store.iter_notes())
+
+    return run
+
+
+def _mongita_iter_notes(fx: Fixture, workdir: Path):
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+    store = MongitaStore(cols)
+    for batch in _batches(fx.note_items):
+        store.upsert_notes(batch)
+
+    def run():
+        return sum(1 for _ in MongitaStore(cols).iter_notes())
+
+    return run
+
+
+def _upsert_by_note_id(fx: Fixture, workdir: Path):
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        for item in fx.note_items:
+            upsert_by_note_id(cols.notes, note_id=item["note_id"], doc=item)
+        return len(fx.note_items)
+
+    return run
+
+
+def _note_id_index_upsert(fx: Fixture, workdir: Path):
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        index = NoteIdIndex(cols.notes)
+        for batch in _batches(fx.note_items):
+            index.upsert_many(batch)
+        return len(fx.note_items)
+
+    return run
+
+
+def _jsonl_pipeline(fx: Fixture, workdir: Path, policy: SegmentPolicy | None = None):
+    pipeline = NotesJsonlPipeline(workdir / "notes.jsonl", policy or SegmentPolicy())
+    items = [*fx.note_items, *fx.detail_items]
+
+    def run():
+        for batch in _batches(items):
+            pipeline.save_items("item", batch)
+        pipeline.close()
+        return len(items)
+
+    return run
+
+
+def _jsonl_pipeline_gzip(fx: Fixture, workdir: Path):
+    return _jsonl_pipeline(fx, workdir, SegmentPolicy(compression="gzip", rotate_bytes=64 << 20))
+
+
+def _jsonl_migration(fx: Fixture, workdir: Path):
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        return sum(migrate_jsonl(fx.jsonl_path, MongitaStore(cols)))
+
+    return run
+
+
+def _versioned_jsonl(fx: Fixture, workdir: Path, copies: int = 3) -> Path:
+    # An export appended to by several crawls: every record `copies` times.
+    path = workdir / f"versions-{fx.size}.jsonl"
+    path.write_bytes(fx.jsonl_path.read_bytes() * copies)
+    return path
+
+
+def _jsonl_migration_versions(fx: Fixture, workdir: Path):
+    path = _versioned_jsonl(fx, workdir)
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        return sum(migrate_jsonl(path, MongitaStore(cols)))
+
+    return run
+
+
+def _jsonl_migration_compact(fx: Fixture, workdir: Path):
+    path = _versioned_jsonl(fx, workdir)
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        return sum(migrate_jsonl_compacted(path, MongitaStore(cols)))
+
+    return run
+
+
+def _jsonl_migration_compact_parallel(fx: Fixture, workdir: Path):
+    # One worker per CPU; on a single core this measures the pickling overhead.
+    path = _versioned_jsonl(fx, workdir)
+    cols = open_mongita(workdir / "mongita", "biji", "notes", "details", "misc")
+
+    def run():
+        return sum(migrate_jsonl_compacted(path, MongitaStore(cols), workers=os.cpu_count() or 1))
+
+    return run
+
+
+CASES = [
+    Case("parse_notes_page", _parse_notes_page),
+    Case("parse_link_detail", _parse_link_detail),
+    Case("render_link_markdown", _render_link_markdown),
+    Case("export_markdown_from_records", _export_markdown),
+    Case("export_markdown.incremental", _export_markdown_incremental),
+    Case("export_markdown.parallel", _export_markdown_parallel),
+    Case("export_markdown.streaming_sqlite", _export_markdown_streaming),
+    Case("export_markdown.streaming_mongita", _export_markdown_streaming_mongita),
+    Case("mongita_pipeline.save_items", _mongita_pipeline),
+    Case("mongita_pipeline.resync", _mongita_pipeline_resync),
+    Case("sqlite_pipeline.save_items", _sqlite_pipeline),
+    Case("sqlite_pipeline.resync", _sqlite_pipeline_resync),
+    Case("mongita.iter_notes", _mongita_iter_notes),
+    Case("sqlite.iter_notes", _sqlite_iter_notes),
+    Case("upsert_by_note_id", _upsert_by_note_id, max_size=10_000),
+    Case("NoteIdIndex.upsert_many", _note_id_index_upsert),
+    Case("notes_jsonl_pipeline.save_items", _jsonl_pipeline),
+    Case("notes_jsonl_pipeline.gzip", _jsonl_pipeline_gzip),
+    Case("migrate_jsonl", _jsonl_migration),
+    Case("migrate_jsonl.3_versions", _jsonl_migration_versions),
+    Case("migrate_jsonl.compact.3_versions", _jsonl_migration_compact),
+    Case("migrate_jsonl.compact.parallel", _jsonl_migration_compact_parallel),
+]
+
+
+@dataclass
+class Result:
+    case: str
+    size: int
+    seconds: float
+    records: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.case}@{self.size}"
+
+    @property
+    def records_per_sec(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+
+def run_case(case: Case, fx: Fixture, *, repeat: int, min_time: float = 0.5) -> Result:
+    """
+    Best of `repeat` runs, each in a fresh workdir. Runs slower than a second
+    are not repeated; quick cases keep repeating until `min_time` seconds
+    have been measured so timer noise does not read as a regression.
+    """
+    best = None
+    records = 0
+    runs = 0
+    total = 0.0
+    while runs < repeat or (total < min_time and runs < 50):
+        workdir = Path(tempfile.mkdtemp(prefix="biji-micro-"))
+        try:
+            fn = case.prepare(fx, workdir)
+            gc.collect()
+            started = time.perf_counter()
+            records = fn()
+            elapsed = time.perf_counter() - started
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        runs += 1
+        total += elapsed
+        best = elapsed if best is None else min(best, elapsed)
+        if elapsed > 1.0:
+            break
+    return Result(case.name, fx.size, best, records)
+
+
+def compare(results: List[Result], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    entries = baseline.get("results", {})
+    for r in results:
+        base = entries.get(r.key)
+        if not base:
+            status = "new"
+        else:
+            ratio = r.seconds / base["seconds"] if base["seconds"] else 1.0
+            status = f"{ratio:5.2f}x"
+            if ratio > 1 + threshold:
+                status += " REGRESSION"
+                regressions.append(r.key)
+        print(f"{r.key:<45} {r.seconds:9.4f}s {r.records_per_sec:12.0f} rec/s  {status}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--cases", default="", help="comma separated case names (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--full", action="store_true", help="ignore per-case size caps")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a case regresses")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    wanted = {c for c in args.cases.split(",") if c}
+    cases = [c for c in CASES if not wanted or c.name in wanted]
+
+    results: List[Result] = []
+    fixture_dir = Path(tempfile.mkdtemp(prefix="biji-micro-fixtures-"))
+    try:
+        for size in sizes:
+            fx = build_fixture(size, fixture_dir)
+            for case in cases:
+                if case.max_size is not None and size > case.max_size and not args.full:
+                    print(f"{f'{case.name}@{size}':<45} skipped (> {case.max_size}; use --full)")
+                    continue
+                results.append(run_case(case, fx, repeat=args.repeat))
+                print(f"  ran {results[-1].key}: {results[-1].seconds:.4f}s", file=sys.stderr)
+            del fx
+    finally:
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        entries = dict(baseline.get("results", {}))
+        entries.update({r.key: {"seconds": round(r.seconds, 6), "records": r.records} for r in results})
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "updated_at": time.strftime("%Y-%m-%d"),
+            "results": dict(sorted(entries.items())),
+        }
+        baseline_path.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline written: {baseline_path}")
+    elif regressions:
+        print(f"regressions (> {args.threshold:.0%} slower): {', '.join(regressions)}")
+        if args.check:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
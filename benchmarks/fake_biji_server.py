@@ -0,0 +1,229 @@
+"""
+Local stand-in for the biji notes and auth APIs.
+
+    python benchmarks/fake_biji_server.py --notes 100000 --link-ratio 0.3 --port 8765
+
+Point the crawler at it with `BIJI_API_BASE` / `BIJI_AUTH_API_BASE` and a
+token from `make_token()` (printed on start-up).
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synthetic import CorpusConfig, SyntheticCorpus
+from crawler.biji_auth import decode_jwt_exp
+
+NOTES_PATH = "/voicenotes/web/notes"
+REFRESH_PATH = "/account/v2/web/user/auth/refresh"
+
+
+def make_token(*, ttl: int, uid: int = 42) -> str:
+    """
+    Unsigned JWT-shaped token; the fake server only checks `exp`.
+    """
+    payload = {"uid": uid, "exp": int(time.time()) + ttl, "nonce": random.getrandbits(32)}
+    body = base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).rstrip(b"=").decode("ascii")
+    return f"eyJhbGciOiJub25lIn0.{body}."
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    corpus: CorpusConfig = field(default_factory=CorpusConfig)
+    latency_ms: float = 20.0
+    latency_sigma: float = 0.5
+    p403: float = 0.0
+    p429: float = 0.0
+    p_detail_error: float = 0.0
+    token_ttl: int = 3600
+
+
+@dataclass
+class ServerStats:
+    requests: Dict[str, int] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+class FakeBijiServer(ThreadingHTTPServer):
+    """
+    Serves notes pages, link details and token refreshes from a
+    `SyntheticCorpus`.
+
+    Response times follow a log-normal distribution around `latency_ms`;
+    `p403`/`p429` inject auth rejections and throttling, `p_detail_error`
+    link details answered with an error envelope (`h.c != 0`), and tokens past
+    their `exp` are rejected with 403 like the real API.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: ServerConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.corpus = SyntheticCorpus(config.corpus)
+        self.stats = ServerStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeBijiServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sleep(self) -> None:
+        config = self.server.config
+        if config.latency_ms > 0:
+            time.sleep(random.lognormvariate(0, config.latency_sigma) * config.latency_ms / 1000)
+
+    def _authorized(self) -> bool:
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        exp = decode_jwt_exp(token) if token else None
+        return exp is not None and exp > time.time() and random.random() >= self.server.config.p403
+
+    def do_GET(self):
+        self._sleep()
+        parts = urlsplit(self.path)
+        endpoint = "detail" if parts.path.endswith("/links/detail") else "notes"
+        self.server.stats.count(endpoint)
+
+        if not parts.path.startswith(NOTES_PATH):
+            self._send_json(404, {"h": {"c": 404, "e": "not found"}})
+            return
+        if random.random() < self.server.config.p429:
+            self.server.stats.count("429")
+            self._send_json(429, {"h": {"c": 429, "e": "too many requests"}})
+            return
+        if not self._authorized():
+            self.server.stats.count("403")
+            self._send_json(403, {"h": {"c": 403, "e": "LoginRequired"}, "message": "LoginRequired"})
+            return
+
+        corpus = self.server.corpus
+        if endpoint == "detail":
+            note_id = parts.path[len(NOTES_PATH) + 1 :].split("/", 1)[0]
+            detail = corpus.link_detail(note_id)
+            if detail is None:
+                self._send_json(404, {"h": {"c": 404, "e": "no link detail"}})
+                return
+            if random.random() < self.server.config.p_detail_error:
+                self.server.stats.count("detail_error")
+                self._send_json(200, {"h": {"c": 500, "e": "internal error"}})
+                return
+            self._send_json(200, {"h": {"c": 0}, "c": detail})
+            return
+
+        query = parse_qs(parts.query)
+        limit = int((query.get("limit") or ["100"])[0])
+        since_id = (query.get("since_id") or [""])[0]
+        self._send_json(200, {"h": {"c": 0}, "c": {"list": corpus.page(since_id, limit)}})
+
+    def do_POST(self):
+        self._sleep()
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if urlsplit(self.path).path != REFRESH_PATH:
+            self._send_json(404, {"h": {"c": 404, "e": "not found"}})
+            return
+        self.server.stats.count("refresh")
+        ttl = self.server.config.token_ttl
+        token = {
+            "token": make_token(ttl=ttl),
+            "token_expire_at": int(time.time()) + ttl,
+            "refresh_token": "fake-refresh-token",
+            "refresh_token_expire_at": int(time.time()) + 30 * 86_400,
+        }
+        self._send_json(200, {"h": {"c": 0}, "c": {"token": token}})
+
+
+def serve(config: ServerConfig, host: str = "127.0.0.1", port: int = 0, ready=None) -> None:
+    server = FakeBijiServer((host, port), config)
+    if ready is not None:
+        ready.put(server.base_url)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--notes", type=int, default=100_000)
+    parser.add_argument("--link-ratio", type=float, default=0.3)
+    parser.add_argument("--content-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--p403", type=float, default=0.0)
+    parser.add_argument("--p429", type=float, default=0.0)
+    parser.add_argument("--p-detail-error", type=float, default=0.0)
+    parser.add_argument("--token-ttl", type=int, default=3600)
+
+
+def server_config_from_args(args: argparse.Namespace) -> ServerConfig:
+    return ServerConfig(
+        corpus=CorpusConfig(
+            notes=args.notes, link_ratio=args.link_ratio, content_size=args.content_size, seed=args.seed
+        ),
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        p403=args.p403,
+        p429=args.p429,
+        p_detail_error=args.p_detail_error,
+        token_ttl=args.token_ttl,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    add_server_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    config = server_config_from_args(args)
+    server = FakeBijiServer((args.host, args.port), config)
+    print(f"BIJI_API_BASE={server.base_url}")
+    print(f"BIJI_AUTH_API_BASE={server.base_url}")
+    print(f"BIJI_BEARER_TOKEN={make_token(ttl=config.token_ttl)}")
+    print("BIJI_REFRESH_TOKEN=fake-refresh-token", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
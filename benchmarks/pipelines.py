@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from typing import Dict, List
+
+from feapder.pipelines import BasePipeline
+
+
+class CountingPipeline(BasePipeline):
+    """
+    Counts saved items by `kind`. feapder instantiates pipelines itself, so
+    the counts live on the class; call `reset()` before a run.
+    """
+
+    counts: Counter = Counter()
+    _lock = threading.Lock()
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls.counts = Counter()
+
+    def save_items(self, table, items: List[Dict]) -> bool:
+        batch = Counter(item.get("kind") for item in items)
+        with self._lock:
+            self.counts.update(batch)
+        return True
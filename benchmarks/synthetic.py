@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+_WORDS = (
+    "note link idea read later summary chapter draft insight memo quote audio "
+    "learning market product design research weekly plan review travel book"
+).split()
+_EPOCH = 1_700_000_000
+
+
+@dataclass(frozen=True)
+class CorpusConfig:
+    notes: int = 100_000
+    link_ratio: float = 0.3
+    content_size: int = 2000
+    seed: int = 0
+
+
+class SyntheticCorpus:
+    """
+    Deterministic fake account: note `i` (0 = newest) is derived from
+    `(seed, i)` on demand, so a 100k-note corpus costs no memory.
+
+    Note ids count down from `notes` to 1, matching the API's newest-first
+    listing, which makes `since_id` lookups O(1).
+    """
+
+    def __init__(self, config: CorpusConfig):
+        self.config = config
+
+    def __len__(self) -> int:
+        return self.config.notes
+
+    def note_id(self, index: int) -> str:
+        return str(self.config.notes - index)
+
+    def index_of(self, note_id: str) -> int | None:
+        try:
+            index = self.config.notes - int(note_id)
+        except ValueError:
+            return None
+        return index if 0 <= index < self.config.notes else None
+
+    def _rng(self, index: int) -> random.Random:
+        return random.Random(self.config.seed * 1_000_003 + index)
+
+    def _text(self, rng: random.Random, size: int) -> str:
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:size]
+
+    def is_link(self, index: int) -> bool:
+        return (index * 2654435761 + self.config.seed) % 10_000 < self.config.link_ratio * 10_000
+
+    def note(self, index: int) -> Dict[str, Any]:
+        rng = self._rng(index)
+        created = _EPOCH - index * 60
+        updated = created + (rng.randint(0, 86_400) if rng.random() < 0.2 else 0)
+        note_id = self.note_id(index)
+        return {
+            "id": note_id,
+            "note_id": note_id,
+            "note_type": "link" if self.is_link(index) else "plain_text",
+            "title": self._text(rng, 40),
+            "content": self._text(rng, rng.randint(self.config.content_size // 4, self.config.content_size // 2)),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(created)),
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(updated)),
+            "tags": [{"name": rng.choice(_WORDS)} for _ in range(rng.randint(0, 3))],
+        }
+
+    def page(self, since_id: str, limit: int) -> List[Dict[str, Any]]:
+        start = 0
+        if since_id:
+            index = self.index_of(since_id)
+            if index is None:
+                return []
+            start = index + 1
+        return [self.note(i) for i in range(start, min(start + limit, self.config.notes))]
+
+    def link_detail(self, note_id: str) -> Dict[str, Any] | None:
+        index = self.index_of(note_id)
+        if index is None or not self.is_link(index):
+            return None
+        rng = self._rng(index + self.config.notes)
+        size = rng.randint(self.config.content_size // 2, self.config.content_size * 3 // 2)
+        return {
+            "title": self._text(rng, 40),
+            "web_title": self._text(rng, 60),
+            "url": f"https://example.com/articles/{note_id}",
+            "content": self._text(rng, size),
+            "has_content": True,
+        }
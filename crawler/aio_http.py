@@ -0,0 +1,91 @@
+"""
+HTTP client for the asyncio crawl engine, on aiohttp
+(`pip install get-biji-export[async]`).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+from crawler import fastjson
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - depends on the environment
+    aiohttp = None
+
+
+@dataclass(frozen=True)
+class HttpResponse:
+    status_code: int
+    headers: Mapping[str, str]
+    content: bytes
+    url: str = ""
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return fastjson.loads(self.content)
+
+
+class AsyncHttpPool:
+    """
+    One keep-alive `aiohttp.ClientSession` with at most
+    `max_connections_per_host` sockets open to one host. Bodies are read in
+    full into an `HttpResponse`; redirects, compression and proxies from the
+    environment (`HTTPS_PROXY`, ...) are handled by aiohttp, as requests
+    does for the spider.
+    """
+
+    def __init__(self, *, max_connections_per_host: int = 64, timeout: float = 30.0):
+        if aiohttp is None:
+            raise RuntimeError('the asyncio engine needs aiohttp: pip install -e ".[async]"')
+        self._max_connections = max_connections_per_host
+        self._timeout = timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "AsyncHttpPool":
+        # The session binds to the running loop, so it is created here.
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=self._max_connections),
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+            trust_env=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Mapping[str, str] | None = None,
+        headers: Mapping[str, str] | None = None,
+        json_body: Any = None,
+    ) -> HttpResponse:
+        if self._session is None:
+            raise RuntimeError("AsyncHttpPool is not open; use it as `async with AsyncHttpPool() as http`")
+        all_headers = dict(headers or {})
+        data = None
+        if json_body is not None:
+            data = fastjson.dumps(json_body)
+            all_headers["Content-Type"] = "application/json"
+        async with self._session.request(method, url, params=params, headers=all_headers, data=data) as response:
+            body = await response.read()
+            return HttpResponse(status_code=response.status, headers=response.headers, content=body, url=str(response.url))
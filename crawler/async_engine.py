@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import importlib
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, TypeVar
+
+from feapder.pipelines import BasePipeline
+from feapder.utils.log import log
+
+from crawler import fastjson
+from crawler.aio_http import AsyncHttpPool, HttpResponse
+from crawler.biji_api import ApiClientConfig, build_api_headers, link_detail_url, notes_url, record_request
+from crawler.biji_auth import account_id_from_token
+from crawler.biji_detail_logic import parse_link_detail
+from crawler.biji_notes_logic import parse_notes_page
+from crawler.crawl_session import (
+    CrawlOptions,
+    CrawlSession,
+    detail_item,
+    log_cache_stats,
+    log_limits,
+    note_item,
+)
+from crawler.dead_letters import DeadLetterStore, dead_letter_store_from_env
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.pipelines.write_behind_pipeline import drain_write_behind, run_after_saved
+from crawler.rate_limit import endpoint_limiters_from_env, is_congestion_status
+from crawler.response_cache import detail_cache_from_env
+from crawler.retry_policy import RETRIES, RetriesExhausted, endpoint_retry_policies_from_env
+from crawler.token_manager import TokenManager
+
+T = TypeVar("T")
+
+# Table name feapder derives for a plain `Item`; pipelines ignore it.
+ITEM_TABLE = "item"
+
+
+def load_pipelines(paths: Sequence[str]) -> List[BasePipeline]:
+    """
+    Instantiate pipelines from dotted class paths, as in `setting.ITEM_PIPELINES`.
+    """
+    pipelines = []
+    for path in paths:
+        module_name, _, class_name = path.rpartition(".")
+        pipelines.append(getattr(importlib.import_module(module_name), class_name)())
+    return pipelines
+
+
+class AsyncBijiCrawler:
+    """
+    asyncio alternative to `BijiNotesSpider` built on a keep-alive connection
+    pool.
+
+    Each sort pass pages sequentially; link details flow through a bounded
+    queue to `BIJI_ASYNC_CONCURRENCY` worker tasks, and items are handed to
+    the pipelines in batches from a worker thread. Cursor, watermark and
+    conditional-fetch bookkeeping is shared with the spider via `CrawlSession`.
+    """
+
+    def __init__(
+        self,
+        *,
+        pipelines: Sequence[BasePipeline],
+        resume: bool = False,
+        replay_dead_letters: bool = False,
+        concurrency: int | None = None,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        dead_letters: DeadLetterStore | None = None,
+    ):
+        self._pipelines = list(pipelines)
+        self._api_config = ApiClientConfig.from_env()
+        self._tokens = TokenManager.from_config(self._api_config)
+        options = CrawlOptions.from_env()
+        if replay_dead_letters:
+            options = dataclasses.replace(options, checkpoint=False, incremental=False)
+        self._replay_dead_letters = replay_dead_letters
+        self._limit = options.limit
+        self._session = CrawlSession(
+            options,
+            account_id=os.getenv("BIJI_ACCOUNT_ID", "").strip() or account_id_from_token(self._tokens.bundle.access_token),
+            resume=resume,
+        )
+        self._concurrency = concurrency or int(os.getenv("BIJI_ASYNC_CONCURRENCY", "200"))
+        self._limiters = endpoint_limiters_from_env(log_limits, detail_max_concurrency=self._concurrency)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._detail_cache = detail_cache_from_env()
+        self._retry_policies = endpoint_retry_policies_from_env()
+        self._dead_letter_store = dead_letters
+        self._dead_lettered: set[str] = set()
+
+        self._items: List[Dict[str, Any]] = []
+        # Run once the items emitted before them are saved (see `_after_saved`).
+        self._on_saved: List[Callable[[], None]] = []
+        self._http: AsyncHttpPool | None = None
+        self._flush_lock: asyncio.Lock | None = None
+
+    def start(self) -> None:
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        self._flush_lock = asyncio.Lock()
+        letters = self._dead_letters().list("detail", account=self._session.account_id)
+        self._dead_lettered = {str(letter["note_id"]) for letter in letters}
+        if self._replay_dead_letters:
+            log.info("replaying dead-lettered details: account=%s count=%s", self._session.account_id, len(letters))
+            starts = {}
+            replay_details = [(str(letter["note_id"]), str(letter.get("version") or "")) for letter in letters]
+        else:
+            starts, replay_details = self._session.start()
+        # Bounded so pagination waits for detail workers instead of queueing
+        # an entire account's worth of detail fetches in memory.
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._concurrency * 4)
+
+        self._tokens.start()
+        metrics_writer = start_metrics_writer_from_env()
+        async with AsyncHttpPool(max_connections_per_host=self._concurrency) as http:
+            self._http = http
+            workers = [asyncio.create_task(self._detail_worker(queue)) for _ in range(self._concurrency)]
+            flusher = asyncio.create_task(self._flush_periodically())
+            try:
+                for note_id, version in replay_details:
+                    await queue.put((note_id, version))
+                results = await asyncio.gather(
+                    *(self._crawl_pass(sort, since_id, queue) for sort, since_id in starts.items()),
+                    return_exceptions=True,
+                )
+                for sort, result in zip(starts, results):
+                    if isinstance(result, BaseException):
+                        log.error("notes pass failed: sort=%s error=%r", sort, result)
+                await queue.join()
+            finally:
+                for task in [*workers, flusher]:
+                    task.cancel()
+                await asyncio.gather(*workers, flusher, return_exceptions=True)
+                await self._flush()
+                self._tokens.stop()
+
+        if not drain_write_behind(self._pipelines):
+            self._session.storage_failed()
+        for pipeline in self._pipelines:
+            pipeline.close()
+        self._session.finish()
+        if self._detail_cache is not None:
+            log_cache_stats(self._detail_cache)
+        if metrics_writer is not None:
+            metrics_writer.stop()
+
+    def _dead_letters(self) -> DeadLetterStore:
+        if self._dead_letter_store is None:
+            self._dead_letter_store = dead_letter_store_from_env()
+        return self._dead_letter_store
+
+    async def _access_token(self) -> str:
+        bundle = self._tokens.bundle
+        if bundle.access_token_expire_at and bundle.needs_refresh(refresh_before_seconds=0):
+            # Only when the background refresh fell behind; keep the loop free.
+            return await asyncio.to_thread(self._tokens.access_token)
+        return bundle.access_token
+
+    async def _refresh_token(self, stale_token: str) -> None:
+        log.info("attempting token refresh after auth rejection...")
+        # Single-flight: tasks holding the same stale token share one refresh.
+        await asyncio.to_thread(self._tokens.refresh, stale_token)
+
+    async def _fetch(self, endpoint: str, url: str, *, params: Dict[str, str] | None = None) -> HttpResponse:
+        """
+        One attempt (plus a single retry after a token refresh on 403);
+        transport errors and congestion statuses raise for `_retrying`.
+        """
+        auth_retried = False
+        while True:
+            token = await self._access_token()
+            limiter = self._limiters.get(endpoint)
+            started_at = await limiter.acquire_async() if limiter else 0.0
+            sent_at = time.perf_counter()
+            response = None
+            try:
+                response = await self._http.get(
+                    url, params=params, headers=build_api_headers(token, self._api_config, auth_retry=auth_retried)
+                )
+            finally:
+                # Whatever went wrong (transport, a bug in the client, cancellation), the slot goes back.
+                status = response.status_code if response is not None else None
+                record_request(endpoint, status if status is not None else "error", time.perf_counter() - sent_at)
+                if limiter:
+                    limiter.release(started_at, status=status, error=status is None)
+            if response.status_code == 403 and not auth_retried and self._tokens.bundle.refresh_token:
+                auth_retried = True
+                await self._refresh_token(token)
+                continue
+            if is_congestion_status(response.status_code):
+                raise RuntimeError(f"server congestion: status={response.status_code}")
+            return response
+
+    async def _retrying(self, endpoint: str, label: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn` under the endpoint's retry policy; raises `RetriesExhausted`
+        once the attempts are used up.
+        """
+        policy = self._retry_policies[endpoint]
+        attempt = 1
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                if not policy.should_retry(attempt):
+                    raise RetriesExhausted(attempt, e) from e
+                delay = policy.delay(attempt)
+                log.info(
+                    "retrying %s request: %s attempt=%s delay=%.2fs error=%r", endpoint, label, attempt, delay, e
+                )
+                RETRIES.inc(endpoint=endpoint)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _crawl_pass(self, sort: str, since_id: str, queue: asyncio.Queue) -> None:
+        while True:
+            params = {"limit": str(self._limit), "since_id": since_id, "sort": sort}
+            response = await self._retrying(
+                "notes", f"sort={sort} since_id={since_id}", lambda: self._fetch("notes", notes_url(), params=params)
+            )
+            try:
+                payload = response.json()
+            except Exception:
+                payload = None
+            if not isinstance(payload, dict) or "c" not in payload:
+                log.error(
+                    "notes page unexpected response: status=%s body=%s", response.status_code, response.text[:200]
+                )
+                return
+
+            page = parse_notes_page(payload, limit=self._limit)
+            outcome = self._session.handle_page(sort=sort, since_id=since_id, page=page)
+            for note in outcome.notes:
+                await self._emit(note_item(note))
+            for detail in outcome.details:
+                await queue.put(detail)
+            self._after_saved(lambda outcome=outcome: self._session.page_done(outcome))
+
+            if outcome.next_since_id is None:
+                return
+            since_id = outcome.next_since_id
+
+    async def _detail_worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            note_id, version = await queue.get()
+            try:
+                await self._process_detail(note_id, version)
+            except Exception as e:
+                log.error("link detail failed: note_id=%s error=%r", note_id, e)
+            finally:
+                queue.task_done()
+
+    async def _process_detail(self, note_id: str, version: str) -> None:
+        try:
+            detail = await self._retrying(
+                "detail", f"note_id={note_id}", lambda: self._fetch_detail(note_id, version)
+            )
+        except RetriesExhausted as e:
+            log.error("link detail dead-lettered: note_id=%s attempts=%s error=%r", note_id, e.attempts, e.error)
+            await asyncio.to_thread(
+                self._dead_letters().record,
+                endpoint="detail",
+                note_id=note_id,
+                error=repr(e.error),
+                attempts=e.attempts,
+                account=self._session.account_id,
+                version=version,
+            )
+            self._session.detail_abandoned(note_id)
+            return
+
+        await self._emit(detail_item(note_id, detail, version))
+        self._after_saved(lambda: self._session.detail_done(note_id, version))
+        if note_id in self._dead_lettered:
+            self._dead_lettered.discard(note_id)
+            await asyncio.to_thread(self._dead_letters().resolve, "detail", note_id)
+
+    async def _fetch_detail(self, note_id: str, version: str):
+        cache = self._detail_cache
+        if cache is not None:
+            body = await asyncio.to_thread(cache.get, note_id, version)
+            if body is not None:
+                try:
+                    return parse_link_detail(fastjson.loads(body))
+                except Exception as e:
+                    log.warning("ignoring unreadable cached detail: note_id=%s error=%r", note_id, e)
+
+        # Parsing is inside the retry: an error envelope (`h.c != 0`) is as
+        # transient as a 5xx.
+        response = await self._fetch("detail", link_detail_url(note_id))
+        detail = parse_link_detail(response.json())
+        if cache is not None:
+            await asyncio.to_thread(cache.put, note_id, version, response.content)
+        return detail
+
+    async def _emit(self, item: Dict[str, Any]) -> None:
+        self._items.append(item)
+        if len(self._items) >= self._batch_size:
+            await self._flush()
+
+    def _after_saved(self, callback: Callable[[], None]) -> None:
+        """
+        Run `callback` once every item emitted so far is saved by the
+        pipelines, so checkpoints never get ahead of the data.
+        """
+        self._on_saved.append(callback)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            if not self._items and not self._on_saved:
+                return
+            batch, self._items = self._items, []
+            callbacks, self._on_saved = self._on_saved, []
+            if batch and not await asyncio.to_thread(self._save_batch, batch):
+                # Later batches still go out, but their pages must not move
+                # the checkpoint past the lost items.
+                self._session.storage_failed()
+                return
+
+            def saved() -> None:
+                for callback in callbacks:
+                    callback()
+
+            # A write-behind pipeline has only queued the batch so far.
+            run_after_saved(self._pipelines, saved, self._session.storage_failed)
+
+    def _save_batch(self, batch: List[Dict[str, Any]]) -> bool:
+        saved = True
+        for pipeline in self._pipelines:
+            try:
+                ok = pipeline.save_items(ITEM_TABLE, batch)
+            except Exception as e:
+                log.exception(e)
+                ok = False
+            if not ok:
+                log.error("pipeline %s failed to save %s items", type(pipeline).__name__, len(batch))
+                saved = False
+        return saved
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping
+from urllib.parse import urlsplit
+
+import requests
+from feapder.utils.log import log
+
+from crawler import fastjson, metrics
+
+DOWNLOADS = metrics.counter("biji_attachment_downloads_total", "Attachment downloads by result.")
+DOWNLOAD_BYTES = metrics.counter("biji_attachment_bytes_total", "Attachment bytes received.")
+
+CHUNK_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class AttachmentRef:
+    note_id: str
+    type: str
+    url: str
+
+
+def attachment_refs(note: Mapping[str, Any], *, types: Iterable[str] | None = None) -> List[AttachmentRef]:
+    """
+    Downloadable entries of a stored note's `raw.attachments`, optionally
+    limited to some attachment `type`s (e.g. `audio`).
+    """
+    raw = note.get("raw") or {}
+    attachments = raw.get("attachments") if isinstance(raw, dict) else None
+    if not isinstance(attachments, list):
+        return []
+    wanted = set(types) if types else None
+    note_id = str(note.get("note_id") or raw.get("id") or "")
+    refs = []
+    for a in attachments:
+        if not isinstance(a, dict):
+            continue
+        url = str(a.get("url") or "")
+        kind = str(a.get("type") or "")
+        if not url.startswith(("http://", "https://")) or (wanted is not None and kind not in wanted):
+            continue
+        refs.append(AttachmentRef(note_id=note_id, type=kind, url=url))
+    return refs
+
+
+def _extension(url: str, content_type: str = "") -> str:
+    suffix = Path(urlsplit(url).path).suffix.lower()
+    if re.fullmatch(r"\.[a-z0-9]{1,8}", suffix):
+        return suffix
+    return mimetypes.guess_extension(content_type.split(";", 1)[0].strip()) or ""
+
+
+class AttachmentStore:
+    """
+    Content-addressed attachment files under `root`:
+
+    - `objects/<sha256[:2]>/<sha256><ext>`: one file per distinct content
+    - `partial/<sha1(url)>.part`: interrupted downloads, resumed with Range
+    - `index.jsonl`: append-only `url -> object` records (last one wins)
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._index_path = root / "index.jsonl"
+        self._lock = threading.Lock()
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        if self._index_path.exists():
+            with self._index_path.open("rb") as f:
+                for line in f:
+                    if line.strip():
+                        record = fastjson.loads(line)
+                        self._by_url[record["url"]] = record
+
+    def partial_path(self, url: str) -> Path:
+        return self.root / "partial" / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.part"
+
+    def object_path(self, sha256: str, ext: str) -> Path:
+        return self.root / "objects" / sha256[:2] / f"{sha256}{ext}"
+
+    def lookup(self, url: str) -> Path | None:
+        """
+        Local file for `url`, if it was downloaded and is still on disk.
+        """
+        record = self._by_url.get(url)
+        if record is None:
+            return None
+        path = self.root / record["path"]
+        return path if path.exists() else None
+
+    def local_paths(self) -> Dict[str, Path]:
+        return {url: path for url in list(self._by_url) if (path := self.lookup(url)) is not None}
+
+    def commit(self, url: str, part: Path, *, sha256: str, size: int, content_type: str) -> Path:
+        """
+        Move a finished download into the object store, deduplicating by
+        content hash, and record it in the index.
+        """
+        target = self.object_path(sha256, _extension(url, content_type))
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            part.unlink(missing_ok=True)
+        else:
+            os.replace(part, target)
+        record = {
+            "url": url,
+            "sha256": sha256,
+            "path": target.relative_to(self.root).as_posix(),
+            "size": size,
+            "content_type": content_type,
+        }
+        with self._lock:
+            with self._index_path.open("ab") as f:
+                f.write(fastjson.dumps_line(record))
+            self._by_url[url] = record
+        return target
+
+
+@dataclass
+class DownloadStats:
+    downloaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes: int = 0
+
+
+class AttachmentDownloader:
+    """
+    Streams attachments into an `AttachmentStore` from a bounded thread pool.
+
+    URLs already in the store are skipped, each URL is fetched once per run,
+    and a `.part` file left by an earlier run is continued with an HTTP
+    Range request (restarting when the server ignores the range).
+    """
+
+    def __init__(
+        self,
+        store: AttachmentStore,
+        *,
+        workers: int = 8,
+        timeout: float = 60.0,
+        headers: Mapping[str, str] | None = None,
+    ):
+        self.store = store
+        self.workers = workers
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+        return session
+
+    def download_all(self, refs: Iterable[AttachmentRef]) -> DownloadStats:
+        stats = DownloadStats()
+        urls = []
+        seen = set()
+        for ref in refs:
+            if ref.url in seen:
+                continue
+            seen.add(ref.url)
+            if self.store.lookup(ref.url) is not None:
+                stats.skipped += 1
+                DOWNLOADS.inc(result="skipped")
+                continue
+            urls.append(ref.url)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="biji-attachment") as pool:
+            for url, result in zip(urls, pool.map(self._download_safely, urls)):
+                if result is None:
+                    stats.failed += 1
+                else:
+                    stats.downloaded += 1
+                    stats.bytes += result
+        return stats
+
+    def _download_safely(self, url: str) -> int | None:
+        try:
+            size = self.download(url)
+        except Exception as e:
+            DOWNLOADS.inc(result="failed")
+            log.error("attachment download failed: url=%s error=%r", url, e)
+            return None
+        DOWNLOADS.inc(result="downloaded")
+        return size
+
+    def download(self, url: str) -> int:
+        """
+        Fetch one URL into the store; returns the number of bytes received.
+        """
+        part = self.store.partial_path(url)
+        part.parent.mkdir(parents=True, exist_ok=True)
+        offset = part.stat().st_size if part.exists() else 0
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self._session().get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if offset and resp.status_code == 416:
+                # The part is stale (the remote file changed); start over.
+                part.unlink()
+                return self.download(url)
+            resp.raise_for_status()
+            resumed = offset > 0 and resp.status_code == 206 and resp.headers.get("Content-Range", "").startswith(
+                f"bytes {offset}-"
+            )
+            digest = hashlib.sha256()
+            if resumed:
+                with part.open("rb") as f:
+                    while chunk := f.read(CHUNK_SIZE):
+                        digest.update(chunk)
+            else:
+                offset = 0
+
+            received = 0
+            with part.open("ab" if resumed else "wb") as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+            DOWNLOAD_BYTES.inc(received)
+            content_type = resp.headers.get("Content-Type", "")
+
+        self.store.commit(url, part, sha256=digest.hexdigest(), size=offset + received, content_type=content_type)
+        return received
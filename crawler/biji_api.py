@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass
+
+from crawler import metrics
+from crawler.biji_auth import TokenBundle, decode_jwt_exp, refresh_access_token
+
+NOTES_API_BASE = "https://get-notes.luojilab.com"
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36"
+)
+
+REQUESTS = metrics.counter("biji_requests_total", "API requests by endpoint and HTTP status (\"error\" for transport failures).")
+REQUEST_SECONDS = metrics.histogram("biji_request_seconds", "API request latency by endpoint.")
+
+
+def record_request(endpoint: str, status: int | str, seconds: float | None) -> None:
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    if seconds is not None:
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def api_base() -> str:
+    """
+    Notes API origin; `BIJI_API_BASE` points the crawler at another server,
+    e.g. the local fake used by the benchmarks.
+    """
+    return os.getenv("BIJI_API_BASE", "").strip().rstrip("/") or NOTES_API_BASE
+
+
+def notes_url() -> str:
+    return f"{api_base()}/voicenotes/web/notes"
+
+
+def link_detail_url(note_id: str) -> str:
+    return f"{api_base()}/voicenotes/web/notes/{note_id}/links/detail"
+
+
+def note_id_from_detail_url(url: str) -> str:
+    try:
+        return url.split("/voicenotes/web/notes/", 1)[1].split("/", 1)[0]
+    except Exception:
+        return ""
+
+
+@dataclass(frozen=True)
+class ApiClientConfig:
+    user_agent: str
+    csrf_token: str | None = None
+    cookie: str | None = None
+
+    @classmethod
+    def from_env(cls) -> "ApiClientConfig":
+        return cls(
+            user_agent=os.getenv("BIJI_USER_AGENT", DEFAULT_USER_AGENT),
+            csrf_token=os.getenv("BIJI_CSRF_TOKEN", "").strip() or None,
+            cookie=os.getenv("BIJI_COOKIE", "").strip() or None,
+        )
+
+
+def build_api_headers(token: str, config: ApiClientConfig, *, auth_retry: bool = False) -> dict[str, str]:
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "User-Agent": config.user_agent,
+        "X-Request-ID": str(int(time.time() * 1000)),
+    }
+    if config.csrf_token:
+        headers["Xi-Csrf-Token"] = config.csrf_token
+    if auth_retry:
+        headers["X-Auth-Retry"] = "1"
+    return headers
+
+
+def refresh_token_bundle(bundle: TokenBundle, config: ApiClientConfig) -> TokenBundle:
+    """
+    Exchange `bundle.refresh_token` for a new access token, retrying once
+    without the (possibly rejected) current access token.
+    """
+    kwargs = dict(
+        refresh_token=bundle.refresh_token,
+        csrf_token=config.csrf_token,
+        cookie=config.cookie,
+        user_agent=config.user_agent,
+    )
+    try:
+        return refresh_access_token(
+            access_token=bundle.access_token, request_id=str(int(time.time() * 1000)), **kwargs
+        )
+    except Exception:
+        return refresh_access_token(access_token=None, request_id=str(int(time.time() * 1000)), **kwargs)
+
+
+def initial_token_bundle(config: ApiClientConfig) -> TokenBundle:
+    """
+    Build the starting token from `BIJI_BEARER_TOKEN` / `BIJI_REFRESH_TOKEN`,
+    refreshing upfront when the bearer is missing or about to expire.
+    """
+    bearer = os.getenv("BIJI_BEARER_TOKEN", "").strip()
+    refresh_token = os.getenv("BIJI_REFRESH_TOKEN", "").strip()
+    bearer_exp = decode_jwt_exp(bearer) if bearer else None
+
+    if refresh_token:
+        # Prefer ensuring a fresh token upfront when refresh_token exists.
+        if (not bearer) or (bearer_exp is not None and int(time.time()) >= bearer_exp - 300):
+            return refresh_access_token(
+                refresh_token=refresh_token,
+                access_token=bearer or None,
+                csrf_token=config.csrf_token,
+                cookie=config.cookie,
+                user_agent=config.user_agent,
+                request_id=str(int(time.time() * 1000)),
+            )
+        return TokenBundle(
+            access_token=bearer,
+            access_token_expire_at=bearer_exp,
+            refresh_token=refresh_token,
+            refresh_token_expire_at=None,
+        )
+    if bearer:
+        return TokenBundle(
+            access_token=bearer,
+            access_token_expire_at=bearer_exp,
+            refresh_token=None,
+            refresh_token_expire_at=None,
+        )
+    raise RuntimeError("Missing BIJI_BEARER_TOKEN/BIJI_REFRESH_TOKEN; please log in to capture env first.")
+
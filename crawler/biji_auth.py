@@ -3,11 +3,16 @@ from __future__ import annotations
 import time
 import base64
 import json
+import os
 from dataclasses import dataclass
 from typing import Any, Mapping
 
 import requests
 
+from crawler import fastjson
+
+AUTH_API_BASE = "https://notes-api.biji.com"
+
 
 @dataclass(frozen=True)
 class TokenBundle:
@@ -23,9 +28,9 @@ class TokenBundle:
         return now >= (int(self.access_token_expire_at) - int(refresh_before_seconds))
 
 
-def decode_jwt_exp(token: str) -> int | None:
+def decode_jwt_payload(token: str) -> dict[str, Any] | None:
     """
-    Decode JWT payload (no verification) and return exp if present.
+    Decode JWT payload (no verification).
     """
     try:
         parts = token.split(".")
@@ -34,12 +39,35 @@ def decode_jwt_exp(token: str) -> int | None:
         payload_b64 = parts[1].replace("-", "+").replace("_", "/")
         payload_b64 += "=" * (-len(payload_b64) % 4)
         payload = json.loads(base64.b64decode(payload_b64).decode("utf-8"))
+        return payload if isinstance(payload, dict) else None
+    except Exception:
+        return None
+
+
+def decode_jwt_exp(token: str) -> int | None:
+    """
+    Decode JWT payload (no verification) and return exp if present.
+    """
+    payload = decode_jwt_payload(token) or {}
+    try:
         exp = payload.get("exp")
         return int(exp) if exp is not None else None
     except Exception:
         return None
 
 
+def account_id_from_token(token: str, *, default: str = "default") -> str:
+    """
+    Best-effort stable account key taken from the access token's claims.
+    """
+    payload = decode_jwt_payload(token) or {}
+    for key in ("uid", "user_id", "userId", "sub", "id"):
+        value = payload.get(key)
+        if value not in (None, ""):
+            return str(value)
+    return default
+
+
 def mask_secret(value: str, *, head: int = 12, tail: int = 6) -> str:
     if not value:
         return ""
@@ -93,10 +121,10 @@ def refresh_access_token(
         headers["Authorization"] = f"Bearer {access_token}"
 
     resp = requests.post(
-        "https://notes-api.biji.com/account/v2/web/user/auth/refresh",
+        f"{os.getenv('BIJI_AUTH_API_BASE', '').strip().rstrip('/') or AUTH_API_BASE}/account/v2/web/user/auth/refresh",
         headers=headers,
         json={"refresh_token": refresh_token},
         timeout=timeout_seconds,
     )
     resp.raise_for_status()
-    return parse_refresh_response(resp.json())
+    return parse_refresh_response(fastjson.loads(resp.content))
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Mapping
+
+from crawler import metrics
+
+BLOBS = metrics.counter("biji_blobs_total", "Large bodies offloaded to the blob store, by result.")
+
+# Body fields that can grow to hundreds of KB, as paths into a stored document.
+BODY_FIELDS = (
+    ("raw", "content"),
+    ("raw", "body_text"),
+    ("raw", "json_content"),
+    ("content",),
+)
+DEFAULT_THRESHOLD = 16 * 1024
+
+
+class BlobStore:
+    """
+    Content-addressed bodies: each distinct body is zlib-compressed once into
+    `<root>/<sha256[:2]>/<sha256>.z`, so identical bodies share one file and
+    a rewrite of an unchanged body costs a `stat`.
+    """
+
+    def __init__(self, root: Path, *, level: int = 6):
+        self.root = root
+        self.level = level
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.z"
+
+    def __contains__(self, digest: str) -> bool:
+        return self._path(digest).exists()
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if path.exists():
+            BLOBS.inc(result="deduplicated")
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique per process and thread: several writers may store the same body at once.
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(zlib.compress(data, self.level))
+        os.replace(tmp, path)
+        BLOBS.inc(result="stored")
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return zlib.decompress(self._path(digest).read_bytes())
+
+
+def blob_store_from_env() -> BlobStore | None:
+    """
+    `BIJI_BLOB_DIR` enables offloading; bodies of at least
+    `BIJI_BLOB_THRESHOLD` bytes (default 16 KiB) go to the store.
+    """
+    root = os.getenv("BIJI_BLOB_DIR", "").strip()
+    return BlobStore(Path(root)) if root else None
+
+
+def blob_threshold_from_env() -> int:
+    return int(os.getenv("BIJI_BLOB_THRESHOLD", str(DEFAULT_THRESHOLD)))
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get("_blob"), str)
+
+
+def offload_bodies(doc: Mapping[str, Any], blobs: BlobStore, *, threshold: int = DEFAULT_THRESHOLD) -> Dict[str, Any]:
+    """
+    Copy of `doc` with every `BODY_FIELDS` string of at least `threshold`
+    UTF-8 bytes replaced by `{"_blob": <sha256>, "bytes": <size>}`.
+
+    The reference is ordinary document content, so the content fingerprint
+    still changes exactly when a body does.
+    """
+    out: Dict[str, Any] = dict(doc)
+    # Body fields live at the top level or under `raw`; copy that one level
+    # so the caller's document is left alone.
+    if isinstance(out.get("raw"), dict):
+        out["raw"] = dict(out["raw"])
+    for path in BODY_FIELDS:
+        parent: Any = out
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            continue
+        value = parent.get(path[-1])
+        # A str of n characters encodes to at most 4n bytes.
+        if not isinstance(value, str) or len(value) * 4 < threshold:
+            continue
+        data = value.encode("utf-8")
+        if len(data) >= threshold:
+            parent[path[-1]] = {"_blob": blobs.put(data), "bytes": len(data)}
+    return out
+
+
+def resolve_body(value: Any, blobs: BlobStore | None) -> Any:
+    """
+    The body a `BODY_FIELDS` value stands for: blob references are loaded
+    from `blobs`, anything else is returned as is.
+    """
+    if not is_blob_ref(value):
+        return value
+    if blobs is None:
+        raise RuntimeError(f"document references blob {value['_blob']} but no blob store was given (BIJI_BLOB_DIR)")
+    return blobs.get(value["_blob"]).decode("utf-8")
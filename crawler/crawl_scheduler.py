@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+# feapder pops smaller priorities first; its default is 300.
+NOTES_PRIORITY = 100
+DETAIL_PRIORITY = 300
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    prefetch_pages: int = 4
+    max_pending_details: int = 2000
+
+    @classmethod
+    def from_env(cls) -> "SchedulerConfig":
+        return cls(
+            prefetch_pages=max(1, int(os.getenv("BIJI_PAGE_PREFETCH", "4"))),
+            max_pending_details=max(1, int(os.getenv("BIJI_MAX_PENDING_DETAILS", "2000"))),
+        )
+
+
+class PaginationGate:
+    """
+    Bounds how far notes pagination may run ahead of detail fetches.
+
+    A page "is ahead" from the moment the gate lets its request out until
+    every detail it scheduled is done. The next-page request is issued only
+    while fewer than `prefetch_pages` pages are ahead and fewer than
+    `max_pending_details` details are outstanding; otherwise it is parked.
+    Every method that can make room hands back the parked requests that may
+    now be issued, one page at a time, each counted as ahead before the
+    next is considered. Thread-safe.
+    """
+
+    def __init__(self, config: SchedulerConfig):
+        self.config = config
+        self._remaining: Dict[str, int] = {}
+        self._pending = 0
+        self._parked: deque = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def pending_details(self) -> int:
+        return self._pending
+
+    @property
+    def pages_ahead(self) -> int:
+        return len(self._remaining)
+
+    @property
+    def parked(self) -> int:
+        return len(self._parked)
+
+    def _can_issue(self) -> bool:
+        return len(self._remaining) < self.config.prefetch_pages and self._pending < self.config.max_pending_details
+
+    def _release(self) -> List[Any]:
+        released = []
+        while self._parked and self._can_issue():
+            page_key, request = self._parked.popleft()
+            if page_key is not None:
+                self._remaining.setdefault(page_key, 0)
+            released.append(request)
+        return released
+
+    def _settle(self, page_key: str | None, delta: int) -> None:
+        if page_key is None or page_key not in self._remaining:
+            return
+        self._remaining[page_key] += delta
+        if self._remaining[page_key] <= 0:
+            del self._remaining[page_key]
+
+    def details_scheduled(self, page_key: str | None, count: int) -> List[Any]:
+        """
+        Record `count` detail fetches for the fetched page `page_key`;
+        replayed details that belong to no page pass None. A page that
+        scheduled none is no longer ahead. Returns the parked page requests
+        that may now be issued.
+        """
+        with self._lock:
+            self._pending += max(count, 0)
+            if page_key is not None:
+                self._remaining[page_key] = self._remaining.get(page_key, 0)
+                self._settle(page_key, count)
+            return self._release()
+
+    def offer_page(self, request: Any, page_key: str | None = None) -> List[Any]:
+        """
+        Park `request` (the page `page_key`) behind any earlier parked page
+        and return the page requests that may be issued now, which is empty
+        when `request` has to wait.
+        """
+        with self._lock:
+            self._parked.append((page_key, request))
+            return self._release()
+
+    def detail_finished(self, page_key: str | None) -> List[Any]:
+        """
+        Mark one detail fetch done (stored or given up on) and return the
+        parked page requests that may now be issued.
+        """
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+            self._settle(page_key, -1)
+            return self._release()
+
+    def page_failed(self, page_key: str | None) -> List[Any]:
+        """
+        The page request for `page_key` was given up on; it is no longer
+        ahead. Returns the parked page requests that may now be issued.
+        """
+        with self._lock:
+            self._remaining.pop(page_key, None)
+            return self._release()
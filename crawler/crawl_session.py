@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Sequence
+
+from feapder.utils.log import log
+
+from crawler import metrics
+from crawler.biji_detail_logic import LinkDetail
+from crawler.biji_notes_logic import NotesPage
+from crawler.detail_index import DetailVersionIndex, note_version
+from crawler.rate_limit import AdaptiveLimiter
+from crawler.response_cache import DetailResponseCache
+from crawler.sync_state import CrawlCursor, SyncStateStore, Watermark, advance_watermark, is_covered, page_is_covered
+
+if TYPE_CHECKING:
+    from crawler.storage import NoteStore
+
+PAGES = metrics.counter("biji_pages_total", "Notes pages fetched, by sort pass.")
+NOTES = metrics.counter("biji_notes_total", "Notes handed to the pipelines.")
+DETAILS = metrics.counter("biji_details_total", "Link details handed to the pipelines.")
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip() not in ("0", "false", "False")
+
+
+@dataclass(frozen=True)
+class CrawlOptions:
+    limit: int = 100
+    sort: str = "create_desc"
+    since_id: str = ""
+    fetch_detail: bool = True
+    incremental: bool = False
+    checkpoint: bool = True
+    detail_conditional: bool = True
+
+    @classmethod
+    def from_env(cls) -> "CrawlOptions":
+        return cls(
+            limit=int(os.getenv("BIJI_LIMIT", "100")),
+            sort=os.getenv("BIJI_SORT", "create_desc"),
+            since_id=os.getenv("BIJI_SINCE_ID", ""),
+            fetch_detail=env_flag("BIJI_FETCH_DETAIL", "1"),
+            incremental=env_flag("BIJI_INCREMENTAL", "0"),
+            checkpoint=env_flag("BIJI_CHECKPOINT", "1"),
+            detail_conditional=env_flag("BIJI_DETAIL_CONDITIONAL", "1"),
+        )
+
+
+@dataclass(frozen=True)
+class PageOutcome:
+    """
+    What a crawl engine should do with one fetched notes page.
+
+    `details` lists `(note_id, version)` pairs to fetch; `next_since_id` is
+    None once the sort pass is finished.
+    """
+
+    sort: str
+    notes: Sequence[Mapping[str, Any]]
+    details: Sequence[tuple[str, str]]
+    next_since_id: str | None
+    skipped_details: int = 0
+
+
+def log_limits(limiter: AdaptiveLimiter, reason: str) -> None:
+    log.info(
+        "rate limit adjusted: endpoint=%s concurrency=%s rate=%.2f/s in_flight=%s reason=%s",
+        limiter.config.name,
+        limiter.concurrency,
+        limiter.rate,
+        limiter.in_flight,
+        reason,
+    )
+
+
+def log_cache_stats(cache: DetailResponseCache) -> None:
+    stats = cache.stats
+    log.info(
+        "detail cache: hits=%s misses=%s expired=%s stores=%s evictions=%s hit_ratio=%.2f entries=%s size_mb=%.1f",
+        stats.hits,
+        stats.misses,
+        stats.expired,
+        stats.stores,
+        stats.evictions,
+        stats.hit_ratio,
+        len(cache),
+        cache.total_bytes / (1 << 20),
+    )
+
+
+def note_item(note: Mapping[str, Any]) -> Dict[str, Any]:
+    return {"kind": "note", "note_id": note.get("id") or note.get("note_id"), "raw": note}
+
+
+def detail_item(note_id: str, detail: LinkDetail, version: str) -> Dict[str, Any]:
+    return {
+        "kind": "link_detail",
+        "note_id": note_id,
+        "title": detail.title,
+        "web_title": detail.web_title,
+        "url": detail.url,
+        "has_content": detail.has_content,
+        "source_version": version,
+        "raw": detail.raw,
+    }
+
+
+class CrawlSession:
+    """
+    Engine-neutral bookkeeping for one crawl run: sort-pass cursors,
+    incremental watermark, conditional detail fetches and checkpoints.
+
+    Both the feapder spider and the asyncio engine drive it: `start()` says
+    where to begin, `handle_page()`/`page_done()` wrap each notes page,
+    `detail_done()` each stored detail, `storage_failed()` reports lost
+    items, and `finish()` persists state. Methods are thread-safe.
+    """
+
+    def __init__(
+        self,
+        options: CrawlOptions,
+        *,
+        account_id: str,
+        resume: bool = False,
+        state_store: SyncStateStore | None = None,
+        store: NoteStore | None = None,
+    ):
+        self.options = options
+        self.account_id = account_id
+        self._resume = resume
+        self._state_store_obj = state_store
+        self._store = store
+
+        self._watermark: Watermark | None = None
+        self._next_watermark: Watermark | None = None
+        # sort -> since_id of the next page to fetch; None once the pass is done.
+        self._pass_cursors: dict[str, str | None] = {}
+        # note_id -> version of details scheduled but not yet stored.
+        self._pending_details: dict[str, str] = {}
+        self._scheduled_details: set[str] = set()
+        self._detail_index: DetailVersionIndex | None = None
+        self._detail_skipped = 0
+        self._storage_failed = False
+        self._last_checkpoint_at = 0.0
+        self._lock = threading.Lock()
+
+    def _state_store(self) -> SyncStateStore:
+        if self._state_store_obj is None:
+            from crawler.mongita_io import open_mongita_from_env
+
+            self._state_store_obj = SyncStateStore(open_mongita_from_env().misc)
+        return self._state_store_obj
+
+    @property
+    def pending_details(self) -> int:
+        return len(self._pending_details)
+
+    def start(self) -> tuple[dict[str, str], list[tuple[str, str]]]:
+        """
+        Returns `({sort: since_id}, [(note_id, version), ...])`: the notes
+        pages to start from and the detail fetches to replay.
+        """
+        options = self.options
+        if options.fetch_detail and options.detail_conditional:
+            store = self._store
+            if store is None:
+                from crawler.storage import open_store_from_env
+
+                store = open_store_from_env()
+            try:
+                self._detail_index = DetailVersionIndex(store.detail_versions())
+            finally:
+                if self._store is None:
+                    store.close()
+            log.info("detail version index loaded: entries=%s", len(self._detail_index))
+
+        cursor = self._state_store().load_cursor(self.account_id) if self._resume else None
+        if self._resume and cursor is None:
+            log.info("no crawl checkpoint found for account=%s, starting from scratch", self.account_id)
+
+        if options.incremental:
+            self._watermark = self._state_store().load_watermark(self.account_id)
+            self._next_watermark = self._watermark
+
+        if cursor is not None:
+            if cursor.watermark is not None:
+                self._next_watermark = cursor.watermark
+            self._pass_cursors = dict(cursor.since_ids)
+            self._pending_details = dict(cursor.pending_details)
+            self._scheduled_details = set(self._pending_details)
+            log.info(
+                "resuming crawl: account=%s since_ids=%s pending_details=%s",
+                self.account_id,
+                self._pass_cursors,
+                len(self._pending_details),
+            )
+        elif options.incremental:
+            # Without a watermark the create_desc pass is a full crawl, so an
+            # update_desc pass would only repeat it.
+            passes = ["create_desc", "update_desc"] if self._watermark else ["create_desc"]
+            self._pass_cursors = {sort: "" for sort in passes}
+            log.info("incremental sync: account=%s watermark=%s passes=%s", self.account_id, self._watermark, passes)
+        else:
+            self._pass_cursors = {options.sort: options.since_id}
+
+        starts = {sort: since_id for sort, since_id in self._pass_cursors.items() if since_id is not None}
+        return starts, sorted(self._pending_details.items())
+
+    def handle_page(self, *, sort: str, since_id: str, page: NotesPage) -> PageOutcome:
+        options = self.options
+        notes = page.notes
+        should_continue = page.should_continue
+        if options.incremental:
+            notes = [n for n in page.notes if not (self._watermark and is_covered(n, self._watermark, sort=sort))]
+            if page_is_covered(page.notes, self._watermark, sort=sort):
+                should_continue = False
+            with self._lock:
+                self._next_watermark = advance_watermark(self._next_watermark, notes)
+
+        PAGES.inc(sort=sort)
+        NOTES.inc(len(notes))
+        log.info(
+            "notes page fetched: count=%s limit=%s since_id=%s next_since_id=%s should_continue=%s",
+            len(page.notes),
+            options.limit,
+            since_id,
+            page.next_since_id,
+            should_continue,
+        )
+        if options.incremental:
+            log.info("incremental sync: sort=%s new_or_changed=%s skipped=%s", sort, len(notes), len(page.notes) - len(notes))
+
+        details: list[tuple[str, str]] = []
+        skipped = 0
+        if options.fetch_detail:
+            for note in notes:
+                note_id = str(note.get("id") or note.get("note_id") or "")
+                if not note_id or note.get("note_type") != "link":
+                    continue
+                version = note_version(note)
+                if self._detail_index is not None and self._detail_index.is_current(note_id, version):
+                    skipped += 1
+                    continue
+                with self._lock:
+                    # Both incremental passes can list the same new note.
+                    if note_id in self._scheduled_details:
+                        continue
+                    self._scheduled_details.add(note_id)
+                    self._pending_details[note_id] = version
+                details.append((note_id, version))
+            with self._lock:
+                self._detail_skipped += skipped
+            log.info("notes page detail scheduled: link_notes=%s skipped_unchanged=%s", len(details), skipped)
+
+        return PageOutcome(
+            sort=sort,
+            notes=notes,
+            details=details,
+            next_since_id=(page.next_since_id or "") if should_continue else None,
+            skipped_details=skipped,
+        )
+
+    def page_done(self, outcome: PageOutcome) -> None:
+        """
+        Call once the page's note items are stored by the pipelines (not
+        merely buffered); moves the cursor past the page and checkpoints it.
+        After `storage_failed()` the cursor stays where it is.
+        """
+        with self._lock:
+            if self._storage_failed:
+                return
+            self._pass_cursors[outcome.sort] = outcome.next_since_id
+        self.save_checkpoint(force=True)
+
+    def detail_done(self, note_id: str, version: str) -> None:
+        """
+        Call once the detail's item is stored; until then it stays pending
+        in the checkpoint.
+        """
+        DETAILS.inc()
+        if self._detail_index is not None:
+            self._detail_index.record(note_id, version)
+        with self._lock:
+            self._pending_details.pop(note_id, None)
+        self.save_checkpoint()
+
+    def detail_abandoned(self, note_id: str) -> None:
+        """
+        The detail exhausted its retries and went to the dead-letter queue;
+        stop tracking it so the checkpoint does not replay it forever.
+        """
+        with self._lock:
+            self._pending_details.pop(note_id, None)
+        self.save_checkpoint()
+
+    def storage_failed(self) -> None:
+        """
+        A pipeline gave up on a batch, so items handed over before the pages
+        completed since may be missing. The cursor stops moving, and
+        `finish()` keeps the checkpoint and the old watermark so a resume
+        fetches those pages again.
+        """
+        with self._lock:
+            if self._storage_failed:
+                return
+            self._storage_failed = True
+        log.error("items were lost by a pipeline, checkpoint frozen: account=%s", self.account_id)
+
+    def save_checkpoint(self, *, force: bool = False) -> None:
+        """
+        Persist the pagination cursor and outstanding detail fetches. Detail
+        completions only flush every few seconds; page boundaries always do.
+        """
+        if not self.options.checkpoint:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_checkpoint_at < 5:
+                return
+            self._last_checkpoint_at = now
+            cursor = CrawlCursor(
+                since_ids=dict(self._pass_cursors),
+                pending_details=tuple(self._pending_details.items()),
+                watermark=self._next_watermark,
+            )
+        self._state_store().save_cursor(self.account_id, cursor)
+
+    def finish(self) -> None:
+        with self._lock:
+            pending_passes = sorted(sort for sort, since_id in self._pass_cursors.items() if since_id is not None)
+            pending_details = len(self._pending_details)
+            storage_failed = self._storage_failed
+
+        if self._detail_index is not None:
+            log.info("detail fetches skipped for unchanged notes: %s", self._detail_skipped)
+
+        if self.options.checkpoint:
+            if pending_passes or pending_details or storage_failed:
+                self.save_checkpoint(force=True)
+                log.warning(
+                    "crawl incomplete, checkpoint kept for --resume: pending_passes=%s pending_details=%s storage_failed=%s",
+                    pending_passes,
+                    pending_details,
+                    storage_failed,
+                )
+            else:
+                self._state_store().clear_cursor(self.account_id)
+
+        if not self.options.incremental:
+            return
+        if pending_passes or storage_failed:
+            log.warning(
+                "incremental sync incomplete, watermark not advanced: pending_passes=%s storage_failed=%s",
+                pending_passes,
+                storage_failed,
+            )
+            return
+        if self._next_watermark and self._next_watermark != self._watermark:
+            self._state_store().save_watermark(self.account_id, self._next_watermark)
+            log.info("incremental sync watermark saved: %s", self._next_watermark)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List
+
+from crawler import metrics
+
+DEAD_LETTERS = metrics.counter("biji_dead_letters_total", "Fetches that exhausted their retries, by endpoint.")
+
+
+class DeadLetterStore:
+    """
+    Fetches that exhausted their retry budget, keyed by endpoint and note id
+    in a Mongita collection, so `--replay-dead-letters` can re-drive just
+    those ids.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(endpoint: str, note_id: str) -> str:
+        return f"{endpoint}:{note_id}"
+
+    def record(
+        self,
+        *,
+        endpoint: str,
+        note_id: str,
+        error: str,
+        attempts: int,
+        account: str = "",
+        version: str = "",
+    ) -> None:
+        DEAD_LETTERS.inc(endpoint=endpoint)
+        key = self._key(endpoint, note_id)
+        now = int(time.time())
+        values = {
+            "endpoint": endpoint,
+            "note_id": note_id,
+            "account": account,
+            "version": version,
+            "error": error[:2000],
+            "attempts": attempts,
+            "last_failed_at": now,
+        }
+        with self._lock:
+            existing = self._collection.find_one({"_id": key})
+            if existing is None:
+                self._collection.insert_one({"_id": key, **values, "failures": 1, "first_failed_at": now})
+            else:
+                values["failures"] = int(existing.get("failures") or 0) + 1
+                self._collection.update_one({"_id": key}, {"$set": values})
+
+    def resolve(self, endpoint: str, note_id: str) -> None:
+        with self._lock:
+            self._collection.delete_one({"_id": self._key(endpoint, note_id)})
+
+    def list(self, endpoint: str = "detail", *, account: str | None = None) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"endpoint": endpoint}
+        if account is not None:
+            query["account"] = account
+        return sorted(self._collection.find(query), key=lambda d: str(d.get("note_id")))
+
+
+def dead_letter_store_from_env() -> DeadLetterStore:
+    from crawler.mongita_io import open_mongita_from_env
+
+    return DeadLetterStore(open_mongita_from_env().dead_letters)
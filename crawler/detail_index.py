@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from typing import Any, Mapping
+
+
+def note_version(note: Mapping[str, Any]) -> str:
+    """
+    Version tag of a listed note: its `updated_at`, or a content fingerprint
+    when the API omits it.
+    """
+    updated_at = str(note.get("updated_at") or "")
+    if updated_at:
+        return updated_at
+    encoded = json.dumps(note, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return "sha1:" + hashlib.sha1(encoded).hexdigest()
+
+
+class DetailVersionIndex:
+    """
+    In-memory `note_id -> source_version` map of the stored link details, used
+    to skip detail fetches for notes that have not changed since.
+    """
+
+    def __init__(self, versions: Mapping[str, str] | None = None):
+        self._versions: dict[str, str] = dict(versions or {})
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def is_current(self, note_id: str, version: str) -> bool:
+        return bool(version) and self._versions.get(note_id) == version
+
+    def record(self, note_id: str, version: str) -> None:
+        if not (note_id and version):
+            return
+        with self._lock:
+            self._versions[note_id] = version
@@ -0,0 +1,60 @@
+"""
+JSON backend for the hot paths: list pages, link details, token responses,
+JSONL items and migration.
+
+Uses orjson when it is installed (`pip install get-biji-export[fast]`) and
+the stdlib `json` module otherwise; `BIJI_JSON_BACKEND=json` forces the
+stdlib. Both backends emit UTF-8 without ASCII escaping.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+if os.getenv("BIJI_JSON_BACKEND", "").strip().lower() == "json":
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: bytes | bytearray | memoryview | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Integers beyond 64 bits, non-str keys, ...: let the stdlib handle them.
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def dumps_canonical(obj: Any) -> bytes:
+    """
+    Compact JSON with sorted keys, for hashing. Both backends produce the
+    same bytes for the values the API returns.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps_line(obj: Any) -> bytes:
+    """
+    One JSONL record, newline included.
+    """
+    return dumps(obj) + b"\n"
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import heapq
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping
+
+from feapder.utils.log import log
+
+from crawler import fastjson, metrics
+from crawler.blob_store import BlobStore, blob_threshold_from_env, offload_bodies
+from crawler.mongita_io import UpsertCounts
+from crawler.storage import NoteStore
+
+MIGRATED = metrics.counter("biji_migrate_records_total", "JSONL records migrated, by kind.")
+SPILLS = metrics.counter("biji_migrate_spills_total", "Sorted runs the compacting migration spilled to disk.")
+
+DEFAULT_MAX_RECORDS = 200_000
+DEFAULT_CHECKPOINT_LINES = 1_000_000
+DEFAULT_BATCH_SIZE = 5000
+PROGRESS_SECONDS = 5.0
+
+
+def classify(obj: Dict[str, Any]) -> tuple[str, str, Dict[str, Any]]:
+    """
+    `(table, key, doc)` for one JSONL record: `notes` / `details` keyed by
+    note id, anything else `misc` with an empty key. Link details are
+    stored with `kind: "details"`, as the migration always did.
+    """
+    kind = obj.get("kind")
+    note_id = obj.get("note_id")
+    if kind == "note" and note_id:
+        return "notes", str(note_id), obj
+    if kind == "link_detail" and note_id:
+        obj = dict(obj)
+        obj["kind"] = "details"
+        return "details", str(note_id), obj
+    return "misc", "", obj
+
+
+def _read_run(path: Path) -> Iterator[list]:
+    with path.open("rb") as f:
+        for line in f:
+            yield fastjson.loads(line)
+
+
+def _run_key(record: list) -> tuple[str, str]:
+    return record[0], record[1]
+
+
+class CompactingMigration:
+    """
+    Last-write-wins compaction of JSONL records before they reach the store.
+
+    `add` merges each note/detail into the pending version for its
+    `(table, note_id)` with `dict.update`, which is what a sequence of
+    upserts would have left behind, so a note appended by a hundred runs is
+    written once. Once `max_records` are pending (or every
+    `checkpoint_lines` lines) the pending records are spilled to a sorted
+    run in `work_dir` and the read position is checkpointed next to it;
+    `finish` merges the runs, oldest first, with what is still in memory
+    and upserts the survivors in batches of `batch_size`.
+
+    A migration interrupted before `finish` resumes from the checkpoint
+    with `load_checkpoint`; `work_dir` is removed once `finish` completes.
+    """
+
+    def __init__(
+        self,
+        store: NoteStore,
+        work_dir: Path,
+        *,
+        max_records: int = DEFAULT_MAX_RECORDS,
+        checkpoint_lines: int = DEFAULT_CHECKPOINT_LINES,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        blobs: BlobStore | None = None,
+        blob_threshold: int | None = None,
+    ):
+        self.store = store
+        self.work_dir = work_dir
+        self.max_records = max_records
+        self.checkpoint_lines = checkpoint_lines
+        self.batch_size = batch_size
+        self.blobs = blobs
+        self.blob_threshold = blob_threshold_from_env() if blob_threshold is None else blob_threshold
+
+        self.pending: Dict[tuple[str, str], Dict[str, Any]] = {}
+        self.misc: List[Dict[str, Any]] = []
+        self.runs: List[str] = []
+        self.position: tuple[str, int] | None = None
+        self.read = {"notes": 0, "details": 0, "misc": 0}
+        self.lines = 0
+        self._counted = dict(self.read)
+        self._lines_since_spill = 0
+        self._started = time.monotonic()
+        self._session_lines = 0
+        self._last_progress = self._started
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.work_dir / "checkpoint.json"
+
+    def load_checkpoint(self) -> bool:
+        """
+        Restore the position, runs and counters of an interrupted migration;
+        False when `work_dir` holds no checkpoint.
+        """
+        if not self.checkpoint_path.exists():
+            return False
+        state = fastjson.loads(self.checkpoint_path.read_bytes())
+        self.position = tuple(state["position"]) if state.get("position") else None
+        self.runs = list(state["runs"])
+        self.read = dict(state["read"])
+        self.lines = int(state["lines"])
+        self._counted = dict(self.read)
+        log.info("resuming migration at %s after %s lines (%s runs)", self.position, self.lines, len(self.runs))
+        return True
+
+    def add(self, table: str, key: str, doc: Dict[str, Any], position: tuple[str, int] | None = None) -> None:
+        if table == "misc":
+            self.misc.append(doc)
+        else:
+            current = self.pending.get((table, key))
+            if current is None:
+                self.pending[(table, key)] = doc
+            else:
+                current.update(doc)
+        self.read[table] += 1
+        if position is not None:
+            self.position = position
+        self.lines += 1
+        self._session_lines += 1
+        self._lines_since_spill += 1
+        if len(self.pending) + len(self.misc) >= self.max_records or self._lines_since_spill >= self.checkpoint_lines:
+            self.spill()
+        if not self._session_lines & 0x3FFF:
+            self._log_progress()
+
+    def add_chunk(self, records: Iterable[tuple[str, str, Dict[str, Any]]], read: Mapping[str, int], position: tuple[str, int]) -> None:
+        """
+        `add` for a chunk parsed elsewhere (`crawler.jsonl_parallel`):
+        `records` in file order, possibly already compacted within the chunk,
+        `read` the records per table it stood for, `position` its end.
+        """
+        for table, key, doc in records:
+            if table == "misc":
+                self.misc.append(doc)
+                continue
+            current = self.pending.get((table, key))
+            if current is None:
+                self.pending[(table, key)] = doc
+            else:
+                current.update(doc)
+        lines = sum(read.values())
+        for table, n in read.items():
+            self.read[table] += n
+        self.position = position
+        self.lines += lines
+        self._session_lines += lines
+        self._lines_since_spill += lines
+        if len(self.pending) + len(self.misc) >= self.max_records or self._lines_since_spill >= self.checkpoint_lines:
+            self.spill()
+        self._log_progress()
+
+    def _count_read(self) -> None:
+        # Published per spill: a labelled inc per record costs as much as the compaction itself.
+        for table, kind in (("notes", "note"), ("details", "link_detail"), ("misc", "misc")):
+            MIGRATED.inc(self.read[table] - self._counted[table], kind=kind)
+        self._counted = dict(self.read)
+
+    def _log_progress(self, *, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_SECONDS:
+            return
+        self._last_progress = now
+        rate = self._session_lines / max(now - self._started, 1e-9)
+        log.info(
+            "migrate: %s lines read (%.0f lines/s), %s pending, %s runs",
+            self.lines,
+            rate,
+            len(self.pending) + len(self.misc),
+            len(self.runs),
+        )
+
+    def spill(self) -> None:
+        """
+        Write the pending records to a new sorted run and checkpoint the
+        read position they cover.
+        """
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self._count_read()
+        if self.pending or self.misc:
+            name = f"run-{len(self.runs) + 1:06d}.jsonl"
+            tmp = self.work_dir / f"{name}.tmp"
+            with tmp.open("wb") as f:
+                for (table, key), doc in sorted(self.pending.items(), key=lambda kv: kv[0]):
+                    f.write(fastjson.dumps([table, key, doc]) + b"\n")
+                # Misc records have no key: they follow the sorted part in read order.
+                for doc in self.misc:
+                    f.write(fastjson.dumps(["misc", "", doc]) + b"\n")
+            os.replace(tmp, self.work_dir / name)
+            self.runs.append(name)
+            SPILLS.inc()
+        self.pending = {}
+        self.misc = []
+        self._lines_since_spill = 0
+        state = {"position": self.position, "runs": self.runs, "read": self.read, "lines": self.lines}
+        tmp = self.checkpoint_path.with_name("checkpoint.json.tmp")
+        tmp.write_bytes(fastjson.dumps(state))
+        os.replace(tmp, self.checkpoint_path)
+
+    def _sorted_sources(self) -> List[Iterable[list]]:
+        sources: List[Iterable[list]] = [
+            (r for r in _read_run(self.work_dir / name) if r[0] != "misc") for name in self.runs
+        ]
+        sources.append([table, key, doc] for (table, key), doc in sorted(self.pending.items(), key=lambda kv: kv[0]))
+        return sources
+
+    def _misc_docs(self) -> Iterator[Dict[str, Any]]:
+        for name in self.runs:
+            for table, _, doc in _read_run(self.work_dir / name):
+                if table == "misc":
+                    yield doc
+        yield from self.misc
+
+    def finish(self) -> Mapping[str, UpsertCounts]:
+        """
+        Upsert the surviving version of every note/detail and insert the
+        misc records; returns the upsert counts per table.
+        """
+        self._log_progress(force=True)
+        self._count_read()
+        counts = {"notes": UpsertCounts(), "details": UpsertCounts()}
+        writers = {"notes": self.store.upsert_notes, "details": self.store.upsert_details}
+        batches: Dict[str, List[Dict[str, Any]]] = {"notes": [], "details": []}
+
+        def emit(table: str, doc: Dict[str, Any]) -> None:
+            if self.blobs is not None:
+                doc = offload_bodies(doc, self.blobs, threshold=self.blob_threshold)
+            batch = batches[table]
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                counts[table].add(writers[table](batch))
+                batch.clear()
+
+        # heapq.merge is stable, so versions of one key arrive oldest run first.
+        current: tuple[str, str] | None = None
+        merged: Dict[str, Any] = {}
+        for table, key, doc in heapq.merge(*self._sorted_sources(), key=_run_key):
+            if (table, key) == current:
+                merged.update(doc)
+                continue
+            if current is not None:
+                emit(current[0], merged)
+            current, merged = (table, key), doc
+        if current is not None:
+            emit(current[0], merged)
+        for table, batch in batches.items():
+            if batch:
+                counts[table].add(writers[table](batch))
+
+        misc: List[Dict[str, Any]] = []
+        for doc in self._misc_docs():
+            misc.append(doc)
+            if len(misc) >= self.batch_size:
+                self.store.insert_misc(misc)
+                misc = []
+        if misc:
+            self.store.insert_misc(misc)
+
+        elapsed = time.monotonic() - self._started
+        log.info(
+            "migrate: %s lines in %.1fs (%.0f lines/s), %s notes and %s details after compaction",
+            self.lines,
+            elapsed,
+            self._session_lines / max(elapsed, 1e-9),
+            counts["notes"].inserted + counts["notes"].updated + counts["notes"].unchanged,
+            counts["details"].inserted + counts["details"].updated + counts["details"].unchanged,
+        )
+        self.pending = {}
+        self.misc = []
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return counts
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import gc
+import io
+import mmap
+import os
+import pickle
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List
+
+from feapder.utils.log import log
+
+from crawler import fastjson
+from crawler.jsonl_migration import classify
+from crawler.jsonl_segments import TRUNCATED_ERRORS, jsonl_sources, open_segment, skip_bytes
+
+DEFAULT_CHUNK_BYTES = 32 << 20
+
+
+@dataclass(frozen=True)
+class JsonlChunk:
+    """
+    A newline-aligned byte range `[start, end)` of one JSONL file. Compressed
+    segments cannot be split and are always one chunk, read to the end
+    (`end` is None).
+    """
+
+    path: Path
+    start: int
+    end: int | None
+
+
+@dataclass
+class ParsedChunk:
+    """
+    What a worker made of one `JsonlChunk`.
+
+    `records` holds `(table, key, doc)` per line in file order, or with
+    `compact` one merged version per `(table, key)` followed by the misc
+    records in order. `end` is the offset after the last complete line, the
+    position a migration checkpoints.
+    """
+
+    name: str
+    end: int
+    read: Dict[str, int] = field(default_factory=lambda: {"notes": 0, "details": 0, "misc": 0})
+    records: List[tuple[str, str, Dict[str, Any]]] = field(default_factory=list)
+
+
+def plan_chunks(
+    path: Path, *, chunk_bytes: int = DEFAULT_CHUNK_BYTES, start: tuple[str, int] | None = None
+) -> List[JsonlChunk]:
+    """
+    Chunks covering every file in `jsonl_sources(path)`, in order, from the
+    position `start` (see `iter_jsonl_positions`) on. Plain files are split
+    every `chunk_bytes`, each boundary moved forward to just after a newline.
+    """
+    sources = jsonl_sources(path)
+    if start is not None:
+        names = [source.name for source in sources]
+        if start[0] not in names:
+            raise RuntimeError(f"cannot resume {path}: {start[0]} is not one of its files")
+        sources = sources[names.index(start[0]) :]
+    chunks: List[JsonlChunk] = []
+    for source in sources:
+        offset = start[1] if start is not None and source.name == start[0] else 0
+        if source.suffix in (".gz", ".zst"):
+            chunks.append(JsonlChunk(source, offset, None))
+            continue
+        size = source.stat().st_size
+        with source.open("rb") as f:
+            while offset < size:
+                # Past the target, up to and including the next newline.
+                f.seek(min(offset + chunk_bytes, size))
+                f.readline()
+                chunks.append(JsonlChunk(source, offset, f.tell()))
+                offset = f.tell()
+    return chunks
+
+
+def _chunk_lines(chunk: JsonlChunk, use_mmap: bool) -> Iterator[bytes]:
+    if chunk.end is None:
+        with open_segment(chunk.path) as f:
+            skip_bytes(f, chunk.start)
+            try:
+                yield from f
+            except TRUNCATED_ERRORS as e:
+                log.warning("jsonl segment is truncated: %s (%s)", chunk.path, e)
+        return
+    with chunk.path.open("rb") as f:
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[chunk.start : chunk.end]
+        else:
+            f.seek(chunk.start)
+            data = f.read(chunk.end - chunk.start)
+    # Not `splitlines`: that would also split on a bare "\r".
+    yield from io.BytesIO(data)
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    # Decoded JSON holds no reference cycles; collecting while a chunk's
+    # dicts pile up only rescans them, and more than doubles the decode time.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def parse_chunk(chunk: JsonlChunk, *, compact: bool = False, use_mmap: bool = True) -> ParsedChunk:
+    """
+    Decode and `classify` every line of `chunk`; with `compact`, versions of
+    the same note/detail are merged last-write-wins inside the chunk so less
+    crosses back to the parent process. Runs in a worker process.
+    """
+    parsed = ParsedChunk(chunk.path.name, chunk.start)
+    merged: Dict[tuple[str, str], Dict[str, Any]] = {}
+    misc: List[tuple[str, str, Dict[str, Any]]] = []
+    for line in _chunk_lines(chunk, use_mmap):
+        if not line.endswith(b"\n"):
+            log.warning("dropping incomplete last line of %s", chunk.path)
+            break
+        parsed.end += len(line)
+        if not line.strip():
+            continue
+        table, key, doc = classify(fastjson.loads(line))
+        parsed.read[table] += 1
+        if not compact:
+            parsed.records.append((table, key, doc))
+        elif table == "misc":
+            misc.append((table, key, doc))
+        elif (table, key) in merged:
+            merged[(table, key)].update(doc)
+        else:
+            merged[(table, key)] = doc
+    if compact:
+        parsed.records = [(table, key, doc) for (table, key), doc in merged.items()] + misc
+    return parsed
+
+
+def _parse_chunk_pickled(chunk: JsonlChunk, compact: bool, use_mmap: bool) -> bytes:
+    # Pickled here so the parent unpickles under `_gc_paused` rather than in
+    # the executor's result thread.
+    with _gc_paused():
+        return pickle.dumps(parse_chunk(chunk, compact=compact, use_mmap=use_mmap), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def iter_parsed_chunks(
+    path: Path,
+    *,
+    workers: int | None = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    start: tuple[str, int] | None = None,
+    compact: bool = False,
+    use_mmap: bool = True,
+) -> Iterator[ParsedChunk]:
+    """
+    `parse_chunk` over `plan_chunks(path)` in a pool of `workers` processes
+    (default: one per CPU), yielded in file order so a single writer sees
+    records exactly as a serial read would. At most two chunks per worker
+    are in flight, which bounds memory on multi-GB files.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = deque(plan_chunks(path, chunk_bytes=chunk_bytes, start=start))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight: Deque[Future] = deque()
+        while chunks or in_flight:
+            while chunks and len(in_flight) < 2 * workers:
+                in_flight.append(pool.submit(_parse_chunk_pickled, chunks.popleft(), compact, use_mmap))
+            data = in_flight.popleft().result()
+            with _gc_paused():
+                parsed = pickle.loads(data)
+            del data
+            yield parsed
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import gzip
+import io
+import os
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List
+
+from feapder.utils.log import log
+
+from crawler import fastjson, metrics
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+SEGMENTS = metrics.counter("biji_jsonl_segments_total", "JSONL segments closed, by compression.")
+WRITTEN_BYTES = metrics.counter("biji_jsonl_bytes_total", "JSONL bytes written, before compression.")
+
+SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+FSYNC_POLICIES = ("never", "rotate", "batch")
+
+# What reading a segment cut short by a crash raises.
+TRUNCATED_ERRORS: tuple = (EOFError, zlib.error, gzip.BadGzipFile)
+if zstandard is not None:
+    TRUNCATED_ERRORS += (zstandard.ZstdError,)
+
+
+@dataclass(frozen=True)
+class SegmentPolicy:
+    """
+    How a JSONL sink is laid out on disk.
+
+    - `compression`: `none`, `gzip` or `zstd` (needs `zstandard`)
+    - `rotate_bytes` / `rotate_seconds`: start a new segment once the current
+      one holds this many uncompressed bytes / is this old (`0` = never)
+    - `fsync`: `never`, `rotate` (when a segment is closed), `batch` (after
+      every write) or a number of seconds between fsyncs
+    - `level`: compression level; defaults to 3 for both codecs, which
+      keeps gzip several times faster than its own default of 6
+
+    With no compression and no rotation the sink is the single plain file
+    the pipeline always wrote.
+    """
+
+    compression: str = "none"
+    rotate_bytes: int = 0
+    rotate_seconds: float = 0
+    fsync: str = "rotate"
+    level: int | None = None
+    buffer_size: int = 1 << 20
+
+    def __post_init__(self):
+        if self.compression not in SUFFIXES:
+            raise ValueError(f"unknown compression: {self.compression!r} (expected one of {', '.join(SUFFIXES)})")
+        if self.compression == "zstd" and zstandard is None:
+            raise RuntimeError('zstd compression needs the zstandard package: pip install -e ".[zstd]"')
+        if self.fsync not in FSYNC_POLICIES:
+            try:
+                float(self.fsync)
+            except ValueError:
+                raise ValueError(f"unknown fsync policy: {self.fsync!r}") from None
+
+    @property
+    def segmented(self) -> bool:
+        return self.compression != "none" or bool(self.rotate_bytes) or bool(self.rotate_seconds)
+
+
+def segment_policy_from_env() -> SegmentPolicy:
+    """
+    `BIJI_EXPORT_COMPRESSION`, `BIJI_EXPORT_ROTATE_MB`,
+    `BIJI_EXPORT_ROTATE_SECONDS`, `BIJI_EXPORT_FSYNC` and
+    `BIJI_EXPORT_COMPRESSION_LEVEL`.
+    """
+    level = os.getenv("BIJI_EXPORT_COMPRESSION_LEVEL", "").strip()
+    return SegmentPolicy(
+        compression=os.getenv("BIJI_EXPORT_COMPRESSION", "none").strip().lower() or "none",
+        rotate_bytes=int(float(os.getenv("BIJI_EXPORT_ROTATE_MB", "0")) * (1 << 20)),
+        rotate_seconds=float(os.getenv("BIJI_EXPORT_ROTATE_SECONDS", "0")),
+        fsync=os.getenv("BIJI_EXPORT_FSYNC", "rotate").strip().lower() or "rotate",
+        level=int(level) if level else None,
+    )
+
+
+def index_path(path: Path) -> Path:
+    return path.with_name(path.name + ".index.json")
+
+
+def _segment_re(path: Path) -> re.Pattern:
+    return re.compile(rf"{re.escape(path.stem)}\.(\d{{6,}}){re.escape(path.suffix)}(\.gz|\.zst)?")
+
+
+def read_segment_index(path: Path) -> List[Dict[str, Any]]:
+    """
+    Segment entries recorded for the sink at `path`, oldest first.
+    """
+    index = index_path(path)
+    if not index.exists():
+        return []
+    return list(fastjson.loads(index.read_bytes()).get("segments") or [])
+
+
+def _write_segment_index(path: Path, segments: List[Dict[str, Any]]) -> None:
+    index = index_path(path)
+    tmp = index.with_name(index.name + ".tmp")
+    tmp.write_bytes(fastjson.dumps({"segments": segments}))
+    os.replace(tmp, index)
+
+
+class JsonlSegmentWriter:
+    """
+    A long-lived, buffered JSONL sink.
+
+    Unsegmented, it appends to `path`. Segmented, records go to
+    `<stem>.<seq>.jsonl[.gz|.zst]` next to `path`, and
+    `<path>.index.json` lists every segment with its record count, raw and
+    stored size and open/close times. Each writer starts a new segment, so
+    a compressed stream is never appended to; segments a crash left open
+    are marked `recovered` in the index on the next start.
+    """
+
+    def __init__(self, path: Path, policy: SegmentPolicy | None = None):
+        self.path = path
+        self.policy = policy or SegmentPolicy()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._raw: BinaryIO | None = None
+        self._stream: Any = None
+        self._entry: Dict[str, Any] | None = None
+        self._opened_at = 0.0
+        self._last_fsync = time.monotonic()
+        self._segments = read_segment_index(path) if self.policy.segmented else []
+        self._recover()
+
+    @property
+    def segments(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(s) for s in self._segments]
+
+    def _recover(self) -> None:
+        changed = False
+        for entry in self._segments:
+            if entry.get("closed_at") is None:
+                segment = self.path.parent / entry["file"]
+                st = segment.stat() if segment.exists() else None
+                entry["stored_bytes"] = st.st_size if st else 0
+                entry["closed_at"] = int(st.st_mtime) if st else int(time.time())
+                entry["records"] = None
+                entry["recovered"] = True
+                changed = True
+                log.warning("jsonl segment was not closed cleanly: %s", segment)
+        if changed:
+            _write_segment_index(self.path, self._segments)
+
+    def write(self, data: bytes, records: int) -> None:
+        """
+        Append `records` complete JSONL lines held in `data`.
+        """
+        if not data:
+            return
+        with self._lock:
+            if self._raw is None:
+                self._open()
+            self._stream.write(data)
+            WRITTEN_BYTES.inc(len(data), compression=self.policy.compression)
+            if self._entry is not None:
+                self._entry["records"] += records
+                self._entry["bytes"] += len(data)
+            self._maybe_fsync()
+            if self._should_rotate():
+                self._close_segment()
+
+    def flush(self, *, fsync: bool = False) -> None:
+        with self._lock:
+            if self._raw is not None:
+                self._flush(fsync=fsync)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._raw is not None:
+                self._close_segment()
+
+    def _open(self) -> None:
+        if not self.policy.segmented:
+            self._raw = self.path.open("ab", buffering=self.policy.buffer_size)
+            self._stream = self._raw
+            self._opened_at = time.monotonic()
+            return
+
+        seq = 1
+        pattern = _segment_re(self.path)
+        for name in [*(entry["file"] for entry in self._segments), *(p.name for p in self.path.parent.iterdir())]:
+            m = pattern.fullmatch(name)
+            if m:
+                seq = max(seq, int(m.group(1)) + 1)
+        name = f"{self.path.stem}.{seq:06d}{self.path.suffix}{SUFFIXES[self.policy.compression]}"
+        self._raw = (self.path.parent / name).open("xb", buffering=self.policy.buffer_size)
+        if self.policy.compression == "gzip":
+            level = 3 if self.policy.level is None else self.policy.level
+            self._stream = gzip.GzipFile(filename="", mode="wb", fileobj=self._raw, compresslevel=level, mtime=0)
+        elif self.policy.compression == "zstd":
+            level = 3 if self.policy.level is None else self.policy.level
+            self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._opened_at = time.monotonic()
+        self._entry = {
+            "file": name,
+            "compression": self.policy.compression,
+            "records": 0,
+            "bytes": 0,
+            "stored_bytes": 0,
+            "opened_at": int(time.time()),
+            "closed_at": None,
+        }
+        self._segments.append(self._entry)
+        _write_segment_index(self.path, self._segments)
+
+    def _flush(self, *, fsync: bool) -> None:
+        if self._stream is not self._raw:
+            self._stream.flush()
+        self._raw.flush()
+        if fsync:
+            os.fsync(self._raw.fileno())
+            self._last_fsync = time.monotonic()
+
+    def _maybe_fsync(self) -> None:
+        fsync = self.policy.fsync
+        if fsync == "batch":
+            self._flush(fsync=True)
+        elif fsync not in FSYNC_POLICIES and time.monotonic() - self._last_fsync >= float(fsync):
+            self._flush(fsync=True)
+
+    def _should_rotate(self) -> bool:
+        if self._entry is None:
+            return False
+        if self.policy.rotate_bytes and self._entry["bytes"] >= self.policy.rotate_bytes:
+            return True
+        return bool(self.policy.rotate_seconds) and time.monotonic() - self._opened_at >= self.policy.rotate_seconds
+
+    def _close_segment(self) -> None:
+        if self._stream is not self._raw:
+            # Writes the gzip trailer / ends the zstd frame; `fileobj` stays open.
+            self._stream.close()
+        self._raw.flush()
+        if self.policy.fsync != "never":
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = None
+        self._stream = None
+        if self._entry is not None:
+            self._entry["stored_bytes"] = (self.path.parent / self._entry["file"]).stat().st_size
+            self._entry["closed_at"] = int(time.time())
+            _write_segment_index(self.path, self._segments)
+            SEGMENTS.inc(compression=self.policy.compression)
+            self._entry = None
+
+
+def jsonl_sources(path: Path) -> List[Path]:
+    """
+    Files holding the records written to `path`, oldest first: the plain
+    file itself, then its segments in index order (segments missing from
+    the index, e.g. copied over by hand, follow in sequence order).
+    """
+    sources = [path] if path.is_file() else []
+    seen = set()
+    for entry in read_segment_index(path):
+        segment = path.parent / entry["file"]
+        if segment.exists() and segment not in seen:
+            sources.append(segment)
+            seen.add(segment)
+    pattern = _segment_re(path)
+    extra = []
+    if path.parent.is_dir():
+        for candidate in path.parent.iterdir():
+            m = pattern.fullmatch(candidate.name)
+            if m and candidate not in seen:
+                extra.append((int(m.group(1)), candidate))
+    sources.extend(p for _, p in sorted(extra))
+    return sources
+
+
+def open_segment(path: Path) -> BinaryIO:
+    """
+    Open one segment for reading its uncompressed bytes, by its suffix.
+    """
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f'{path} is zstd-compressed; install the zstandard package: pip install -e ".[zstd]"')
+        raw = path.open("rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True))
+    return path.open("rb")
+
+
+def iter_jsonl_lines(path: Path) -> Iterator[bytes]:
+    """
+    Non-empty lines of every file in `jsonl_sources(path)`, decompressing
+    as needed. A segment cut short by a crash yields its complete lines and
+    logs a warning instead of failing the whole read.
+    """
+    for _, _, line in iter_jsonl_positions(path):
+        yield line
+
+
+def skip_bytes(f: BinaryIO, n: int) -> None:
+    """
+    Read past `n` bytes of a stream that cannot seek (a compressed segment).
+    """
+    while n > 0:
+        chunk = f.read(min(n, 1 << 20))
+        if not chunk:
+            break
+        n -= len(chunk)
+
+
+def iter_jsonl_positions(path: Path, start: tuple[str, int] | None = None) -> Iterator[tuple[str, int, bytes]]:
+    """
+    `iter_jsonl_lines` as `(source name, offset after the line, line)`; the
+    offset counts uncompressed bytes. `start` resumes from such a position:
+    earlier sources are skipped and the source named in it is read from
+    that offset on.
+    """
+    sources = jsonl_sources(path)
+    if start is not None:
+        names = [source.name for source in sources]
+        if start[0] not in names:
+            raise RuntimeError(f"cannot resume {path}: {start[0]} is not one of its files")
+        sources = sources[names.index(start[0]) :]
+    for source in sources:
+        pos = start[1] if start is not None and source.name == start[0] else 0
+        with open_segment(source) as f:
+            try:
+                # Plain files seek; compressed segments decompress up to the offset.
+                if pos and source.suffix in (".gz", ".zst"):
+                    skip_bytes(f, pos)
+                elif pos:
+                    f.seek(pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        log.warning("dropping incomplete last line of %s", source)
+                        break
+                    pos += len(line)
+                    if line.strip():
+                        yield source.name, pos, line
+            except TRUNCATED_ERRORS as e:
+                log.warning("jsonl segment is truncated: %s (%s)", source, e)
@@ -1,10 +1,41 @@
 from __future__ import annotations
 
+import hashlib
+import os
 import re
 import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Any, Mapping
+from typing import Any, Dict, Iterable, Iterator, Mapping, Protocol
+
+from feapder.utils.log import log
+
+from crawler import fastjson, metrics
+from crawler.attachments import AttachmentStore
+from crawler.blob_store import BlobStore, resolve_body
+
+EXPORT_FILES = metrics.counter("biji_export_files_total", "Markdown files written.")
+EXPORT_UNCHANGED = metrics.counter("biji_export_unchanged_total", "Markdown files an incremental export left alone.")
+EXPORT_DELETED = metrics.counter("biji_export_deleted_total", "Markdown files removed for notes that are gone.")
+
+MANIFEST_NAME = ".biji-export-manifest.json"
+# Part of every manifest hash: bump it whenever `render_link_markdown`'s
+# output changes, so the next incremental export rewrites every file.
+RENDER_VERSION = 1
+# Parallel export: notes rendered per batch, per worker, and sent to a worker at a time.
+PARALLEL_BATCH_PER_WORKER = 64
+PARALLEL_CHUNKSIZE = 16
+
+
+class DetailSource(Protocol):
+    """
+    Where an export finds the link detail of a note: a dict keyed by
+    note_id, or `crawler.storage.DetailLookup` to fetch them one at a time.
+    """
+
+    def get(self, note_id: str, /) -> Mapping[str, Any] | None: ...
 
 
 def _safe_filename(name: str, *, max_len: int = 120) -> str:
@@ -20,6 +51,17 @@ def _safe_filename(name: str, *, max_len: int = 120) -> str:
 class MarkdownExportOptions:
     out_dir: Path
     only_with_details: bool = True
+    # AttachmentStore root; downloaded attachments are linked by local path.
+    attachments_dir: Path | None = None
+    # BlobStore root for bodies the pipeline offloaded (BIJI_BLOB_DIR).
+    blob_dir: Path | None = None
+    # Only write new or changed notes, and delete files of notes that are
+    # gone, according to the manifest in `out_dir`.
+    incremental: bool = False
+    # `exported_at` stamped into the front matter; defaults to the time of export.
+    exported_at: int | None = None
+    # Render in this many processes and write from as many threads (0/1: serial).
+    workers: int = 0
 
 
 def _normalize_tag(tag: str) -> str:
@@ -37,26 +79,27 @@ def _yaml_bool(value: bool) -> str:
     return "true" if value else "false"
 
 
-def _get_detail_content(detail: Mapping[str, Any]) -> str:
+def _get_detail_content(detail: Mapping[str, Any], blobs: BlobStore | None = None) -> str:
     raw = detail.get("raw") or {}
     if isinstance(raw, dict) and raw.get("content"):
-        return str(raw.get("content") or "")
+        return str(resolve_body(raw.get("content"), blobs) or "")
     if detail.get("content"):
-        return str(detail.get("content") or "")
+        return str(resolve_body(detail.get("content"), blobs) or "")
     return ""
 
 
-def _get_note_content(note: Mapping[str, Any]) -> str:
+def _get_note_content(note: Mapping[str, Any], blobs: BlobStore | None = None) -> str:
     raw = note.get("raw") or {}
     if not isinstance(raw, dict):
         return ""
 
+    # Offloaded bodies are only read once an earlier field came up empty.
     for k in ("content", "body_text"):
-        v = raw.get(k)
+        v = resolve_body(raw.get(k), blobs)
         if isinstance(v, str) and v.strip():
             return v.strip()
 
-    jc = raw.get("json_content")
+    jc = resolve_body(raw.get("json_content"), blobs)
     if isinstance(jc, str) and jc.strip():
         return jc.strip()
     return ""
@@ -77,7 +120,32 @@ def _extract_audio_meta(note: Mapping[str, Any]) -> tuple[str, int | None]:
     return "", None
 
 
-def render_link_markdown(*, note: Mapping[str, Any], detail: Mapping[str, Any] | None) -> str:
+def _local_attachments(note: Mapping[str, Any], local_paths: Mapping[str, str]) -> list[tuple[str, str, str]]:
+    raw = note.get("raw") or {}
+    attachments = raw.get("attachments") if isinstance(raw, dict) else None
+    if not isinstance(attachments, list):
+        return []
+    out = []
+    for a in attachments:
+        if isinstance(a, dict) and str(a.get("url") or "") in local_paths:
+            url = str(a.get("url"))
+            out.append((str(a.get("type") or ""), url, local_paths[url]))
+    return out
+
+
+def render_link_markdown(
+    *,
+    note: Mapping[str, Any],
+    detail: Mapping[str, Any] | None,
+    local_paths: Mapping[str, str] | None = None,
+    blobs: BlobStore | None = None,
+    exported_at: int | None = None,
+) -> str:
+    """
+    `local_paths` maps attachment URLs to downloaded files (relative to the
+    Markdown file); those attachments are linked locally. `blobs` resolves
+    bodies that were offloaded to a blob store.
+    """
     note_id = str(note.get("note_id") or "")
     raw_note = note.get("raw") or {}
     note_type = str(raw_note.get("note_type") or "")
@@ -93,10 +161,10 @@ def render_link_markdown(*, note: Mapping[str, Any], detail: Mapping[str, Any] |
         title = str(detail.get("title") or "")
         url = str(detail.get("url") or "")
         web_title = str(detail.get("web_title") or "")
-        content = _get_detail_content(detail)
+        content = _get_detail_content(detail, blobs)
         has_content = bool(detail.get("has_content")) if "has_content" in detail else bool(content)
     else:
-        content = _get_note_content(note)
+        content = _get_note_content(note, blobs)
         has_content = bool(content)
 
     if not title:
@@ -110,7 +178,7 @@ def render_link_markdown(*, note: Mapping[str, Any], detail: Mapping[str, Any] |
 
     lines: list[str] = []
 
-    exported_at = int(time.time())
+    exported_at = int(time.time()) if exported_at is None else int(exported_at)
     lines.append("---")
     lines.append(f'title: {_yaml_escape(title)}')
     if web_title:
@@ -132,10 +200,14 @@ def render_link_markdown(*, note: Mapping[str, Any], detail: Mapping[str, Any] |
         for t in tag_names:
             lines.append(f"  - {_yaml_escape(str(t))}")
 
+    local = _local_attachments(note, local_paths or {})
+
     if note_type == "audio":
         audio_url, duration = _extract_audio_meta(note)
         if audio_url:
             lines.append(f'audio_url: {_yaml_escape(audio_url)}')
+            if local_paths and audio_url in local_paths:
+                lines.append(f'audio_local: {_yaml_escape(local_paths[audio_url])}')
         if duration is not None:
             try:
                 lines.append(f"audio_duration_ms: {int(duration)}")
@@ -152,32 +224,203 @@ def render_link_markdown(*, note: Mapping[str, Any], detail: Mapping[str, Any] |
         else:
             lines.append(content)
         lines.append("")
+    if local:
+        lines.append("## Attachments")
+        lines.append("")
+        for kind, url, path in local:
+            name = Path(path).name
+            lines.append(f"- [{kind or 'file'}: {name}](<{path}>)")
+        lines.append("")
     return "\n".join(lines).rstrip() + "\n"
 
 
+def read_export_manifest(out_dir: Path) -> Dict[str, Dict[str, str]]:
+    """
+    note_id -> `{"path", "hash", "updated_at"}` of the files the last export
+    wrote to `out_dir`; empty when there is no manifest.
+    """
+    path = out_dir / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    return dict(fastjson.loads(path.read_bytes()).get("notes") or {})
+
+
+def _write_export_manifest(out_dir: Path, entries: Mapping[str, Mapping[str, str]]) -> None:
+    path = out_dir / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(fastjson.dumps({"render_version": RENDER_VERSION, "notes": entries}))
+    os.replace(tmp, path)
+
+
+def _source_hash(note: Mapping[str, Any], detail: Mapping[str, Any] | None, local: list) -> str:
+    # Everything the rendered file depends on, so unchanged notes need not be rendered to compare.
+    payload = [
+        RENDER_VERSION,
+        {k: v for k, v in note.items() if not k.startswith("_")},
+        {k: v for k, v in detail.items() if not k.startswith("_")} if detail else None,
+        local,
+    ]
+    return hashlib.sha1(fastjson.dumps_canonical(payload)).hexdigest()
+
+
+def _allocate_filename(title: str, note_id: str, previous: str | None, taken: Dict[str, str], out_dir: Path) -> str:
+    """
+    File name for a note: its title, or `<title> - <note_id>` when that name
+    belongs to another note or to a file the export did not write.
+
+    While its title is unchanged a note keeps `previous`, the name the last
+    export's manifest gave it. `taken` (casefolded name -> note id) starts
+    out holding every manifest name, so which of two same-titled notes gets
+    the plain name does not depend on the order the store returns them in.
+    Compared case-insensitively for macOS and Windows.
+    """
+    base = _safe_filename(title) or "untitled"
+    plain = f"{base}.md"
+    if not note_id:
+        return plain
+    suffixed = f"{base} - {note_id}.md"
+    if previous in (plain, suffixed):
+        return previous
+    name = plain
+    if plain.casefold() in taken or (out_dir / plain).exists():
+        # Avoid overwriting when multiple notes share the same title.
+        name = suffixed
+    taken[name.casefold()] = note_id
+    return name
+
+
+def _render_job(job: tuple, blobs: BlobStore | None, exported_at: int) -> str:
+    _, note, detail, local = job
+    return render_link_markdown(note=note, detail=detail, local_paths=local, blobs=blobs, exported_at=exported_at)
+
+
+def _write_serial(jobs: Iterable[tuple], blobs: BlobStore | None, exported_at: int) -> list[Path]:
+    written: list[Path] = []
+    for job in jobs:
+        job[0].write_text(_render_job(job, blobs, exported_at), encoding="utf-8")
+        EXPORT_FILES.inc()
+        written.append(job[0])
+    return written
+
+
+def _write_parallel(jobs: Iterable[tuple], blobs: BlobStore | None, exported_at: int, workers: int) -> list[Path]:
+    # Rendering is CPU-bound and goes to processes; writing blocks on I/O and
+    # goes to threads. One batch is rendered while the previous one is written.
+    written: list[Path] = []
+    render = partial(_render_job, blobs=blobs, exported_at=exported_at)
+
+    def finish(pending: list[tuple[Path, Future]]) -> None:
+        # A file counts once its write has gone through.
+        for path, future in pending:
+            future.result()
+            EXPORT_FILES.inc()
+            written.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as renderers, ThreadPoolExecutor(max_workers=workers) as writers:
+        pending: list[tuple[Path, Future]] = []
+        for batch in _batched(jobs, workers * PARALLEL_BATCH_PER_WORKER):
+            markdowns = list(renderers.map(render, batch, chunksize=PARALLEL_CHUNKSIZE))
+            finish(pending)
+            pending = [
+                (job[0], writers.submit(job[0].write_text, markdown, encoding="utf-8"))
+                for job, markdown in zip(batch, markdowns)
+            ]
+        finish(pending)
+    return written
+
+
+def _batched(items: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    batch: list[tuple] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def export_markdown_from_records(
     *,
-    notes: list[Mapping[str, Any]],
-    details_by_note_id: Mapping[str, Mapping[str, Any]],
+    notes: Iterable[Mapping[str, Any]],
+    details_by_note_id: DetailSource,
     options: MarkdownExportOptions,
 ) -> list[Path]:
+    """
+    Write one Markdown file per note and return the paths written.
+
+    `notes` is consumed as it is iterated and each file is written before
+    the next note is read (a batch at a time in parallel mode), so a store
+    cursor plus a `DetailLookup` export in bounded memory.
+
+    Every export records note_id -> file name, source hash and `updated_at`
+    in `out_dir/.biji-export-manifest.json`. With `options.incremental`,
+    notes whose hash and file name match the manifest (and whose file still
+    exists) are neither rendered nor written, notes whose title changed are
+    written under the new name, and files of notes that are gone are deleted.
+    In either mode a note keeps the file name the manifest gave it while its
+    title is unchanged (see `_allocate_filename`).
+
+    With `options.workers` > 1, files are rendered in that many processes
+    and written from as many threads; file names are still allocated here,
+    in note order, so the output is the same as a serial export.
+    """
     options.out_dir.mkdir(parents=True, exist_ok=True)
-    written: list[Path] = []
-
-    for note in notes:
-        note_id = str(note.get("note_id") or "")
-        detail = details_by_note_id.get(note_id)
-        if options.only_with_details and not detail:
-            continue
-
-        raw_note = note.get("raw") or {}
-        title = str((detail or {}).get("title") or raw_note.get("title") or note_id or "Untitled")
-        base = _safe_filename(title) or "untitled"
-        path = options.out_dir / f"{base}.md"
-        if path.exists() and note_id:
-            # Avoid overwriting when multiple notes share the same title.
-            path = options.out_dir / f"{base} - {note_id}.md"
-        path.write_text(render_link_markdown(note=note, detail=detail), encoding="utf-8")
-        written.append(path)
 
+    local_paths: dict[str, str] = {}
+    if options.attachments_dir is not None:
+        for url, path in AttachmentStore(options.attachments_dir).local_paths().items():
+            local_paths[url] = Path(os.path.relpath(path, options.out_dir)).as_posix()
+    blobs = BlobStore(options.blob_dir) if options.blob_dir is not None else None
+    exported_at = int(time.time()) if options.exported_at is None else options.exported_at
+
+    manifest = read_export_manifest(options.out_dir)
+    entries: Dict[str, Dict[str, str]] = {}
+    unchanged = 0
+
+    def jobs() -> Iterator[tuple]:
+        # `(path, note, detail, local attachment paths)` for every file to write.
+        nonlocal unchanged
+        taken = {entry["path"].casefold(): note_id for note_id, entry in manifest.items()}
+        for note in notes:
+            note_id = str(note.get("note_id") or "")
+            detail = details_by_note_id.get(note_id)
+            if options.only_with_details and not detail:
+                continue
+
+            raw_note = note.get("raw") or {}
+            title = str((detail or {}).get("title") or raw_note.get("title") or note_id or "Untitled")
+            previous = manifest.get(note_id, {}).get("path") if note_id else None
+            name = _allocate_filename(title, note_id, previous, taken, options.out_dir)
+            path = options.out_dir / name
+            local = _local_attachments(note, local_paths)
+            entry = {
+                "path": name,
+                "hash": _source_hash(note, detail, local),
+                "updated_at": str(raw_note.get("updated_at") or ""),
+            }
+            if note_id:
+                entries[note_id] = entry
+                if options.incremental and manifest.get(note_id) == entry and path.exists():
+                    unchanged += 1
+                    EXPORT_UNCHANGED.inc()
+                    continue
+            # Only this note's attachments travel to a render worker.
+            yield path, note, detail, {url: local_path for _, url, local_path in local}
+
+    if options.workers > 1:
+        written = _write_parallel(jobs(), blobs, exported_at, options.workers)
+    else:
+        written = _write_serial(jobs(), blobs, exported_at)
+
+    if options.incremental:
+        claimed = {entry["path"] for entry in entries.values()} | {path.name for path in written}
+        deleted = 0
+        for entry in manifest.values():
+            if entry["path"] not in claimed and (options.out_dir / entry["path"]).exists():
+                (options.out_dir / entry["path"]).unlink()
+                deleted += 1
+        EXPORT_DELETED.inc(deleted)
+        log.info("markdown export: %s written, %s unchanged, %s deleted", len(written), unchanged, deleted)
+    _write_export_manifest(options.out_dir, entries)
     return written
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from feapder.utils.log import log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def _samples(self) -> List[Tuple[LabelKey, float]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelKey, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_label_key(labels))
+        return int(state[-2]) if state else 0
+
+    def _samples(self) -> List[Tuple[LabelKey, List[float]]]:
+        with self._lock:
+            return [(key, list(state)) for key, state in self._values.items()]
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms for crawls, migrations and exports.
+
+    Metrics are declared once at module level (`metrics.counter(...)`);
+    declaring a name again returns the existing metric.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def counter(self, name: str, help: str) -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help)
+            return metric
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help, buckets)
+            return metric
+
+    def _all(self) -> List[Counter | Histogram]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: m.name)
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        for metric in self._all():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if isinstance(metric, Counter):
+                for key, value in metric._samples():
+                    lines.append(f"{metric.name}{_format_labels(key)} {value:g}")
+                continue
+            for key, state in metric._samples():
+                for bound, count in zip(metric.buckets, state):
+                    lines.append(f"{metric.name}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {count:g}")
+                lines.append(f"{metric.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-2]:g}")
+                lines.append(f"{metric.name}_sum{_format_labels(key)} {state[-1]:g}")
+                lines.append(f"{metric.name}_count{_format_labels(key)} {state[-2]:g}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> Dict[str, object]:
+        """
+        Snapshot with per-counter `rate_per_sec` averaged over the process
+        uptime (pages/sec, items/sec, files/sec, ...).
+        """
+        uptime = max(time.time() - self.started_at, 1e-9)
+        out: Dict[str, object] = {"timestamp": int(time.time()), "uptime_seconds": round(uptime, 3), "metrics": {}}
+        for metric in self._all():
+            samples = []
+            if isinstance(metric, Counter):
+                for key, value in metric._samples():
+                    samples.append({"labels": dict(key), "value": value, "rate_per_sec": round(value / uptime, 3)})
+            else:
+                for key, state in metric._samples():
+                    count, total = state[-2], state[-1]
+                    samples.append(
+                        {
+                            "labels": dict(key),
+                            "count": count,
+                            "sum": round(total, 6),
+                            "avg": round(total / count, 6) if count else 0.0,
+                            "buckets": {f"{b:g}": c for b, c in zip(metric.buckets, state)},
+                        }
+                    )
+            out["metrics"][metric.name] = {"type": metric.kind, "help": metric.help, "samples": samples}
+        return out
+
+    def write(self, path: Path) -> None:
+        """
+        Atomically write a snapshot; `.json` files get JSON, anything else
+        the Prometheus text format (for node_exporter's textfile collector).
+        """
+        if path.suffix == ".json":
+            text = json.dumps(self.to_json(), ensure_ascii=False, indent=2)
+        else:
+            text = self.to_prometheus()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help: str) -> Counter:
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, buckets)
+
+
+class MetricsWriter:
+    """
+    Writes `REGISTRY` to `path` every `interval` seconds from a daemon
+    thread, and once more on `stop()`.
+    """
+
+    def __init__(self, path: Path, *, interval: float = 10.0, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self._registry = registry
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "MetricsWriter":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="biji-metrics-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._write()
+
+    def _write(self) -> None:
+        try:
+            self._registry.write(self.path)
+        except Exception as e:
+            log.error("metrics write failed: path=%s error=%r", self.path, e)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._write()
+
+
+def start_metrics_writer_from_env() -> MetricsWriter | None:
+    """
+    Start a writer when `BIJI_METRICS_PATH` is set (interval from
+    `BIJI_METRICS_INTERVAL`, default 10s); returns None otherwise.
+    """
+    path = os.getenv("BIJI_METRICS_PATH", "").strip()
+    if not path:
+        return None
+    writer = MetricsWriter(Path(path), interval=float(os.getenv("BIJI_METRICS_INTERVAL", "10")))
+    log.info("metrics enabled: path=%s interval=%ss", writer.path, writer.interval)
+    return writer.start()
@@ -1,41 +1,330 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import threading
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Mapping
 
+import bson
+from feapder.utils.log import log
 from mongita import MongitaClientDisk
 
+from crawler import fastjson, metrics
+
+UPSERT_SECONDS = metrics.histogram("biji_mongita_upsert_seconds", "Mongita upsert latency by collection.")
+WRITES = metrics.counter("biji_mongita_writes_total", "Upserted documents by collection and result.")
+
+# Unchanged documents get their `_seen_at` rewritten at most this often.
+SEEN_REFRESH_SECONDS = int(os.getenv("BIJI_SEEN_REFRESH_SECONDS", str(86_400)))
+
 
 @dataclass(frozen=True)
 class MongitaCollections:
     notes: Any
     details: Any
     misc: Any
+    dead_letters: Any = None
+
+
+_CLIENTS: Dict[Path, MongitaClientDisk] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def mongita_client(dir_path: Path) -> MongitaClientDisk:
+    """
+    The one client of a Mongita directory in this process.
+
+    Mongita shares a single disk engine per directory, and creating another
+    `MongitaClientDisk` for it closes that engine, without its lock, under
+    whoever is using it. The pipeline, the stores, the crawl state and the
+    dead letters therefore all get their collections from this client.
+    """
+    dir_path = dir_path.resolve()
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(dir_path)
+        if client is None:
+            dir_path.mkdir(parents=True, exist_ok=True)
+            client = _CLIENTS[dir_path] = MongitaClientDisk(str(dir_path))
+        return client
+
+
+def open_mongita(
+    dir_path: Path, db_name: str, notes: str, details: str, misc: str, dead_letters: str = "dead_letters"
+) -> MongitaCollections:
+    db = mongita_client(dir_path)[db_name]
+    return MongitaCollections(notes=db[notes], details=db[details], misc=db[misc], dead_letters=db[dead_letters])
+
+
+def open_mongita_from_env() -> MongitaCollections:
+    """
+    Open the collections configured by the same `BIJI_MONGITA_*` env vars the
+    pipeline uses.
+    """
+    return open_mongita(
+        Path(os.getenv("BIJI_MONGITA_DIR", "data/mongita")),
+        os.getenv("BIJI_MONGITA_DB", "biji"),
+        os.getenv("BIJI_MONGITA_NOTES_COLLECTION", "notes"),
+        os.getenv("BIJI_MONGITA_DETAILS_COLLECTION", "details"),
+        os.getenv("BIJI_MONGITA_MISC_COLLECTION", "misc"),
+        os.getenv("BIJI_MONGITA_DEAD_LETTERS_COLLECTION", "dead_letters"),
+    )
+
+
+def content_fingerprint(doc: Mapping[str, Any]) -> str:
+    """
+    Stable hash of a document's payload: every field except the `_`-prefixed
+    bookkeeping ones (`_id`, `_ts`, `_fp`, `_seen_at`, ...).
+    """
+    payload = {key: value for key, value in doc.items() if not key.startswith("_")}
+    return hashlib.sha1(fastjson.dumps_canonical(payload)).hexdigest()
+
+
+def seen_is_stale(seen_at: Any, now: int) -> bool:
+    """
+    Whether a stored `_seen_at` is old enough (`SEEN_REFRESH_SECONDS`) that an
+    unchanged document should have it refreshed. Shared by the stores.
+    """
+    return now - int(seen_at or 0) >= SEEN_REFRESH_SECONDS
+
+
+def upsert_by_note_id(collection, *, note_id: str, doc: Mapping[str, Any], now: int | None = None) -> str:
+    """
+    Upsert a single document: a one-document `NoteIdIndex.upsert_many`, which
+    loads the collection's keys on every call. Returns `inserted`, `updated`
+    or `unchanged`.
+    """
+    counts = NoteIdIndex(collection).upsert_many([{**doc, "note_id": note_id}], now=now)
+    return "inserted" if counts.inserted else "updated" if counts.updated else "unchanged"
+
+
+@dataclass
+class UpsertCounts:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
 
+    def add(self, other: "UpsertCounts") -> None:
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
 
-def open_mongita(dir_path: Path, db_name: str, notes: str, details: str, misc: str) -> MongitaCollections:
-    dir_path.mkdir(parents=True, exist_ok=True)
-    client = MongitaClientDisk(str(dir_path))
-    db = client[db_name]
-    return MongitaCollections(notes=db[notes], details=db[details], misc=db[misc])
 
+# Bookkeeping fields of a document that are copied into its key.
+KEY_FIELDS = ("_ts", "_fp", "_seen_at", "source_version")
 
-def upsert_by_note_id(collection, *, note_id: str, doc: Mapping[str, Any], now: int | None = None) -> None:
+_BUILD_LOCK = threading.Lock()
+
+
+def keys_collection(collection):
+    """
+    The `<name>_keys` collection kept next to a collection upserted by
+    `note_id`: one small document per note id (its `_id`), holding the
+    stored document's `_id` as `doc_id` plus its `KEY_FIELDS`.
+    """
+    return collection.database[f"{collection.name}_keys"]
+
+
+def _key(doc_id: Any, doc: Mapping[str, Any]) -> Dict[str, Any]:
+    return {"doc_id": doc_id, **{field: doc[field] for field in KEY_FIELDS if field in doc}}
+
+
+def _build_keys(collection, keys) -> None:
+    # Newest `_ts` wins among documents sharing a note id; the others are dropped.
+    newest: Dict[str, Dict[str, Any]] = {}
+    stale: List[Any] = []
+    for doc in collection.find({}):
+        note_id = doc.get("note_id")
+        if note_id in (None, ""):
+            continue
+        note_id = str(note_id)
+        current = newest.get(note_id)
+        if current is not None and int(current.get("_ts") or 0) > int(doc.get("_ts") or 0):
+            stale.append(doc["_id"])
+            continue
+        if current is not None:
+            stale.append(current["doc_id"])
+        newest[note_id] = _key(doc["_id"], doc)
+    if stale:
+        log.warning("dropping duplicate documents: collection=%s count=%s", collection.name, len(stale))
+        collection.delete_many({"_id": {"$in": stale}})
+    if newest:
+        keys.insert_many([{"_id": note_id, **key} for note_id, key in newest.items()])
+    log.info("built note_id keys: collection=%s count=%s", collection.name, len(newest))
+
+
+def load_keys(collection, *, repair: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    `note_id -> key` of a collection upserted by `note_id`, read from its
+    `keys_collection` without decoding the documents themselves.
+
+    A collection written before it had keys gets them built first, from one
+    full read. Keys an interrupted insert left pending are skipped when
+    their document never made it; `repair`, for writers, also settles them.
+    """
+    keys = keys_collection(collection)
+    with _BUILD_LOCK:
+        if keys.find_one({}) is None and collection.find_one({}) is not None:
+            _build_keys(collection, keys)
+    loaded: Dict[str, Dict[str, Any]] = {}
+    settled = False
+    lost: List[str] = []
+    for key in keys.find({}):
+        note_id = key.pop("_id")
+        if key.pop("_pending", False):
+            if collection.find_one({"_id": key["doc_id"]}) is None:
+                lost.append(note_id)
+                continue
+            settled = True
+        loaded[note_id] = key
+    if repair and lost:
+        log.warning("dropping keys of documents never written: collection=%s count=%s", collection.name, len(lost))
+        keys.delete_many({"_id": {"$in": lost}})
+    if repair and settled:
+        keys.update_many({"_pending": True}, {"$set": {"_pending": False}})
+    return loaded
+
+
+@dataclass
+class _Entry:
+    doc_id: Any
+    fp: str | None
+    seen_at: int
+
+
+class NoteIdIndex:
     """
-    Mongita doesn't support `$setOnInsert`, so we implement upsert with a
-    find-then-update/insert flow.
+    Bulk upserts keyed by `note_id`, backed by an in-memory map of each
+    stored document's `_id`, content fingerprint (`_fp`) and `_seen_at`,
+    loaded once from the collection's keys (`load_keys`), so opening it
+    never decodes the documents themselves.
+
+    Mongita answers `find_one({"note_id": ...})` with a scan of the whole
+    collection, and rewrites its whole document location table on every
+    write call, so per-document upserts grow quadratic. `upsert_many` drops
+    documents whose fingerprint is unchanged and inserts new ones with one
+    `insert_many`; changed ones are merged with their stored version (like
+    `$set`) and replaced in place one at a time, keeping their `_id` and
+    position; a re-sync changes few documents. Keys of new documents are
+    written first and marked pending until the documents are in, so a crash
+    in between never leaves a document without a key.
+
+    Unchanged documents only have `_seen_at` refreshed once it is more than
+    `SEEN_REFRESH_SECONDS` old, so a re-sync of identical data writes
+    nothing; the refresh is one `update_many` per batch that sets it in
+    place. `counts` accumulates what the index did since it was opened.
     """
-    now = int(time.time()) if now is None else int(now)
-    existing = collection.find_one({"note_id": note_id})
-    if existing is None:
-        to_insert = dict(doc)
-        to_insert.setdefault("_created_at", now)
-        to_insert.setdefault("_ts", now)
-        collection.insert_one(to_insert)
-        return
-    to_update = dict(doc)
-    to_update.setdefault("_ts", now)
-    collection.update_one({"note_id": note_id}, {"$set": to_update}, upsert=False)
 
+    def __init__(self, collection):
+        self.collection = collection
+        self.keys = keys_collection(collection)
+        if not any("_pending_1" in index for index in self.keys.index_information()):
+            # Settling a batch then looks up its pending keys instead of scanning them all.
+            self.keys.create_index("_pending")
+        self.counts = UpsertCounts()
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {
+            note_id: _Entry(key["doc_id"], key.get("_fp"), int(key.get("_seen_at") or key.get("_ts") or 0))
+            for note_id, key in load_keys(collection, repair=True).items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, note_id: str) -> bool:
+        return note_id in self._entries
+
+    def upsert_many(self, docs: Iterable[Mapping[str, Any]], *, now: int | None = None) -> UpsertCounts:
+        """
+        Upsert documents carrying a `note_id`; repeated note ids within the
+        batch are merged in order.
+        """
+        now = int(time.time()) if now is None else int(now)
+        merged: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            note_id = str(doc["note_id"])
+            merged[note_id] = {**merged.get(note_id, {}), **doc}
+        counts = UpsertCounts()
+        if not merged:
+            return counts
+
+        with self._lock, UPSERT_SECONDS.time(collection=self.collection.name):
+            inserts = []
+            replaces = []
+            seen: List[_Entry] = []
+            for note_id, doc in merged.items():
+                fp = content_fingerprint(doc)
+                entry = self._entries.get(note_id)
+                if entry is not None and entry.fp == fp:
+                    counts.unchanged += 1
+                    if seen_is_stale(entry.seen_at, now):
+                        seen.append(entry)
+                    continue
+                doc.setdefault("_ts", now)
+                doc["_fp"] = fp
+                doc["_seen_at"] = now
+                if entry is None:
+                    doc.setdefault("_created_at", now)
+                    doc["_id"] = bson.ObjectId()
+                    counts.inserted += 1
+                    inserts.append((note_id, doc))
+                else:
+                    # `find_one` by `_id` is a direct lookup, not a scan.
+                    existing = self.collection.find_one({"_id": entry.doc_id}) or {}
+                    doc = {**existing, **doc, "_id": entry.doc_id}
+                    counts.updated += 1
+                    replaces.append((note_id, doc))
+
+            if inserts:
+                self.keys.insert_many([{"_id": note_id, **_key(doc["_id"], doc), "_pending": True} for note_id, doc in inserts])
+                self.collection.insert_many([doc for _, doc in inserts])
+                self.keys.update_many({"_pending": True}, {"$set": {"_pending": False}})
+            for note_id, doc in replaces:
+                self.collection.replace_one({"_id": doc["_id"]}, doc)
+                self.keys.replace_one({"_id": note_id}, _key(doc["_id"], doc))
+            for note_id, doc in (*inserts, *replaces):
+                self._entries[note_id] = _Entry(doc["_id"], doc["_fp"], now)
+            if seen:
+                doc_ids = [entry.doc_id for entry in seen]
+                self.collection.update_many({"_id": {"$in": doc_ids}}, {"$set": {"_seen_at": now}})
+                self.keys.update_many({"doc_id": {"$in": doc_ids}}, {"$set": {"_seen_at": now}})
+                for entry in seen:
+                    entry.seen_at = now
+            self.counts.add(counts)
+
+        name = self.collection.name
+        WRITES.inc(counts.inserted, collection=name, result="inserted")
+        WRITES.inc(counts.updated, collection=name, result="updated")
+        WRITES.inc(counts.unchanged, collection=name, result="unchanged")
+        return counts
+
+
+def iter_collection(collection, *, batch_size: int | None = None) -> Iterator[Dict[str, Any]]:
+    """
+    Every document of `collection`, read through `find` one page of
+    `batch_size` (`BIJI_MONGITA_READ_BATCH`, default 1000) at a time; a
+    `skip`/`limit` page only decodes its own documents.
+
+    Mongita's disk engine keeps every document it decodes until its client
+    is closed, so the client is closed after each page (`close` only drops
+    the caches and file handles, which reopen on the next call) and memory
+    stays around one page, plus whatever the caller looks up meanwhile.
+    Each page reopens the collection's location table, so smaller pages
+    cost more time on large collections. Meant for readers that have the
+    directory to themselves, like the export scripts.
+    """
+    batch_size = batch_size or int(os.getenv("BIJI_MONGITA_READ_BATCH", "1000"))
+    client = collection.database.client
+    skip = 0
+    while True:
+        page = collection.find({}, skip=skip, limit=batch_size)
+        count = 0
+        for doc in page:
+            count += 1
+            yield doc
+        client.close()
+        if count < batch_size:
+            return
+        skip += count
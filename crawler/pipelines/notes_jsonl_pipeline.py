@@ -1,21 +1,34 @@
 from __future__ import annotations
 
-import json
 import os
 from pathlib import Path
 from typing import Dict, List
 
 from feapder.pipelines import BasePipeline
 
+from crawler import fastjson, metrics
+from crawler.jsonl_segments import JsonlSegmentWriter, SegmentPolicy, segment_policy_from_env
+
+BATCH_SIZE = metrics.histogram("biji_pipeline_batch_size", "Items per save_items call.", metrics.SIZE_BUCKETS)
+FLUSH_SECONDS = metrics.histogram("biji_pipeline_flush_seconds", "save_items wall time per batch.")
+
 
 class NotesJsonlPipeline(BasePipeline):
-    def __init__(self):
-        self.output_path = Path(os.getenv("BIJI_EXPORT_PATH", "data/notes.jsonl"))
-        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+    """
+    Append every item to `BIJI_EXPORT_PATH` as JSON lines through one
+    buffered writer kept open for the life of the spider; `BIJI_EXPORT_*`
+    selects compression, segment rotation and fsync (see `SegmentPolicy`).
+    """
+
+    def __init__(self, output_path: Path | None = None, policy: SegmentPolicy | None = None):
+        self.output_path = output_path or Path(os.getenv("BIJI_EXPORT_PATH", "data/notes.jsonl"))
+        self._writer = JsonlSegmentWriter(self.output_path, policy or segment_policy_from_env())
 
     def save_items(self, table, items: List[Dict]) -> bool:
-        with self.output_path.open("a", encoding="utf-8") as f:
-            for item in items:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        BATCH_SIZE.observe(len(items), pipeline="jsonl")
+        with FLUSH_SECONDS.time(pipeline="jsonl"):
+            self._writer.write(b"".join(fastjson.dumps_line(item) for item in items), len(items))
         return True
 
+    def close(self):
+        self._writer.close()
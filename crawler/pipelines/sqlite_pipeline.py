@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from crawler.blob_store import blob_store_from_env
+from crawler.pipelines.store_pipeline import StorePipeline
+from crawler.sqlite_store import SqliteStore
+
+
+class SqlitePipeline(StorePipeline):
+    """
+    Store all exported items in the SQLite database at `BIJI_SQLITE_PATH`
+    (default `data/biji.sqlite3`).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path | None = None):
+        blobs = blob_store_from_env()
+        store = SqliteStore(path or Path(os.getenv("BIJI_SQLITE_PATH", "data/biji.sqlite3")), blobs=blobs)
+        super().__init__(store, blobs)
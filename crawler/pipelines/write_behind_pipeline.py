@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, List, Tuple
+
+from feapder.pipelines import BasePipeline
+from feapder.utils.log import log
+
+from crawler import fastjson, metrics
+from crawler.pipelines.mongita_pipeline import MongitaPipeline
+from crawler.pipelines.notes_jsonl_pipeline import NotesJsonlPipeline
+from crawler.pipelines.sqlite_pipeline import SqlitePipeline
+
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "biji_write_behind_wait_seconds", "Time save_items blocked on a full write-behind queue."
+)
+FAILED_ITEMS = metrics.counter("biji_write_behind_failed_items_total", "Items the write-behind writer gave up on.")
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+
+
+class WriteBehindPipeline(BasePipeline):
+    """
+    Queues items and writes them to `inner` from a dedicated thread, so
+    feapder's item path (or the asyncio engine's flush) never waits on
+    storage unless the queue is full.
+
+    - at most `max_queue_items` items wait; `save_items` blocks beyond that
+    - the writer hands `inner` batches of up to `batch_size` items, or what
+      has accumulated once the oldest item waited `flush_interval` seconds
+    - `close()` drains the queue, then closes `inner`
+
+    `save_items` reports success as soon as items are queued, so whatever
+    has to wait for the items to be stored (checkpoints) goes through
+    `after_saved`. A batch that still fails after a few attempts is
+    appended to `failed_path` (`BIJI_WRITE_BEHIND_FAILED_PATH`, JSON lines
+    that `scripts/migrate_jsonl_to_mongita.py` can load), counted in
+    `biji_write_behind_failed_items_total`, and the pipeline is `lost`
+    from then on.
+
+    Subclasses set `inner_class` so they can be named in
+    `setting.ITEM_PIPELINES`, which instantiates pipelines without arguments.
+    """
+
+    inner_class: type[BasePipeline] | None = None
+
+    def __init__(
+        self,
+        inner: BasePipeline | None = None,
+        *,
+        max_queue_items: int | None = None,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        failed_path: Path | None = None,
+    ):
+        if inner is None:
+            if self.inner_class is None:
+                raise TypeError("WriteBehindPipeline needs an inner pipeline")
+            inner = self.inner_class()
+        self.inner = inner
+        self.max_queue_items = max_queue_items or int(os.getenv("BIJI_WRITE_BEHIND_MAX_ITEMS", "20000"))
+        self.batch_size = batch_size or int(os.getenv("BIJI_WRITE_BEHIND_BATCH", "1000"))
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else float(os.getenv("BIJI_WRITE_BEHIND_FLUSH_SECONDS", "2"))
+        )
+        self.failed_path = failed_path or Path(
+            os.getenv("BIJI_WRITE_BEHIND_FAILED_PATH", "data/write_behind_failed.jsonl")
+        )
+
+        self._pending: Deque[Tuple[str, Dict]] = deque()
+        # (items queued before it, callback): run by the writer once that many are written.
+        self._callbacks: Deque[Tuple[int, Callable[[bool], None]]] = deque()
+        self._queued = 0
+        self._written = 0
+        self._oldest_at = 0.0
+        self._writing = False
+        self._closed = False
+        self._stopped = False
+        self._lost = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="biji-write-behind", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def lost(self) -> bool:
+        """
+        Whether a batch was given up on (and went to `failed_path`).
+        """
+        return self._lost
+
+    def save_items(self, table, items: List[Dict]) -> bool:
+        if not items:
+            return True
+        with self._cond:
+            if self._closed:
+                log.error("write-behind pipeline is closed, dropping %s items", len(items))
+                return False
+            # A batch larger than the whole queue is still let in once it is empty.
+            if self._pending and len(self._pending) + len(items) > self.max_queue_items:
+                with QUEUE_WAIT_SECONDS.time(pipeline=type(self.inner).__name__):
+                    while self._pending and len(self._pending) + len(items) > self.max_queue_items:
+                        self._cond.wait()
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            self._pending.extend((table, item) for item in items)
+            self._queued += len(items)
+            self._cond.notify_all()
+        return True
+
+    def after_saved(self, callback: Callable[[bool], None]) -> None:
+        """
+        Run `callback(saved)` from the writer thread once every item queued
+        so far has been written; `saved` is False if any batch up to then
+        was given up on. Callbacks run in the order they were added.
+        """
+        with self._cond:
+            if not self._stopped:
+                self._callbacks.append((self._queued, callback))
+                self._cond.notify_all()
+                return
+            saved = not self._lost
+        callback(saved)
+
+    def flush(self) -> None:
+        """
+        Block until everything queued so far has been handed to `inner` and
+        the callbacks waiting on it have run.
+        """
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._writing or self._callbacks:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.inner.close()
+
+    def _next_batch(self) -> List[Tuple[str, Dict]] | List[Callable[[bool], None]] | None:
+        # The next items to write or, once everything before them is
+        # written, the callbacks that were waiting for it.
+        with self._cond:
+            while True:
+                if self._callbacks and self._callbacks[0][0] <= self._written:
+                    callbacks = []
+                    while self._callbacks and self._callbacks[0][0] <= self._written:
+                        callbacks.append(self._callbacks.popleft()[1])
+                    self._writing = True
+                    return callbacks
+                if self._pending and (
+                    self._closed
+                    or len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._oldest_at >= self.flush_interval
+                ):
+                    break
+                if self._closed:
+                    self._stopped = True
+                    self._cond.notify_all()
+                    return None
+                timeout = self._oldest_at + self.flush_interval - time.monotonic() if self._pending else None
+                self._cond.wait(timeout)
+
+            n = min(self.batch_size, len(self._pending))
+            batch = [self._pending.popleft() for _ in range(n)]
+            self._oldest_at = time.monotonic()
+            self._writing = True
+            self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            written = 0
+            try:
+                if batch and callable(batch[0]):
+                    for callback in batch:
+                        try:
+                            callback(not self._lost)
+                        except Exception as e:
+                            log.exception(e)
+                    continue
+                written = len(batch)
+                start = 0
+                # Keep feapder's contract of one table per save_items call.
+                for i in range(1, len(batch) + 1):
+                    if i == len(batch) or batch[i][0] != batch[start][0]:
+                        self._write(batch[start][0], [item for _, item in batch[start:i]])
+                        start = i
+            finally:
+                with self._cond:
+                    self._written += written
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write(self, table: str, items: List[Dict]) -> None:
+        name = type(self.inner).__name__
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                if self.inner.save_items(table, items):
+                    return
+                error = "save_items returned False"
+            except Exception as e:
+                error = repr(e)
+            log.warning("%s failed to save %s items: attempt=%s error=%s", name, len(items), attempt, error)
+            if attempt < MAX_ATTEMPTS:
+                time.sleep(RETRY_DELAY * 2**attempt)
+        self._lost = True
+        FAILED_ITEMS.inc(len(items), pipeline=name)
+        try:
+            self.failed_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.failed_path.open("ab") as f:
+                f.write(b"".join(fastjson.dumps_line(item) for item in items))
+        except Exception as e:
+            log.error(
+                "%s lost %s items after %s attempts: writing %s failed: %r",
+                name,
+                len(items),
+                MAX_ATTEMPTS,
+                self.failed_path,
+                e,
+            )
+            return
+        log.error(
+            "%s gave up on %s items after %s attempts, kept in %s", name, len(items), MAX_ATTEMPTS, self.failed_path
+        )
+
+
+def run_after_saved(
+    pipelines: Iterable[BasePipeline], callback: Callable[[], None], on_lost: Callable[[], None]
+) -> None:
+    """
+    Run `callback` once the write-behind pipelines among `pipelines` have
+    stored every item handed to them so far (at once if there are none),
+    or `on_lost` instead if one of them had to give up on a batch.
+    """
+    deferring = [pipeline for pipeline in pipelines if isinstance(pipeline, WriteBehindPipeline)]
+    if not deferring:
+        callback()
+        return
+    lock = threading.Lock()
+    state = {"left": len(deferring), "saved": True}
+
+    def done(saved: bool) -> None:
+        with lock:
+            state["left"] -= 1
+            state["saved"] = state["saved"] and saved
+            if state["left"]:
+                return
+        (callback if state["saved"] else on_lost)()
+
+    for pipeline in deferring:
+        pipeline.after_saved(done)
+
+
+def drain_write_behind(pipelines: Iterable[BasePipeline]) -> bool:
+    """
+    `flush()` every write-behind pipeline among `pipelines`; False if any of
+    them lost items.
+    """
+    saved = True
+    for pipeline in pipelines:
+        if isinstance(pipeline, WriteBehindPipeline):
+            pipeline.flush()
+            saved = saved and not pipeline.lost
+    return saved
+
+
+class WriteBehindMongitaPipeline(WriteBehindPipeline):
+    inner_class = MongitaPipeline
+
+
+class WriteBehindJsonlPipeline(WriteBehindPipeline):
+    inner_class = NotesJsonlPipeline
+
+
+class WriteBehindSqlitePipeline(WriteBehindPipeline):
+    inner_class = SqlitePipeline
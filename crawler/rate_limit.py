@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class LimiterConfig:
+    name: str
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    initial_rate: float = 10.0
+    min_rate: float = 0.5
+    max_rate: float = 50.0
+    # Responses slower than this count as congestion, like a 429.
+    target_latency: float = 3.0
+    decrease_factor: float = 0.5
+    # Successful responses needed before each additive increase.
+    increase_every: int = 10
+    rate_step: float = 1.0
+    # Minimum spacing between two decreases, so one burst of failures from
+    # requests that were already in flight only halves the limits once.
+    decrease_cooldown: float = 1.0
+
+
+def limiter_config_from_env(name: str, **defaults) -> LimiterConfig:
+    """
+    Build a config for endpoint `name`, overridable through
+    `BIJI_<NAME>_MAX_CONCURRENCY`, `BIJI_<NAME>_MAX_RPS` and
+    `BIJI_<NAME>_TARGET_LATENCY`.
+    """
+    config = LimiterConfig(name=name, **defaults)
+    prefix = f"BIJI_{name.upper()}_"
+    if os.getenv(prefix + "MAX_CONCURRENCY"):
+        max_concurrency = max(1, int(os.environ[prefix + "MAX_CONCURRENCY"]))
+        config = replace(
+            config,
+            max_concurrency=max_concurrency,
+            initial_concurrency=min(config.initial_concurrency, max_concurrency),
+            min_concurrency=min(config.min_concurrency, max_concurrency),
+        )
+    if os.getenv(prefix + "MAX_RPS"):
+        max_rate = max(0.01, float(os.environ[prefix + "MAX_RPS"]))
+        config = replace(
+            config,
+            max_rate=max_rate,
+            initial_rate=min(config.initial_rate, max_rate),
+            min_rate=min(config.min_rate, max_rate),
+        )
+    if os.getenv(prefix + "TARGET_LATENCY"):
+        config = replace(config, target_latency=float(os.environ[prefix + "TARGET_LATENCY"]))
+    return config
+
+
+def is_congestion_status(status: int | None) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limiter for one endpoint: caps requests in flight and request rate.
+
+    Every `increase_every` fast successes add one slot and `rate_step` req/s;
+    a 429, 5xx, transport error or slow response multiplies both by
+    `decrease_factor`. `on_change(limiter, reason)` fires whenever the limits
+    move.
+    """
+
+    def __init__(
+        self,
+        config: LimiterConfig,
+        *,
+        on_change: Callable[["AdaptiveLimiter", str], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self._on_change = on_change
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._concurrency = config.initial_concurrency
+        self._rate = config.initial_rate
+        self._in_flight = 0
+        self._next_slot_at = 0.0
+        self._successes = 0
+        self._last_decrease_at = -math.inf
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _reserve(self) -> float:
+        """
+        Take a slot if one is free and the rate allows it. Returns 0.0 on
+        success, otherwise how long to wait before trying again. Caller holds
+        the lock.
+        """
+        if self._in_flight >= self._concurrency:
+            return 0.05
+        now = self._clock()
+        if now < self._next_slot_at:
+            return self._next_slot_at - now
+        self._next_slot_at = max(now, self._next_slot_at) + 1.0 / self._rate
+        self._in_flight += 1
+        return 0.0
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be sent; returns the start timestamp to hand
+        back to `release`.
+        """
+        with self._cond:
+            while True:
+                wait = self._reserve()
+                if wait <= 0:
+                    return self._clock()
+                self._cond.wait(wait)
+
+    async def acquire_async(self) -> float:
+        """
+        `acquire` for event-loop callers: waits with `asyncio.sleep` instead
+        of blocking the thread.
+        """
+        while True:
+            with self._cond:
+                wait = self._reserve()
+                if wait <= 0:
+                    return self._clock()
+            await asyncio.sleep(wait)
+
+    def release(self, started_at: float, *, status: int | None = None, error: bool = False) -> None:
+        latency = self._clock() - started_at
+        congested = error or is_congestion_status(status) or latency > self.config.target_latency
+        reason = ""
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            if congested:
+                reason = self._decrease(status, error, latency)
+            elif status is None or status < 400:
+                reason = self._increase()
+            self._cond.notify_all()
+        if reason and self._on_change is not None:
+            self._on_change(self, reason)
+
+    def _decrease(self, status: int | None, error: bool, latency: float) -> str:
+        now = self._clock()
+        self._successes = 0
+        if now - self._last_decrease_at < self.config.decrease_cooldown:
+            return ""
+        self._last_decrease_at = now
+        concurrency = max(self.config.min_concurrency, int(self._concurrency * self.config.decrease_factor))
+        rate = max(self.config.min_rate, self._rate * self.config.decrease_factor)
+        if (concurrency, rate) == (self._concurrency, self._rate):
+            return ""
+        self._concurrency, self._rate = concurrency, rate
+        if error:
+            return "error"
+        if is_congestion_status(status):
+            return f"status={status}"
+        return f"latency={latency:.2f}s"
+
+    def _increase(self) -> str:
+        self._successes += 1
+        if self._successes < self.config.increase_every:
+            return ""
+        self._successes = 0
+        concurrency = min(self.config.max_concurrency, self._concurrency + 1)
+        rate = min(self.config.max_rate, self._rate + self.config.rate_step)
+        if (concurrency, rate) == (self._concurrency, self._rate):
+            return ""
+        self._concurrency, self._rate = concurrency, rate
+        return "increase"
+
+
+def endpoint_limiters_from_env(
+    on_change: Callable[[AdaptiveLimiter, str], None] | None = None,
+    *,
+    detail_max_concurrency: int = 32,
+) -> dict[str, AdaptiveLimiter]:
+    """
+    The `notes` and `detail` budgets used by the crawl engines; empty when
+    `BIJI_ADAPTIVE_LIMIT=0`.
+    """
+    if os.getenv("BIJI_ADAPTIVE_LIMIT", "1").strip() in ("0", "false", "False"):
+        return {}
+    # Pagination is sequential per sort pass, so list pages need few slots.
+    return {
+        "notes": AdaptiveLimiter(
+            limiter_config_from_env("notes", initial_concurrency=2, max_concurrency=4, initial_rate=5.0, max_rate=20.0),
+            on_change=on_change,
+        ),
+        "detail": AdaptiveLimiter(
+            limiter_config_from_env(
+                "detail",
+                initial_concurrency=min(4, detail_max_concurrency),
+                max_concurrency=detail_max_concurrency,
+                initial_rate=10.0,
+                max_rate=50.0,
+            ),
+            on_change=on_change,
+        ),
+    }
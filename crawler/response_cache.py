@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from crawler import metrics
+
+CACHE_LOOKUPS = metrics.counter("biji_detail_cache_total", "Link detail cache lookups and writes, by result.")
+
+# magic + stored_at (unix seconds), followed by the zlib-compressed body.
+_HEADER = struct.Struct("<4sd")
+_MAGIC = b"BJC1"
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class DetailResponseCache:
+    """
+    On-disk cache of link detail response bodies, keyed by note id and the
+    note's version (`updated_at`), so an unchanged note is not fetched again.
+
+    Each body is zlib-compressed into `<root>/<key[:2]>/<key>.z`. Entries
+    older than `ttl` seconds count as misses (`ttl=0` keeps them forever),
+    and once the files exceed `max_bytes` the least recently used ones are
+    evicted; recency survives restarts through the file mtime.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int = 1 << 30, ttl: float = 30 * 86_400, level: int = 6):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.level = level
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        # key -> compressed size, least recently used first.
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+
+        found = []
+        if root.exists():
+            for path in root.glob("*/*.z"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, path.stem, st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    @staticmethod
+    def _key(note_id: str, version: str) -> str:
+        return hashlib.sha1(f"{note_id}\n{version}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.z"
+
+    def _count(self, result: str) -> None:
+        setattr(self.stats, result, getattr(self.stats, result) + 1)
+        CACHE_LOOKUPS.inc(result=result)
+
+    def get(self, note_id: str, version: str) -> bytes | None:
+        """
+        Cached body for this version of the note, or None. Without a version
+        there is nothing to validate against, so nothing is served.
+        """
+        if not version:
+            return None
+        key = self._key(note_id, version)
+        with self._lock:
+            known = key in self._entries
+        if not known:
+            with self._lock:
+                self._count("misses")
+            return None
+
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            magic, stored_at = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError("bad cache header")
+            if self.ttl and time.time() - stored_at > self.ttl:
+                with self._lock:
+                    self._count("expired")
+                    self._count("misses")
+                    self._drop(key)
+                return None
+            body = zlib.decompress(memoryview(data)[_HEADER.size :])
+        except (OSError, ValueError, struct.error, zlib.error):
+            # Evicted by another thread, or a torn file: treat as a miss.
+            with self._lock:
+                self._count("misses")
+                self._drop(key)
+            return None
+
+        with self._lock:
+            self._count("hits")
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return body
+
+    def put(self, note_id: str, version: str, body: bytes) -> None:
+        if not version:
+            return
+        key = self._key(note_id, version)
+        data = _HEADER.pack(_MAGIC, time.time()) + zlib.compress(body, self.level)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._count("stores")
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._count("evictions")
+
+    def _drop(self, key: str) -> None:
+        # Caller holds the lock.
+        size = self._entries.pop(key, None)
+        if size is None:
+            return
+        self._total_bytes -= size
+        self._path(key).unlink(missing_ok=True)
+
+
+def detail_cache_from_env() -> DetailResponseCache | None:
+    """
+    `BIJI_DETAIL_CACHE_DIR` enables the cache; `BIJI_DETAIL_CACHE_MAX_MB`
+    (default 1024) and `BIJI_DETAIL_CACHE_TTL` (seconds, default 30 days,
+    `0` for none) bound it.
+    """
+    root = os.getenv("BIJI_DETAIL_CACHE_DIR", "").strip()
+    if not root:
+        return None
+    return DetailResponseCache(
+        Path(root),
+        max_bytes=int(float(os.getenv("BIJI_DETAIL_CACHE_MAX_MB", "1024")) * (1 << 20)),
+        ttl=float(os.getenv("BIJI_DETAIL_CACHE_TTL", str(30 * 86_400))),
+    )
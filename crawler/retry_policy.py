@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import os
+import random
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from crawler import metrics
+
+RETRIES = metrics.counter("biji_retries_total", "Fetches re-scheduled after a backoff, by endpoint.")
+
+
+class RetriesExhausted(Exception):
+    def __init__(self, attempts: int, error: BaseException):
+        super().__init__(f"gave up after {attempts} attempts: {error!r}")
+        self.attempts = attempts
+        self.error = error
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Exponential backoff with jitter: attempt `n` (1-based) waits a random
+    time in `[(1 - jitter) * d, d]` where `d = min(max_delay, base_delay * 2**(n-1))`.
+    """
+
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    jitter: float = 1.0
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+    def delay(self, attempt: int, *, rand: Callable[[], float] = random.random) -> float:
+        cap = min(self.max_delay, self.base_delay * 2 ** max(0, attempt - 1))
+        return cap * (1 - self.jitter + self.jitter * rand())
+
+
+def retry_policy_from_env(endpoint: str, **defaults) -> RetryPolicy:
+    """
+    `BIJI_<ENDPOINT>_MAX_ATTEMPTS` / `_RETRY_BASE_DELAY` / `_RETRY_MAX_DELAY`
+    override the given defaults.
+    """
+    prefix = f"BIJI_{endpoint.upper()}_"
+    policy = RetryPolicy(**defaults)
+    return RetryPolicy(
+        max_attempts=max(1, int(os.getenv(prefix + "MAX_ATTEMPTS", str(policy.max_attempts)))),
+        base_delay=float(os.getenv(prefix + "RETRY_BASE_DELAY", str(policy.base_delay))),
+        max_delay=float(os.getenv(prefix + "RETRY_MAX_DELAY", str(policy.max_delay))),
+        jitter=policy.jitter,
+    )
+
+
+def endpoint_retry_policies_from_env() -> Dict[str, RetryPolicy]:
+    # A lost notes page stalls a whole sort pass, so it gets more patience.
+    return {
+        "notes": retry_policy_from_env("notes", max_attempts=8, base_delay=1.0, max_delay=60.0),
+        "detail": retry_policy_from_env("detail", max_attempts=5, base_delay=0.5, max_delay=30.0),
+    }
+
+
+class DelayedRetries:
+    """
+    Runs retry callbacks after their backoff on daemon timers, tracking how
+    many are still waiting so a crawl does not end underneath them.
+    """
+
+    def __init__(self):
+        self._pending = 0
+        self._timers: set[threading.Timer] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def schedule(self, delay: float, fn: Callable, *args) -> None:
+        def fire():
+            try:
+                fn(*args)
+            finally:
+                # Only after `fn` re-queued the work, so there is no gap in
+                # which the crawl looks idle.
+                with self._lock:
+                    if timer in self._timers:
+                        self._timers.discard(timer)
+                        self._pending -= 1
+
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        with self._lock:
+            self._pending += 1
+            self._timers.add(timer)
+        timer.start()
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            timers, self._timers = self._timers, set()
+            self._pending -= len(timers)
+        for timer in timers:
+            timer.cancel()
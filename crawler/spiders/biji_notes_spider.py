@@ -1,155 +1,301 @@
 from __future__ import annotations
 
+import dataclasses
+import functools
 import os
 import time
 
 import feapder.setting as setting
+import requests
 from feapder import AirSpider
 from feapder.network.item import Item
 from feapder.network.request import Request
+from feapder.network.response import Response
 from feapder.utils.log import log
 
-from crawler.biji_notes_logic import parse_notes_page
-from crawler.biji_auth import TokenBundle, decode_jwt_exp, refresh_access_token
+from crawler import fastjson
+from crawler.biji_api import (
+    ApiClientConfig,
+    build_api_headers,
+    link_detail_url,
+    note_id_from_detail_url,
+    notes_url,
+    record_request,
+)
+from crawler.biji_auth import account_id_from_token
 from crawler.biji_detail_logic import parse_link_detail
+from crawler.biji_notes_logic import parse_notes_page
+from crawler.crawl_scheduler import DETAIL_PRIORITY, NOTES_PRIORITY, PaginationGate, SchedulerConfig
+from crawler.crawl_session import (
+    CrawlOptions,
+    CrawlSession,
+    detail_item,
+    log_cache_stats,
+    log_limits,
+    note_item,
+)
+from crawler.dead_letters import DeadLetterStore, dead_letter_store_from_env
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.pipelines.write_behind_pipeline import drain_write_behind, run_after_saved
+from crawler.rate_limit import endpoint_limiters_from_env, is_congestion_status
+from crawler.response_cache import detail_cache_from_env
+from crawler.retry_policy import RETRIES, DelayedRetries, endpoint_retry_policies_from_env
+from crawler.token_manager import TokenManager
 
 
 class BijiNotesSpider(AirSpider):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, resume: bool = False, replay_dead_letters: bool = False, **kwargs):
+        if os.getenv("BIJI_THREAD_COUNT") and not args:
+            kwargs.setdefault("thread_count", int(os.environ["BIJI_THREAD_COUNT"]))
         super().__init__(*args, **kwargs)
-        self._user_agent = os.getenv(
-            "BIJI_USER_AGENT",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36",
+        self._api_config = ApiClientConfig.from_env()
+        self._tokens = TokenManager.from_config(self._api_config)
+
+        options = CrawlOptions.from_env()
+        if replay_dead_letters:
+            # A replay only re-drives dead-lettered details; it must not touch
+            # the pagination checkpoint or the incremental watermark.
+            options = dataclasses.replace(options, checkpoint=False, incremental=False)
+        self._replay_dead_letters = replay_dead_letters
+        self._limit = options.limit
+        self._sort = options.sort
+        self._session = CrawlSession(
+            options,
+            account_id=os.getenv("BIJI_ACCOUNT_ID", "").strip() or account_id_from_token(self._tokens.bundle.access_token),
+            resume=resume,
         )
+        self._limiters = endpoint_limiters_from_env(log_limits)
+        self._gate = PaginationGate(SchedulerConfig.from_env())
+        self._detail_cache = detail_cache_from_env()
+        self._retry_policies = endpoint_retry_policies_from_env()
+        self._retry_timers = DelayedRetries()
+        self._dead_letter_store: DeadLetterStore | None = None
+        # Dead-lettered note ids of this account; a successful fetch resolves them.
+        self._dead_lettered: set[str] = set()
+        self._metrics_writer = None
 
-        bearer = os.getenv("BIJI_BEARER_TOKEN", "").strip()
-        refresh_token = os.getenv("BIJI_REFRESH_TOKEN", "").strip()
-        csrf_token = os.getenv("BIJI_CSRF_TOKEN", "").strip() or None
-        cookie = os.getenv("BIJI_COOKIE", "").strip() or None
-
-        bearer_exp = decode_jwt_exp(bearer) if bearer else None
-
-        if refresh_token:
-            # Prefer ensuring a fresh token upfront when refresh_token exists.
-            if (not bearer) or (bearer_exp is not None and int(time.time()) >= bearer_exp - 300):
-                self._token_bundle = refresh_access_token(
-                    refresh_token=refresh_token,
-                    access_token=bearer or None,
-                    csrf_token=csrf_token,
-                    cookie=cookie,
-                    user_agent=self._user_agent,
-                    request_id=str(int(time.time() * 1000)),
-                )
-            else:
-                self._token_bundle = TokenBundle(
-                    access_token=bearer,
-                    access_token_expire_at=bearer_exp,
-                    refresh_token=refresh_token,
-                    refresh_token_expire_at=None,
-                )
-        elif bearer:
-            self._token_bundle = TokenBundle(
-                access_token=bearer,
-                access_token_expire_at=bearer_exp,
-                refresh_token=None,
-                refresh_token_expire_at=None,
-            )
-        else:
-            self._token_bundle = refresh_access_token(
-                refresh_token=refresh_token,
-                access_token=None,
-                csrf_token=csrf_token,
-                cookie=cookie,
-                user_agent=self._user_agent,
-                request_id=str(int(time.time() * 1000)),
-            )
-            # (unreachable)
+    def start_callback(self):
+        self._tokens.start()
+        self._metrics_writer = start_metrics_writer_from_env()
 
-        self._csrf_token = csrf_token
-        self._cookie = cookie
+    def start_requests(self):
+        letters = self._dead_letters().list("detail", account=self._session.account_id)
+        self._dead_lettered = {str(letter["note_id"]) for letter in letters}
+        if self._replay_dead_letters:
+            log.info("replaying dead-lettered details: account=%s count=%s", self._session.account_id, len(letters))
+            self._gate.details_scheduled(None, len(letters))
+            for letter in letters:
+                yield self._make_link_detail_request(str(letter["note_id"]), str(letter.get("version") or ""))
+            return
 
-        self._limit = int(os.getenv("BIJI_LIMIT", "100"))
-        self._sort = os.getenv("BIJI_SORT", "create_desc")
-        self._since_id = os.getenv("BIJI_SINCE_ID", "")
-        self._fetch_detail = os.getenv("BIJI_FETCH_DETAIL", "1").strip() not in ("0", "false", "False")
+        starts, replay_details = self._session.start()
+        for sort, since_id in starts.items():
+            yield self._make_notes_request(since_id, sort=sort)
+        self._gate.details_scheduled(None, len(replay_details))
+        for note_id, version in replay_details:
+            yield self._make_link_detail_request(note_id, version)
 
-    def start_requests(self):
-        yield self._make_notes_request(self._since_id)
+    def end_callback(self):
+        self._retry_timers.cancel_all()
+        self._tokens.stop()
+        # AirSpider stops the ItemBuffer without waiting for it, and a
+        # write-behind pipeline may still be writing (and running the
+        # checkpoint callbacks); only its own close() would drain it.
+        if not drain_write_behind(self._item_pipelines()) or self._item_buffer.export_falied_times:
+            self._session.storage_failed()
+        self._session.finish()
+        if self._detail_cache is not None:
+            log_cache_stats(self._detail_cache)
+        if self._metrics_writer is not None:
+            self._metrics_writer.stop()
+
+    def _dead_letters(self) -> DeadLetterStore:
+        if self._dead_letter_store is None:
+            self._dead_letter_store = dead_letter_store_from_env()
+        return self._dead_letter_store
+
+    def all_thread_is_done(self):
+        # Requests waiting out a retry backoff are in neither the queue nor a
+        # parser thread.
+        return self._retry_timers.pending == 0 and super().all_thread_is_done()
 
     def _ensure_access_token(self) -> str:
-        bundle = self._token_bundle
-        if not bundle.refresh_token and bundle.access_token_expire_at and bundle.needs_refresh(refresh_before_seconds=0):
-            raise RuntimeError("Access token expired and no refresh token; please re-login to refresh env.")
-
-        if bundle.refresh_token and bundle.needs_refresh():
-            try:
-                self._token_bundle = refresh_access_token(
-                    refresh_token=bundle.refresh_token,
-                    access_token=bundle.access_token,
-                    csrf_token=self._csrf_token,
-                    cookie=self._cookie,
-                    user_agent=self._user_agent,
-                    request_id=str(int(time.time() * 1000)),
-                )
-            except Exception:
-                self._token_bundle = refresh_access_token(
-                    refresh_token=bundle.refresh_token,
-                    access_token=None,
-                    csrf_token=self._csrf_token,
-                    cookie=self._cookie,
-                    user_agent=self._user_agent,
-                    request_id=str(int(time.time() * 1000)),
-                )
-        return self._token_bundle.access_token
+        return self._tokens.access_token()
 
-    def _make_notes_request(self, since_id: str, *, auth_retry: bool = False):
+    def _make_notes_request(self, since_id: str, *, sort: str | None = None, auth_retry: bool = False):
         token = self._ensure_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": self._user_agent,
-            "X-Request-ID": str(int(time.time() * 1000)),
-        }
-        if self._csrf_token:
-            headers["Xi-Csrf-Token"] = self._csrf_token
-        if auth_retry:
-            headers["X-Auth-Retry"] = "1"
+        sort = sort or self._sort
         return Request(
-            "https://get-notes.luojilab.com/voicenotes/web/notes",
-            headers=headers,
-            params={"limit": str(self._limit), "since_id": since_id, "sort": self._sort},
+            notes_url(),
+            headers=build_api_headers(token, self._api_config, auth_retry=auth_retry),
+            params={"limit": str(self._limit), "since_id": since_id, "sort": sort},
             filter_repeat=False,
+            priority=NOTES_PRIORITY,
+            endpoint="notes",
+            page_key=_page_key(sort, since_id),
         )
 
-    def _make_link_detail_request(self, note_id: str):
+    def _make_link_detail_request(self, note_id: str, version: str = "", *, page_key: str | None = None):
         token = self._ensure_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "User-Agent": self._user_agent,
-            "X-Request-ID": str(int(time.time() * 1000)),
-        }
-        if self._csrf_token:
-            headers["Xi-Csrf-Token"] = self._csrf_token
         return Request(
-            f"https://get-notes.luojilab.com/voicenotes/web/notes/{note_id}/links/detail",
-            headers=headers,
+            link_detail_url(note_id),
+            headers=build_api_headers(token, self._api_config),
             callback="parse_link_detail",
             filter_repeat=False,
+            priority=DETAIL_PRIORITY,
+            endpoint="detail",
+            note_version=version,
+            page_key=page_key,
+        )
+
+    def _queue_request(self, request) -> None:
+        request.parser_name = request.parser_name or self.name
+        self._request_buffer.put_request(request)
+
+    def _item_pipelines(self):
+        # feapder keeps the pipelines it built from ITEM_PIPELINES here.
+        return self._item_buffer._pipelines
+
+    def _after_items_stored(self, callback) -> None:
+        # feapder's ItemBuffer runs a queued callable once the items queued
+        # before it are exported, and not at all when the export fails. It
+        # does run the callables of later batches, though, so once any
+        # export has failed (the attribute is feapder's spelling) nothing
+        # may move the checkpoint any more. A write-behind pipeline has only
+        # queued the items by then; it runs the callback once they are written.
+        def exported():
+            if self._item_buffer.export_falied_times:
+                self._session.storage_failed()
+            run_after_saved(self._item_pipelines(), callback, self._session.storage_failed)
+
+        self._item_buffer.put_item(exported)
+
+    def _detail_finished(self, request) -> None:
+        # Parked page requests are queued directly, as this also runs from
+        # exception_request where yielded requests count as retries.
+        for next_page in self._gate.detail_finished(getattr(request, "page_key", None)):
+            self._queue_request(next_page)
+
+    def _page_failed(self, request) -> None:
+        for next_page in self._gate.page_failed(getattr(request, "page_key", None)):
+            self._queue_request(next_page)
+
+    def download_midware(self, request):
+        request.from_cache = False
+        endpoint = getattr(request, "endpoint", "")
+        # Retries bypass the cache in case the cached body is what failed.
+        if endpoint == "detail" and self._detail_cache is not None and getattr(request, "attempt", 1) == 1:
+            body = self._detail_cache.get(note_id_from_detail_url(request.url), getattr(request, "note_version", ""))
+            if body is not None:
+                request.from_cache = True
+                return request, _cached_response(request, body)
+
+        limiter = self._limiters.get(getattr(request, "endpoint", ""))
+        if limiter is not None:
+            request.limiter_started_at = limiter.acquire()
+        # Requests can sit in the queue (or come back for a retry) across a
+        # token rotation; always send the current one.
+        request.headers["Authorization"] = f"Bearer {self._ensure_access_token()}"
+        request.sent_at = time.perf_counter()
+        return request
+
+    def _record_request(self, request, status) -> None:
+        sent_at = getattr(request, "sent_at", None)
+        request.sent_at = None
+        record_request(getattr(request, "endpoint", ""), status, time.perf_counter() - sent_at if sent_at else None)
+
+    def _release_limiter(self, request, *, status: int | None = None, error: bool = False) -> None:
+        started_at = getattr(request, "limiter_started_at", None)
+        limiter = self._limiters.get(getattr(request, "endpoint", ""))
+        if limiter is None or started_at is None:
+            return
+        request.limiter_started_at = None
+        limiter.release(started_at, status=status, error=error)
+
+    def validate(self, request, response):
+        if request.from_cache:
+            return
+        self._record_request(request, response.status_code)
+        self._release_limiter(request, status=response.status_code)
+        if is_congestion_status(response.status_code):
+            # Raising hands the request back to feapder's retry queue.
+            raise RuntimeError(f"server congestion: status={response.status_code}")
+
+    def exception_request(self, request, response, e):
+        # Transport errors never reach validate, so the slot is still held.
+        if response is None:
+            self._record_request(request, "error")
+        self._release_limiter(request, error=True)
+
+        endpoint = getattr(request, "endpoint", "")
+        policy = self._retry_policies.get(endpoint)
+        if policy is None:
+            yield request
+            return
+
+        # feapder would re-queue immediately; wait out a backoff instead.
+        # Yielding nothing keeps feapder from re-queueing the request itself.
+        request.attempt = getattr(request, "attempt", 1)
+        if policy.should_retry(request.attempt):
+            delay = policy.delay(request.attempt)
+            log.info(
+                "retrying %s request: url=%s attempt=%s delay=%.2fs error=%r",
+                endpoint,
+                request.url,
+                request.attempt,
+                delay,
+                e,
+            )
+            RETRIES.inc(endpoint=endpoint)
+            request.attempt += 1
+            self._retry_timers.schedule(delay, self._queue_request, request)
+        else:
+            self._give_up(request, e)
+
+    def _give_up(self, request, e) -> None:
+        endpoint = getattr(request, "endpoint", "")
+        if endpoint != "detail":
+            log.error(
+                "%s request failed after %s attempts, cursor kept for --resume: url=%s error=%r",
+                endpoint,
+                request.attempt,
+                request.url,
+                e,
+            )
+            if endpoint == "notes":
+                self._page_failed(request)
+            return
+
+        note_id = note_id_from_detail_url(request.url)
+        log.error("link detail dead-lettered: note_id=%s attempts=%s error=%r", note_id, request.attempt, e)
+        self._dead_letters().record(
+            endpoint="detail",
+            note_id=note_id,
+            error=repr(e),
+            attempts=request.attempt,
+            account=self._session.account_id,
+            version=getattr(request, "note_version", ""),
         )
+        self._session.detail_abandoned(note_id)
+        self._detail_finished(request)
 
     def parse(self, request, response):
         payload = None
         try:
-            payload = response.json
+            # feapder's `response.json` decodes via requests and the stdlib.
+            payload = fastjson.loads(response.content)
         except Exception:
             payload = None
 
-        if response.status_code == 403 or (isinstance(payload, dict) and payload.get("message") == "LoginRequired"):
-            since_id = ""
-            try:
-                since_id = (getattr(request, "params", None) or {}).get("since_id", "")  # type: ignore[union-attr]
-            except Exception:
-                since_id = ""
+        params = {}
+        try:
+            params = getattr(request, "params", None) or {}
+        except Exception:
+            params = {}
+        since_id = params.get("since_id", "")
+        sort = params.get("sort") or self._sort
 
+        if response.status_code == 403 or (isinstance(payload, dict) and payload.get("message") == "LoginRequired"):
             log.error(
                 "notes page rejected: status=%s since_id=%s body=%s",
                 response.status_code,
@@ -157,17 +303,14 @@ class BijiNotesSpider(AirSpider):
                 (response.text or "")[:200],
             )
 
-            if self._token_bundle.refresh_token and not (getattr(request, "headers", {}) or {}).get("X-Auth-Retry"):
+            headers = getattr(request, "headers", {}) or {}
+            if self._tokens.bundle.refresh_token and not headers.get("X-Auth-Retry"):
                 log.info("attempting token refresh and retry notes page once...")
-                self._token_bundle = refresh_access_token(
-                    refresh_token=self._token_bundle.refresh_token,
-                    access_token=self._token_bundle.access_token,
-                    csrf_token=self._csrf_token,
-                    cookie=self._cookie,
-                    user_agent=self._user_agent,
-                    request_id=str(int(time.time() * 1000)),
-                )
-                yield self._make_notes_request(since_id, auth_retry=True)
+                # Single-flight: a token another worker already rotated is not refreshed again.
+                self._tokens.refresh(stale_token=headers.get("Authorization", "").removeprefix("Bearer "))
+                yield self._make_notes_request(since_id, sort=sort, auth_retry=True)
+            else:
+                self._page_failed(request)
             return
 
         if not isinstance(payload, dict) or "c" not in payload:
@@ -176,57 +319,62 @@ class BijiNotesSpider(AirSpider):
                 response.status_code,
                 (response.text or "")[:200],
             )
+            self._page_failed(request)
             return
 
         page = parse_notes_page(payload, limit=self._limit)
+        outcome = self._session.handle_page(sort=sort, since_id=since_id, page=page)
 
-        since_id = ""
-        try:
-            since_id = (getattr(request, "params", None) or {}).get("since_id", "")  # type: ignore[union-attr]
-        except Exception:
-            since_id = ""
-
-        log.info(
-            "notes page fetched: count=%s limit=%s since_id=%s next_since_id=%s should_continue=%s",
-            len(page.notes),
-            self._limit,
-            since_id,
-            page.next_since_id,
-            page.should_continue,
-        )
+        for note in outcome.notes:
+            yield Item(**note_item(note))
+        page_key = _page_key(sort, since_id)
+        yield from self._gate.details_scheduled(page_key, len(outcome.details))
+        for note_id, version in outcome.details:
+            yield self._make_link_detail_request(note_id, version, page_key=page_key)
 
-        link_count = 0
-        for note in page.notes:
-            note_id = note.get("id") or note.get("note_id")
-            yield Item(kind="note", note_id=note_id, raw=note)
+        # The cursor moves past this page only once its notes are stored;
+        # until then they sit in feapder's ItemBuffer.
+        self._after_items_stored(functools.partial(self._session.page_done, outcome))
 
-            if self._fetch_detail and note_id and note.get("note_type") == "link":
-                link_count += 1
-                yield self._make_link_detail_request(str(note_id))
+        if outcome.next_since_id is not None:
+            next_page = self._make_notes_request(outcome.next_since_id, sort=sort)
+            released = self._gate.offer_page(next_page, next_page.page_key)
+            yield from released
+            if not any(r is next_page for r in released):
+                log.info(
+                    "pagination parked: sort=%s pages_ahead=%s pending_details=%s",
+                    sort,
+                    self._gate.pages_ahead,
+                    self._gate.pending_details,
+                )
 
-        if self._fetch_detail:
-            log.info("notes page detail scheduled: link_notes=%s", link_count)
+    def parse_link_detail(self, request, response):
+        note_id = note_id_from_detail_url(request.url)
+        version = getattr(request, "note_version", "")
 
-        if page.should_continue:
-            yield self._make_notes_request(page.next_since_id or "")
+        detail = parse_link_detail(fastjson.loads(response.content))
+        if self._detail_cache is not None and not request.from_cache:
+            self._detail_cache.put(note_id, version, response.content)
+        yield Item(**detail_item(note_id, detail, version))
+        self._after_items_stored(functools.partial(self._session.detail_done, note_id, version))
+        if note_id in self._dead_lettered:
+            self._dead_letters().resolve("detail", note_id)
+            self._dead_lettered.discard(note_id)
+        self._detail_finished(request)
 
-    def parse_link_detail(self, request, response):
-        note_id = ""
-        try:
-            note_id = request.url.split("/voicenotes/web/notes/", 1)[1].split("/", 1)[0]
-        except Exception:
-            note_id = ""
 
-        detail = parse_link_detail(response.json)
-        yield Item(
-            kind="link_detail",
-            note_id=note_id,
-            title=detail.title,
-            web_title=detail.web_title,
-            url=detail.url,
-            has_content=detail.has_content,
-            raw=detail.raw,
-        )
+def _page_key(sort: str, since_id: str) -> str:
+    return f"{sort}:{since_id}"
+
+
+def _cached_response(request, body: bytes) -> Response:
+    raw = requests.Response()
+    raw.status_code = 200
+    raw.url = request.url
+    raw.encoding = "utf-8"
+    raw.headers["Content-Type"] = "application/json"
+    raw._content = body
+    return Response(raw)
 
 
 if __name__ == "__main__":
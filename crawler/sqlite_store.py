@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Sequence
+
+from feapder.utils.log import log
+
+from crawler import fastjson
+from crawler.blob_store import BlobStore, resolve_body
+from crawler.mongita_io import UPSERT_SECONDS, WRITES, UpsertCounts, content_fingerprint, seen_is_stale
+from crawler.storage import NoteStore
+
+SCHEMA_VERSION = 1
+# Rows per keyset page when iterating, and ids per `IN (...)` lookup.
+PAGE_SIZE = 1000
+IN_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    note_id TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT '',
+    note_type TEXT NOT NULL DEFAULT '',
+    fp TEXT,
+    seen_at INTEGER NOT NULL DEFAULT 0,
+    doc BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_created_at ON notes (created_at);
+CREATE INDEX IF NOT EXISTS notes_note_type ON notes (note_type);
+CREATE TABLE IF NOT EXISTS details (
+    id INTEGER PRIMARY KEY,
+    note_id TEXT NOT NULL UNIQUE,
+    source_version TEXT NOT NULL DEFAULT '',
+    fp TEXT,
+    seen_at INTEGER NOT NULL DEFAULT 0,
+    doc BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS misc (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL DEFAULT '',
+    doc BLOB NOT NULL
+);
+"""
+
+_UPSERT = {
+    "notes": (
+        "INSERT INTO notes (note_id, created_at, updated_at, note_type, fp, seen_at, doc) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT (note_id) DO UPDATE SET created_at = excluded.created_at, updated_at = excluded.updated_at,"
+        " note_type = excluded.note_type, fp = excluded.fp, seen_at = excluded.seen_at, doc = excluded.doc"
+    ),
+    "details": (
+        "INSERT INTO details (note_id, source_version, fp, seen_at, doc) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (note_id) DO UPDATE SET source_version = excluded.source_version, fp = excluded.fp,"
+        " seen_at = excluded.seen_at, doc = excluded.doc"
+    ),
+}
+# Notes and details share one FTS table; their rowids are interleaved.
+_FTS_KIND = {"notes": 0, "details": 1}
+
+
+def _chunks(values: Sequence[Any], size: int = IN_CHUNK) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _placeholders(n: int) -> str:
+    return ",".join("?" * n)
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else ""
+
+
+def _searchable(table: str, doc: Mapping[str, Any], blobs: BlobStore | None) -> tuple[str, str]:
+    raw = doc.get("raw") if isinstance(doc.get("raw"), dict) else {}
+    if table == "details":
+        title = _text(doc.get("title")) or _text(raw.get("title"))
+        return title, _text(resolve_body(raw.get("content"), blobs)) or _text(resolve_body(doc.get("content"), blobs))
+    for key in ("content", "body_text", "json_content"):
+        content = _text(resolve_body(raw.get(key), blobs))
+        if content.strip():
+            return _text(raw.get("title")), content
+    return _text(raw.get("title")), ""
+
+
+def _row(table: str, note_id: str, doc: Mapping[str, Any], fp: str, now: int) -> tuple:
+    body = fastjson.dumps(doc)
+    if table == "details":
+        return (note_id, str(doc.get("source_version") or ""), fp, now, body)
+    raw = doc.get("raw") if isinstance(doc.get("raw"), dict) else {}
+    return (
+        note_id,
+        str(raw.get("created_at") or ""),
+        str(raw.get("updated_at") or ""),
+        str(raw.get("note_type") or ""),
+        fp,
+        now,
+        body,
+    )
+
+
+class SqliteStore(NoteStore):
+    """
+    `NoteStore` in a single SQLite file.
+
+    Notes and details are rows keyed by a unique `note_id`, with the full
+    document as JSON plus the columns queries need (`created_at`,
+    `note_type`, `source_version`, the content fingerprint and `_seen_at`);
+    each bulk upsert is one transaction. The database runs in WAL mode, so
+    exports and the crawl's startup reads do not block the pipeline.
+
+    Titles and bodies are indexed in an FTS5 table (trigram tokenizer where
+    SQLite supports it, which also matches Chinese substrings); see
+    `search`; bodies offloaded to `blobs` are read back for indexing. SQLite
+    builds without FTS5 still work, without search.
+    """
+
+    def __init__(self, path: Path, *, blobs: BlobStore | None = None):
+        self.path = path
+        self.blobs = blobs
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self.fts = self._create_fts()
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _create_fts(self) -> bool:
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5"
+                    f"(note_id UNINDEXED, kind UNINDEXED, title, content, tokenize = '{tokenizer}')"
+                )
+                return True
+            except sqlite3.OperationalError as e:
+                if "no such module" in str(e):
+                    log.warning("SQLite was built without FTS5; full-text search is disabled")
+                    return False
+        return False
+
+    def upsert_notes(self, docs, *, now=None) -> UpsertCounts:
+        return self._upsert("notes", docs, now)
+
+    def upsert_details(self, docs, *, now=None) -> UpsertCounts:
+        return self._upsert("details", docs, now)
+
+    def _upsert(self, table: str, docs: Iterable[Mapping[str, Any]], now: int | None) -> UpsertCounts:
+        now = int(time.time()) if now is None else int(now)
+        merged: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            note_id = str(doc["note_id"])
+            merged[note_id] = {**merged.get(note_id, {}), **doc}
+        counts = UpsertCounts()
+        if not merged:
+            return counts
+
+        with self._lock, UPSERT_SECONDS.time(collection=table), self._conn:
+            stored: Dict[str, tuple[str | None, int]] = {}
+            for chunk in _chunks(list(merged)):
+                query = f"SELECT note_id, fp, seen_at FROM {table} WHERE note_id IN ({_placeholders(len(chunk))})"
+                stored.update((note_id, (fp, seen_at)) for note_id, fp, seen_at in self._conn.execute(query, chunk))
+
+            to_write: Dict[str, tuple[Dict[str, Any], str]] = {}
+            touched = []
+            for note_id, doc in merged.items():
+                fp = content_fingerprint(doc)
+                entry = stored.get(note_id)
+                if entry is not None and entry[0] == fp:
+                    counts.unchanged += 1
+                    if seen_is_stale(entry[1], now):
+                        touched.append((now, note_id))
+                    continue
+                for key in ("_id", "_fp", "_seen_at"):
+                    doc.pop(key, None)
+                doc.setdefault("_ts", now)
+                if entry is None:
+                    doc.setdefault("_created_at", now)
+                    counts.inserted += 1
+                else:
+                    counts.updated += 1
+                to_write[note_id] = (doc, fp)
+
+            # Like `$set`: fields the new document lacks keep their stored value.
+            updated = [note_id for note_id in to_write if note_id in stored]
+            for chunk in _chunks(updated):
+                query = f"SELECT note_id, doc FROM {table} WHERE note_id IN ({_placeholders(len(chunk))})"
+                for note_id, body in self._conn.execute(query, chunk):
+                    doc, fp = to_write[note_id]
+                    to_write[note_id] = ({**fastjson.loads(body), **doc}, fp)
+
+            self._conn.executemany(
+                _UPSERT[table], [_row(table, note_id, doc, fp, now) for note_id, (doc, fp) in to_write.items()]
+            )
+            if touched:
+                self._conn.executemany(f"UPDATE {table} SET seen_at = ? WHERE note_id = ?", touched)
+            if self.fts and to_write:
+                self._index_text(table, to_write)
+
+        WRITES.inc(counts.inserted, collection=table, result="inserted")
+        WRITES.inc(counts.updated, collection=table, result="updated")
+        WRITES.inc(counts.unchanged, collection=table, result="unchanged")
+        return counts
+
+    def _index_text(self, table: str, written: Mapping[str, tuple[Dict[str, Any], str]]) -> None:
+        # Caller holds the lock and the transaction.
+        kind = _FTS_KIND[table]
+        rows = []
+        for chunk in _chunks(list(written)):
+            query = f"SELECT id, note_id FROM {table} WHERE note_id IN ({_placeholders(len(chunk))})"
+            for row_id, note_id in self._conn.execute(query, chunk):
+                title, content = _searchable(table, written[note_id][0], self.blobs)
+                rows.append((row_id * 2 + kind, note_id, table, title, content))
+        # FTS5 flushes its pending terms whenever a rowid arrives out of order.
+        rows.sort()
+        self._conn.executemany("DELETE FROM fts WHERE rowid = ?", [(row[0],) for row in rows])
+        self._conn.executemany("INSERT INTO fts (rowid, note_id, kind, title, content) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def insert_misc(self, docs) -> None:
+        rows = []
+        for doc in docs:
+            doc = dict(doc)
+            doc.pop("_id", None)
+            rows.append((str(doc.get("kind") or ""), fastjson.dumps(doc)))
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT INTO misc (kind, doc) VALUES (?, ?)", rows)
+
+    def _iter(self, table: str, columns: str) -> Iterator[tuple]:
+        # Keyset pages, so a long export neither holds the lock nor a cursor
+        # open across the pipeline's writes.
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last, PAGE_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last = rows[-1][0]
+
+    @staticmethod
+    def _doc(fp: str | None, seen_at: int, body: bytes) -> Dict[str, Any]:
+        doc = fastjson.loads(body)
+        doc["_fp"] = fp
+        doc["_seen_at"] = seen_at
+        return doc
+
+    def iter_notes(self):
+        return (self._doc(*row) for row in self._iter("notes", "fp, seen_at, doc"))
+
+    def iter_details(self):
+        return (self._doc(*row) for row in self._iter("details", "fp, seen_at, doc"))
+
+    def iter_misc(self):
+        return (fastjson.loads(body) for (body,) in self._iter("misc", "doc"))
+
+    def get_detail(self, note_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT fp, seen_at, doc FROM details WHERE note_id = ?", (note_id,)).fetchone()
+        return self._doc(*row) if row else None
+
+    def detail_versions(self) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT note_id, source_version FROM details WHERE source_version != ''").fetchall()
+        return dict(rows)
+
+    def count_notes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def count_details(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM details").fetchone()[0]
+
+    def search(self, query: str, *, limit: int = 20) -> List[str]:
+        """
+        Note ids whose title or body (note or link detail) contains `query`,
+        best matches first.
+        """
+        if not self.fts or not query.strip():
+            return []
+        with self._lock:
+            if len(query) < 3:
+                # Trigrams need three characters; shorter terms scan instead.
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = self._conn.execute(
+                    "SELECT note_id FROM fts WHERE title LIKE ?1 ESCAPE '\\' OR content LIKE ?1 ESCAPE '\\' LIMIT ?2",
+                    (pattern, limit * 2),
+                ).fetchall()
+            else:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = self._conn.execute(
+                    "SELECT note_id FROM fts WHERE fts MATCH ? ORDER BY rank LIMIT ?", (phrase, limit * 2)
+                ).fetchall()
+        return list(dict.fromkeys(note_id for (note_id,) in rows))[:limit]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.execute("PRAGMA optimize")
+            self._conn.close()
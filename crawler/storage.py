@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import abc
+import argparse
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Mapping
+
+from crawler.blob_store import BlobStore, blob_store_from_env
+from crawler.mongita_io import MongitaCollections, NoteIdIndex, UpsertCounts, iter_collection, load_keys, open_mongita
+
+BACKENDS = ("mongita", "sqlite")
+
+
+class NoteStore(abc.ABC):
+    """
+    Where crawled notes, link details and other items live.
+
+    Notes and details are keyed by `note_id` and upserted in bulk with the
+    `NoteIdIndex` semantics: repeated ids in a batch are merged in order, a
+    changed document is merged over the stored one (like `$set`), and one
+    with an unchanged content fingerprint is left alone. Everything else
+    goes to `misc`. Reads return documents shaped like the Mongita ones
+    (`raw`, `_ts`, `_fp`, ...), so exporters work against either backend.
+
+    Crawl state (checkpoints, watermarks, dead letters) is not part of the
+    store; it stays in the Mongita `misc`/`dead_letters` collections.
+
+    A backend has to implement every abstract method to be instantiated;
+    `detail_versions` and `close` have working defaults.
+    """
+
+    @abc.abstractmethod
+    def upsert_notes(self, docs: Iterable[Mapping[str, Any]], *, now: int | None = None) -> UpsertCounts:
+        ...
+
+    @abc.abstractmethod
+    def upsert_details(self, docs: Iterable[Mapping[str, Any]], *, now: int | None = None) -> UpsertCounts:
+        ...
+
+    @abc.abstractmethod
+    def insert_misc(self, docs: Iterable[Mapping[str, Any]]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def iter_notes(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def iter_details(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def iter_misc(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def get_detail(self, note_id: str) -> Dict[str, Any] | None:
+        ...
+
+    def detail_versions(self) -> Dict[str, str]:
+        """
+        `note_id -> source_version` of the stored link details.
+        """
+        versions = {}
+        for doc in self.iter_details():
+            note_id = str(doc.get("note_id") or "")
+            version = str(doc.get("source_version") or "")
+            if note_id and version:
+                versions[note_id] = version
+        return versions
+
+    @abc.abstractmethod
+    def count_notes(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def count_details(self) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MongitaStore(NoteStore):
+    """
+    `NoteStore` over the Mongita collections. Unless `load_indexes` is set,
+    the `note_id` indexes are only loaded by the first upsert, so read-only
+    users skip the scan.
+
+    Mongita answers `find_one({"note_id": ...})` with a scan of the whole
+    collection, so `get_detail` goes through a note_id -> `_id` map read
+    from the details' keys (see `load_keys`) on first use, and fetches by
+    `_id` directly; `detail_versions` comes from the same keys. The
+    `iter_*` methods stream through `iter_collection`, so they don't fill
+    Mongita's document cache.
+    """
+
+    def __init__(self, cols: MongitaCollections, *, load_indexes: bool = False):
+        self.cols = cols
+        self._notes_index: NoteIdIndex | None = NoteIdIndex(cols.notes) if load_indexes else None
+        self._details_index: NoteIdIndex | None = NoteIdIndex(cols.details) if load_indexes else None
+        self._detail_ids: Dict[str, Any] | None = None
+
+    def upsert_notes(self, docs, *, now=None) -> UpsertCounts:
+        if self._notes_index is None:
+            self._notes_index = NoteIdIndex(self.cols.notes)
+        return self._notes_index.upsert_many(docs, now=now)
+
+    def upsert_details(self, docs, *, now=None) -> UpsertCounts:
+        if self._details_index is None:
+            self._details_index = NoteIdIndex(self.cols.details)
+        # New details are not in the `_id` map yet.
+        self._detail_ids = None
+        return self._details_index.upsert_many(docs, now=now)
+
+    def insert_misc(self, docs) -> None:
+        docs = [dict(doc) for doc in docs]
+        if docs:
+            self.cols.misc.insert_many(docs)
+
+    def iter_notes(self):
+        return iter_collection(self.cols.notes)
+
+    def iter_details(self):
+        return iter_collection(self.cols.details)
+
+    def iter_misc(self):
+        return iter_collection(self.cols.misc)
+
+    def get_detail(self, note_id: str):
+        if self._detail_ids is None:
+            self._detail_ids = {note_id: key["doc_id"] for note_id, key in load_keys(self.cols.details).items()}
+        doc_id = self._detail_ids.get(str(note_id))
+        # `find_one` by `_id` is a direct lookup, not a scan.
+        return self.cols.details.find_one({"_id": doc_id}) if doc_id is not None else None
+
+    def detail_versions(self) -> Dict[str, str]:
+        # Read from the details' keys, never the documents themselves.
+        versions = {}
+        for note_id, key in load_keys(self.cols.details).items():
+            version = str(key.get("source_version") or "")
+            if version:
+                versions[note_id] = version
+        return versions
+
+    def count_notes(self) -> int:
+        return self.cols.notes.count_documents({})
+
+    def count_details(self) -> int:
+        return self.cols.details.count_documents({})
+
+
+class DetailLookup:
+    """
+    `details_by_note_id` for `export_markdown_from_records` that fetches
+    each detail from the store when it is asked for, instead of holding
+    every detail in memory.
+    """
+
+    def __init__(self, store: NoteStore):
+        self.store = store
+
+    def get(self, note_id: str, default: Any = None) -> Any:
+        detail = self.store.get_detail(note_id) if note_id else None
+        return default if detail is None else detail
+
+
+def open_store(
+    backend: str = "mongita",
+    *,
+    mongita_dir: Path = Path("data/mongita"),
+    db: str = "biji",
+    notes: str = "notes",
+    details: str = "details",
+    misc: str = "misc",
+    sqlite_path: Path = Path("data/biji.sqlite3"),
+    blobs: BlobStore | None = None,
+) -> NoteStore:
+    if backend == "mongita":
+        return MongitaStore(open_mongita(mongita_dir, db, notes, details, misc))
+    if backend == "sqlite":
+        from crawler.sqlite_store import SqliteStore
+
+        return SqliteStore(sqlite_path, blobs=blobs)
+    raise ValueError(f"unknown storage backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def storage_backend_from_env() -> str:
+    return os.getenv("BIJI_STORAGE", "mongita").strip().lower() or "mongita"
+
+
+def open_store_from_env() -> NoteStore:
+    """
+    `BIJI_STORAGE` picks the backend; the Mongita one uses the same
+    `BIJI_MONGITA_*` settings as the pipeline, the SQLite one
+    `BIJI_SQLITE_PATH`.
+    """
+    return open_store(
+        storage_backend_from_env(),
+        mongita_dir=Path(os.getenv("BIJI_MONGITA_DIR", "data/mongita")),
+        db=os.getenv("BIJI_MONGITA_DB", "biji"),
+        notes=os.getenv("BIJI_MONGITA_NOTES_COLLECTION", "notes"),
+        details=os.getenv("BIJI_MONGITA_DETAILS_COLLECTION", "details"),
+        misc=os.getenv("BIJI_MONGITA_MISC_COLLECTION", "misc"),
+        sqlite_path=Path(os.getenv("BIJI_SQLITE_PATH", "data/biji.sqlite3")),
+        blobs=blob_store_from_env(),
+    )
+
+
+def add_storage_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    The storage flags shared by the scripts; defaults come from the same
+    env vars the crawler reads.
+    """
+    parser.add_argument("--storage", choices=BACKENDS, default=storage_backend_from_env())
+    parser.add_argument("--mongita-dir", default=os.getenv("BIJI_MONGITA_DIR", "data/mongita"))
+    parser.add_argument("--db", default=os.getenv("BIJI_MONGITA_DB", "biji"))
+    parser.add_argument("--notes", default=os.getenv("BIJI_MONGITA_NOTES_COLLECTION", "notes"))
+    parser.add_argument("--details", default=os.getenv("BIJI_MONGITA_DETAILS_COLLECTION", "details"))
+    parser.add_argument("--misc", default=os.getenv("BIJI_MONGITA_MISC_COLLECTION", "misc"))
+    parser.add_argument("--sqlite", default=os.getenv("BIJI_SQLITE_PATH", "data/biji.sqlite3"), help="SQLite database file")
+    parser.add_argument(
+        "--blob-dir",
+        default=os.getenv("BIJI_BLOB_DIR", ""),
+        help="Blob store holding offloaded note/detail bodies (default: BIJI_BLOB_DIR, none)",
+    )
+
+
+def open_store_from_args(args: argparse.Namespace) -> NoteStore:
+    return open_store(
+        args.storage,
+        mongita_dir=Path(args.mongita_dir),
+        db=args.db,
+        notes=args.notes,
+        details=args.details,
+        misc=args.misc,
+        sqlite_path=Path(args.sqlite),
+        blobs=blob_store_from_args(args),
+    )
+
+
+def blob_store_from_args(args: argparse.Namespace) -> BlobStore | None:
+    return BlobStore(Path(args.blob_dir)) if args.blob_dir else None
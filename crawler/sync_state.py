@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Iterable, Mapping, Sequence
+
+SORT_FIELDS = {
+    "create_desc": ("created_at", "created_id"),
+    "update_desc": ("updated_at", "updated_id"),
+}
+
+
+@dataclass(frozen=True)
+class Watermark:
+    """
+    High-water mark of an account's already-synced notes.
+
+    `created_*` tracks the newest note by creation time, `updated_*` the most
+    recently edited one. Timestamps are compared as strings, which matches the
+    fixed-width `YYYY-MM-DD HH:MM:SS` values the notes API returns.
+    """
+
+    created_at: str = ""
+    created_id: str = ""
+    updated_at: str = ""
+    updated_id: str = ""
+
+
+def _note_id(note: Mapping[str, Any]) -> str:
+    return str(note.get("id") or note.get("note_id") or "")
+
+
+def _id_key(note_id: str) -> tuple[int, str]:
+    # Numeric ids order by length first, so "10" sorts after "9".
+    return (len(note_id), note_id)
+
+
+def _position(ts: str, note_id: str) -> tuple[str, tuple[int, str]]:
+    return (ts, _id_key(note_id))
+
+
+def is_covered(note: Mapping[str, Any], watermark: Watermark, *, sort: str) -> bool:
+    """
+    Return True if `note` is at or below the watermark for the given sort pass.
+    """
+    ts_field, id_field = SORT_FIELDS[sort]
+    mark_ts = getattr(watermark, ts_field)
+    if not mark_ts:
+        return False
+    ts = str(note.get(ts_field) or "")
+    if not ts:
+        return False
+    return _position(ts, _note_id(note)) <= _position(mark_ts, getattr(watermark, id_field))
+
+
+def page_is_covered(notes: Iterable[Mapping[str, Any]], watermark: Watermark | None, *, sort: str) -> bool:
+    """
+    A page is covered when every note on it is already synced; paging further
+    down a `*_desc` listing can only return older notes.
+    """
+    if watermark is None:
+        return False
+    notes = list(notes)
+    return bool(notes) and all(is_covered(n, watermark, sort=sort) for n in notes)
+
+
+def advance_watermark(watermark: Watermark | None, notes: Iterable[Mapping[str, Any]]) -> Watermark:
+    values = asdict(watermark or Watermark())
+    for note in notes:
+        note_id = _note_id(note)
+        for ts_field, id_field in SORT_FIELDS.values():
+            ts = str(note.get(ts_field) or "")
+            if not ts:
+                continue
+            if _position(ts, note_id) > _position(values[ts_field], values[id_field]):
+                values[ts_field] = ts
+                values[id_field] = note_id
+    return Watermark(**values)
+
+
+@dataclass(frozen=True)
+class CrawlCursor:
+    """
+    Checkpoint of an in-flight crawl.
+
+    `since_ids` maps each sort pass to the `since_id` of its next page, or None
+    once the pass reached its last page. `pending_details` lists the
+    `(note_id, version)` of link notes whose detail fetch was scheduled but
+    not yet stored, so a resumed crawl fetches them conditionally again.
+    """
+
+    since_ids: Mapping[str, str | None]
+    pending_details: Sequence[tuple[str, str]] = ()
+    watermark: Watermark | None = None
+
+    @property
+    def is_done(self) -> bool:
+        return all(v is None for v in self.since_ids.values()) and not self.pending_details
+
+
+def _pending_detail(value: Any) -> tuple[str, str]:
+    # Checkpoints written before versions were kept hold bare note ids.
+    if isinstance(value, (list, tuple)):
+        return str(value[0]), str(value[1] or "")
+    return str(value), ""
+
+
+class SyncStateStore:
+    """
+    Per-account crawl state kept in the Mongita `misc` collection.
+
+    Each record is a single document keyed by `(kind, account)`.
+    """
+
+    WATERMARK_KIND = "sync_watermark"
+    CURSOR_KIND = "crawl_cursor"
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, account: str) -> Mapping[str, Any] | None:
+        return self._collection.find_one({"kind": kind, "account": account})
+
+    def _put(self, kind: str, account: str, values: Mapping[str, Any]) -> None:
+        doc = {"kind": kind, "account": account, **values, "_ts": int(time.time())}
+        with self._lock:
+            if self._get(kind, account) is None:
+                self._collection.insert_one(doc)
+            else:
+                self._collection.update_one({"kind": kind, "account": account}, {"$set": doc})
+
+    def _delete(self, kind: str, account: str) -> None:
+        with self._lock:
+            self._collection.delete_many({"kind": kind, "account": account})
+
+    def load_watermark(self, account: str) -> Watermark | None:
+        doc = self._get(self.WATERMARK_KIND, account)
+        if doc is None:
+            return None
+        return Watermark(**{k: str(doc.get(k) or "") for k in Watermark.__dataclass_fields__})
+
+    def save_watermark(self, account: str, watermark: Watermark) -> None:
+        self._put(self.WATERMARK_KIND, account, asdict(watermark))
+
+    def load_cursor(self, account: str) -> CrawlCursor | None:
+        doc = self._get(self.CURSOR_KIND, account)
+        if doc is None:
+            return None
+        watermark = doc.get("watermark")
+        return CrawlCursor(
+            since_ids=dict(doc.get("since_ids") or {}),
+            pending_details=tuple(_pending_detail(x) for x in doc.get("pending_details") or ()),
+            watermark=Watermark(**watermark) if watermark else None,
+        )
+
+    def save_cursor(self, account: str, cursor: CrawlCursor) -> None:
+        self._put(
+            self.CURSOR_KIND,
+            account,
+            {
+                "since_ids": dict(cursor.since_ids),
+                "pending_details": [list(pending) for pending in sorted(cursor.pending_details)],
+                "watermark": asdict(cursor.watermark) if cursor.watermark else None,
+            },
+        )
+
+    def clear_cursor(self, account: str) -> None:
+        self._delete(self.CURSOR_KIND, account)
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable
+
+from feapder.utils.log import log
+
+from crawler import metrics
+from crawler.biji_api import ApiClientConfig, initial_token_bundle, refresh_token_bundle
+from crawler.biji_auth import TokenBundle
+
+REFRESHES = metrics.counter("biji_token_refreshes_total", "Access-token refreshes by result.")
+
+MIN_REFRESH_INTERVAL = 10.0
+
+
+class TokenManager:
+    """
+    Shares one `TokenBundle` between all crawl workers.
+
+    - `access_token()` reads the current bundle without locking.
+    - `refresh()` is single-flight: concurrent callers wait for the one
+      in-flight refresh instead of firing their own, and a caller holding a
+      token that was already rotated gets the new one without a request.
+    - `start()` runs a daemon thread that refreshes `refresh_before_seconds`
+      ahead of `access_token_expire_at`, so workers never wait on rotation.
+
+    A token that lives no longer than `refresh_before_seconds` is refreshed
+    halfway through its lifetime instead, and scheduled refreshes are at
+    least `min_refresh_interval` apart, so short-lived tokens cannot turn
+    into back-to-back refreshes.
+    """
+
+    def __init__(
+        self,
+        bundle: TokenBundle,
+        refresh_fn: Callable[[TokenBundle], TokenBundle],
+        *,
+        refresh_before_seconds: int = 300,
+        retry_interval: float = 30.0,
+        min_refresh_interval: float = MIN_REFRESH_INTERVAL,
+    ):
+        self._bundle = bundle
+        self._refresh_fn = refresh_fn
+        self._refresh_before = refresh_before_seconds
+        self._retry_interval = retry_interval
+        self._min_interval = min_refresh_interval
+        # When the current bundle was issued; unknown for the one we started with.
+        self._issued_at: float | None = None
+        self._last_attempt = float("-inf")
+        self._cond = threading.Condition()
+        self._refreshing = False
+        self._refresh_count = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_config(cls, config: ApiClientConfig, **kwargs) -> "TokenManager":
+        return cls(initial_token_bundle(config), lambda bundle: refresh_token_bundle(bundle, config), **kwargs)
+
+    @property
+    def bundle(self) -> TokenBundle:
+        return self._bundle
+
+    @property
+    def refresh_count(self) -> int:
+        return self._refresh_count
+
+    def refresh_due_at(self) -> float | None:
+        """
+        When the current token should be rotated (epoch seconds), or None
+        when it has no expiry or there is no refresh token.
+        """
+        bundle = self._bundle
+        if not (bundle.refresh_token and bundle.access_token_expire_at):
+            return None
+        expire_at = float(bundle.access_token_expire_at)
+        if self._issued_at is None:
+            due = expire_at - self._refresh_before
+        else:
+            ttl = max(expire_at - self._issued_at, 0.0)
+            due = self._issued_at + max(ttl - self._refresh_before, ttl / 2)
+        return max(due, self._last_attempt + self._min_interval)
+
+    def access_token(self) -> str:
+        bundle = self._bundle
+        if bundle.access_token_expire_at and bundle.needs_refresh(refresh_before_seconds=0):
+            if not bundle.refresh_token:
+                raise RuntimeError("Access token expired and no refresh token; please re-login to refresh env.")
+            if time.time() - self._last_attempt < self._min_interval:
+                # Just refreshed and still expired: let the request's 403 handling decide.
+                return bundle.access_token
+            return self.refresh(stale_token=bundle.access_token).access_token
+        due = self.refresh_due_at()
+        if self._thread is None and due is not None and time.time() >= due:
+            # No background refresher: rotate inline, still single-flight.
+            return self.refresh(stale_token=bundle.access_token).access_token
+        return bundle.access_token
+
+    def refresh(self, stale_token: str | None = None) -> TokenBundle:
+        """
+        Rotate the token once. Pass the token a failed request used as
+        `stale_token`; if it has already been replaced, the current bundle is
+        returned without another refresh.
+        """
+        with self._cond:
+            if stale_token is not None and self._bundle.access_token != stale_token:
+                return self._bundle
+            if self._refreshing:
+                while self._refreshing:
+                    self._cond.wait()
+                return self._bundle
+            if not self._bundle.refresh_token:
+                raise RuntimeError("No refresh token available; please re-login to refresh env.")
+            self._refreshing = True
+            self._last_attempt = time.time()
+            current = self._bundle
+
+        try:
+            bundle = self._refresh_fn(current)
+        except Exception:
+            REFRESHES.inc(result="error")
+            with self._cond:
+                self._refreshing = False
+                self._cond.notify_all()
+            raise
+        REFRESHES.inc(result="ok")
+
+        with self._cond:
+            self._bundle = bundle
+            self._issued_at = time.time()
+            self._refresh_count += 1
+            self._refreshing = False
+            self._cond.notify_all()
+        log.info("access token refreshed: expire_at=%s", bundle.access_token_expire_at)
+        return bundle
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="biji-token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            bundle = self._bundle
+            due = self.refresh_due_at()
+            if due is None:
+                # Nothing to schedule yet; a 403-triggered refresh may add an expiry.
+                self._stop.wait(60)
+                continue
+            delay = due - time.time()
+            if delay > 0:
+                self._stop.wait(min(delay, 60))
+                continue
+            try:
+                self.refresh(stale_token=bundle.access_token)
+            except Exception as e:
+                log.error("background token refresh failed: %r", e)
+                self._stop.wait(self._retry_interval)
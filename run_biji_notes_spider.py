@@ -1,12 +1,69 @@
+import argparse
+import os
 from pathlib import Path
 
 import feapder.setting as setting
 
 from crawler.spiders.biji_notes_spider import BijiNotesSpider
 from crawler.bootstrap_biji_env import ensure_biji_env
+from crawler.storage import storage_backend_from_env
+
+# backend -> (pipeline, write-behind pipeline)
+PIPELINES = {
+    "mongita": (
+        "crawler.pipelines.mongita_pipeline.MongitaPipeline",
+        "crawler.pipelines.write_behind_pipeline.WriteBehindMongitaPipeline",
+    ),
+    "sqlite": (
+        "crawler.pipelines.sqlite_pipeline.SqlitePipeline",
+        "crawler.pipelines.write_behind_pipeline.WriteBehindSqlitePipeline",
+    ),
+}
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpointed cursor and replay unfinished detail fetches.",
+    )
+    parser.add_argument(
+        "--replay-dead-letters",
+        action="store_true",
+        help="Only re-fetch link details that exhausted their retries in earlier runs.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["feapder", "asyncio"],
+        default="feapder",
+        help="Crawl engine: feapder AirSpider threads, or the asyncio keep-alive engine.",
+    )
+    parser.add_argument(
+        "--write-behind",
+        action="store_true",
+        help="Write to storage from a background thread so storage overlaps with crawling.",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=list(PIPELINES),
+        default=None,
+        help="Storage backend (default: BIJI_STORAGE, else mongita). Crawl state always stays in Mongita.",
+    )
+    args = parser.parse_args()
+
     ensure_biji_env(env_path=Path(".env"), url="https://www.biji.com/note")
-    setting.ITEM_PIPELINES = ["crawler.pipelines.mongita_pipeline.MongitaPipeline"]
-    BijiNotesSpider().start()
+    if args.storage:
+        os.environ["BIJI_STORAGE"] = args.storage
+    pipeline, write_behind_pipeline = PIPELINES[storage_backend_from_env()]
+    setting.ITEM_PIPELINES = [write_behind_pipeline if args.write_behind else pipeline]
+    if args.engine == "asyncio":
+        from crawler.async_engine import AsyncBijiCrawler, load_pipelines
+
+        AsyncBijiCrawler(
+            pipelines=load_pipelines(setting.ITEM_PIPELINES),
+            resume=args.resume,
+            replay_dead_letters=args.replay_dead_letters,
+        ).start()
+    else:
+        BijiNotesSpider(resume=args.resume, replay_dead_letters=args.replay_dead_letters).start()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from crawler.blob_store import blob_store_from_env
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.mongita_io import open_mongita
+from crawler.sqlite_store import SqliteStore
+from crawler.storage import MongitaStore, NoteStore
+
+BATCH_SIZE = 1000
+
+
+def _copy(docs: Iterable[Dict[str, Any]], write: Callable[[List[Dict[str, Any]]], Any]) -> int:
+    n = 0
+    batch: List[Dict[str, Any]] = []
+    for doc in docs:
+        doc.pop("_id", None)
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            write(batch)
+            n += len(batch)
+            batch = []
+    if batch:
+        write(batch)
+        n += len(batch)
+    return n
+
+
+def convert_store(source: NoteStore, target: NoteStore) -> tuple[int, int, int]:
+    """
+    Copy every note, link detail and misc item of `source` into `target`,
+    keeping `_ts`/`_created_at`; returns `(notes, details, misc)` counts.
+    Notes and details are upserted, so a second run only rewrites what
+    changed; misc items have no key and are appended again.
+    """
+    n_notes = _copy(source.iter_notes(), target.upsert_notes)
+    n_details = _copy(source.iter_details(), target.upsert_details)
+    n_misc = _copy(source.iter_misc(), target.insert_misc)
+    return n_notes, n_details, n_misc
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="One-shot copy of a Mongita directory into a SQLite database.")
+    parser.add_argument("--mongita-dir", default="data/mongita")
+    parser.add_argument("--db", default="biji")
+    parser.add_argument("--notes", default="notes")
+    parser.add_argument("--details", default="details")
+    parser.add_argument("--misc", default="misc")
+    parser.add_argument("--sqlite", default="data/biji.sqlite3")
+    args = parser.parse_args()
+
+    mongita_dir = Path(args.mongita_dir)
+    if not mongita_dir.exists():
+        raise SystemExit(f"mongita dir not found: {mongita_dir}")
+
+    source = MongitaStore(open_mongita(mongita_dir, args.db, args.notes, args.details, args.misc))
+    # Offloaded bodies stay in BIJI_BLOB_DIR; the target only reads them for search.
+    target = SqliteStore(Path(args.sqlite), blobs=blob_store_from_env())
+    metrics_writer = start_metrics_writer_from_env()
+    try:
+        n_notes, n_details, n_misc = convert_store(source, target)
+    finally:
+        target.close()
+        if metrics_writer is not None:
+            metrics_writer.stop()
+    print(f"converted: notes={n_notes} details={n_details} misc={n_misc} -> {args.sqlite}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
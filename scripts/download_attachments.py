@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from crawler.attachments import AttachmentDownloader, AttachmentStore, attachment_refs
+from crawler.biji_api import DEFAULT_USER_AGENT
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.storage import add_storage_arguments, open_store_from_args
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    add_storage_arguments(parser)
+    parser.add_argument("--out", default="data/attachments")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--type",
+        action="append",
+        dest="types",
+        help="Only download attachments of this type (repeatable), e.g. --type audio. Default: all.",
+    )
+    args = parser.parse_args()
+
+    store = open_store_from_args(args)
+    refs = [ref for note in store.iter_notes() for ref in attachment_refs(note, types=args.types)]
+    store.close()
+
+    downloader = AttachmentDownloader(
+        AttachmentStore(Path(args.out)), workers=args.workers, headers={"User-Agent": DEFAULT_USER_AGENT}
+    )
+    metrics_writer = start_metrics_writer_from_env()
+    try:
+        stats = downloader.download_all(refs)
+    finally:
+        if metrics_writer is not None:
+            metrics_writer.stop()
+    print(
+        f"attachments: downloaded={stats.downloaded} skipped={stats.skipped} failed={stats.failed} "
+        f"bytes={stats.bytes} -> {args.out}"
+    )
+    return 0 if stats.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,38 +8,57 @@ ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
 
 from crawler.markdown_export import MarkdownExportOptions, export_markdown_from_records
-from crawler.mongita_io import open_mongita
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.storage import DetailLookup, add_storage_arguments, open_store_from_args
 
 
 def main() -> int:
     parser = argparse.ArgumentParser()
-    parser.add_argument("--mongita-dir", default="data/mongita")
-    parser.add_argument("--db", default="biji")
-    parser.add_argument("--notes", default="notes")
-    parser.add_argument("--details", default="details")
-    parser.add_argument("--misc", default="misc")
+    add_storage_arguments(parser)
     parser.add_argument("--out", default="data/markdown")
     parser.add_argument(
         "--only-details",
         action="store_true",
         help="Only export notes that have details (usually note_type=link).",
     )
+    parser.add_argument(
+        "--attachments-dir",
+        default="",
+        help="Attachment store written by scripts/download_attachments.py; downloaded files are linked locally.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only write new or changed notes and delete files of removed notes, using the manifest in --out.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Render in this many processes and write from as many threads (0: serial).",
+    )
     args = parser.parse_args()
 
-    cols = open_mongita(Path(args.mongita_dir), args.db, args.notes, args.details, args.misc)
-    notes = list(cols.notes.find({}))
-
-    details_by_note_id = {}
-    for d in cols.details.find({}):
-        nid = str(d.get("note_id") or "")
-        if nid:
-            details_by_note_id[nid] = d
-
-    written = export_markdown_from_records(
-        notes=notes,
-        details_by_note_id=details_by_note_id,
-        options=MarkdownExportOptions(out_dir=Path(args.out), only_with_details=args.only_details),
-    )
+    store = open_store_from_args(args)
+    metrics_writer = start_metrics_writer_from_env()
+    try:
+        # Streamed: notes come off a cursor and details are fetched per note.
+        written = export_markdown_from_records(
+            notes=store.iter_notes(),
+            details_by_note_id=DetailLookup(store),
+            options=MarkdownExportOptions(
+                out_dir=Path(args.out),
+                only_with_details=args.only_details,
+                attachments_dir=Path(args.attachments_dir) if args.attachments_dir else None,
+                blob_dir=Path(args.blob_dir) if args.blob_dir else None,
+                incremental=args.incremental,
+                workers=args.workers,
+            ),
+        )
+    finally:
+        store.close()
+        if metrics_writer is not None:
+            metrics_writer.stop()
     print(f"exported: {len(written)} files -> {args.out}")
     return 0
 
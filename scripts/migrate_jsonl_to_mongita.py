@@ -1,57 +1,187 @@
 from __future__ import annotations
 
 import argparse
-import json
+import shutil
 import sys
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
 
-from crawler.mongita_io import open_mongita, upsert_by_note_id
+from feapder.utils.log import log
+
+from crawler import fastjson
+from crawler.blob_store import BlobStore, blob_threshold_from_env, offload_bodies
+from crawler.jsonl_migration import DEFAULT_MAX_RECORDS, MIGRATED, CompactingMigration, classify
+from crawler.jsonl_parallel import iter_parsed_chunks
+from crawler.jsonl_segments import iter_jsonl_lines, iter_jsonl_positions, jsonl_sources
+from crawler.metrics import start_metrics_writer_from_env
+from crawler.mongita_io import UpsertCounts
+from crawler.storage import NoteStore, add_storage_arguments, blob_store_from_args, open_store_from_args
+
+BATCH_SIZE = 1000
+
+
+def migrate_jsonl(
+    jsonl_path: Path,
+    store: NoteStore,
+    *,
+    blobs: BlobStore | None = None,
+    blob_threshold: int | None = None,
+    workers: int = 0,
+) -> tuple[int, int, int]:
+    """
+    Upsert every record a `NotesJsonlPipeline` wrote to `jsonl_path` (the
+    plain file and any rotated, compressed segments) in batches; returns
+    `(notes, details, misc)` counts. With `blobs`, large note/detail bodies
+    are offloaded there as the crawl pipeline does. With `workers`, lines
+    are decoded by that many processes and written here in file order.
+    """
+    threshold = blob_threshold_from_env() if blob_threshold is None else blob_threshold
+    n_notes = 0
+    n_details = 0
+    n_misc = 0
+    counts = {"notes": UpsertCounts(), "details": UpsertCounts()}
+    notes: list[dict] = []
+    details: list[dict] = []
+    misc: list[dict] = []
+
+    def flush() -> None:
+        counts["notes"].add(store.upsert_notes(notes))
+        counts["details"].add(store.upsert_details(details))
+        store.insert_misc(misc)
+        MIGRATED.inc(len(notes), kind="note")
+        MIGRATED.inc(len(details), kind="link_detail")
+        MIGRATED.inc(len(misc), kind="misc")
+        notes.clear()
+        details.clear()
+        misc.clear()
+
+    if workers:
+        records = (r for chunk in iter_parsed_chunks(jsonl_path, workers=workers) for r in chunk.records)
+    else:
+        records = (classify(fastjson.loads(line)) for line in iter_jsonl_lines(jsonl_path))
+    for table, _, obj in records:
+        if table != "misc" and blobs is not None:
+            obj = offload_bodies(obj, blobs, threshold=threshold)
+        if table == "notes":
+            notes.append(obj)
+            n_notes += 1
+        elif table == "details":
+            details.append(obj)
+            n_details += 1
+        else:
+            misc.append(obj)
+            n_misc += 1
+        if len(notes) + len(details) + len(misc) >= BATCH_SIZE:
+            flush()
+    flush()
+
+    for name, c in counts.items():
+        log.info("migrated %s: inserted=%s updated=%s unchanged=%s", name, c.inserted, c.updated, c.unchanged)
+    return n_notes, n_details, n_misc
+
+
+def default_work_dir(jsonl_path: Path) -> Path:
+    return jsonl_path.with_name(jsonl_path.name + ".migrate")
+
+
+def migrate_jsonl_compacted(
+    jsonl_path: Path,
+    store: NoteStore,
+    *,
+    work_dir: Path | None = None,
+    resume: bool = False,
+    max_records: int = DEFAULT_MAX_RECORDS,
+    blobs: BlobStore | None = None,
+    blob_threshold: int | None = None,
+    workers: int = 0,
+) -> tuple[int, int, int]:
+    """
+    `migrate_jsonl` through a `CompactingMigration`: only the last version
+    of each note/detail is written. Spilled runs and the byte-offset
+    checkpoint live in `work_dir` (default `<jsonl>.migrate/`); with
+    `resume` an interrupted migration continues from its checkpoint,
+    otherwise leftovers of one are discarded. With `workers`, chunks are
+    decoded and pre-compacted by that many processes.
+    """
+    work_dir = work_dir or default_work_dir(jsonl_path)
+    migration = CompactingMigration(
+        store, work_dir, max_records=max_records, blobs=blobs, blob_threshold=blob_threshold
+    )
+    if not (resume and migration.load_checkpoint()) and work_dir.exists():
+        log.warning("discarding unfinished migration in %s (pass --resume to continue it)", work_dir)
+        shutil.rmtree(work_dir)
+
+    if workers:
+        for chunk in iter_parsed_chunks(jsonl_path, workers=workers, start=migration.position, compact=True):
+            migration.add_chunk(chunk.records, chunk.read, (chunk.name, chunk.end))
+    else:
+        for source, offset, line in iter_jsonl_positions(jsonl_path, migration.position):
+            table, key, obj = classify(fastjson.loads(line))
+            migration.add(table, key, obj, (source, offset))
+    counts = migration.finish()
+
+    for name, c in counts.items():
+        log.info("migrated %s: inserted=%s updated=%s unchanged=%s", name, c.inserted, c.updated, c.unchanged)
+    return migration.read["notes"], migration.read["details"], migration.read["misc"]
 
 
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--jsonl", default="data/notes.jsonl")
-    parser.add_argument("--mongita-dir", default="data/mongita")
-    parser.add_argument("--db", default="biji")
-    parser.add_argument("--notes", default="notes")
-    parser.add_argument("--details", default="details")
-    parser.add_argument("--misc", default="misc")
+    add_storage_arguments(parser)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep only the last version of each note/detail in memory (spilling sorted runs to disk) before writing.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --compact: continue an interrupted migration from its checkpoint.",
+    )
+    parser.add_argument(
+        "--max-records",
+        type=int,
+        default=DEFAULT_MAX_RECORDS,
+        help="With --compact: records held in memory before spilling a sorted run to disk.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Decode JSON in this many processes (0: in this process); useful for multi-GB files.",
+    )
+    parser.add_argument("--work-dir", default="", help="With --compact: spill/checkpoint directory (default: <jsonl>.migrate)")
     args = parser.parse_args()
 
     jsonl_path = Path(args.jsonl)
-    if not jsonl_path.exists():
+    if not jsonl_sources(jsonl_path):
         raise SystemExit(f"jsonl not found: {jsonl_path}")
 
-    cols = open_mongita(Path(args.mongita_dir), args.db, args.notes, args.details, args.misc)
-
-    n_notes = 0
-    n_details = 0
-    n_misc = 0
-
-    with jsonl_path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            obj = json.loads(line)
-            kind = obj.get("kind")
-            note_id = obj.get("note_id")
-
-            if kind == "note" and note_id:
-                upsert_by_note_id(cols.notes, note_id=str(note_id), doc=obj)
-                n_notes += 1
-            elif kind == "link_detail" and note_id:
-                obj = dict(obj)
-                obj["kind"] = "details"
-                upsert_by_note_id(cols.details, note_id=str(note_id), doc=obj)
-                n_details += 1
-            else:
-                cols.misc.insert_one(obj)
-                n_misc += 1
+    store = open_store_from_args(args)
 
+    metrics_writer = start_metrics_writer_from_env()
+    try:
+        if args.compact:
+            n_notes, n_details, n_misc = migrate_jsonl_compacted(
+                jsonl_path,
+                store,
+                work_dir=Path(args.work_dir) if args.work_dir else None,
+                resume=args.resume,
+                max_records=args.max_records,
+                blobs=blob_store_from_args(args),
+                workers=args.workers,
+            )
+        else:
+            n_notes, n_details, n_misc = migrate_jsonl(
+                jsonl_path, store, blobs=blob_store_from_args(args), workers=args.workers
+            )
+    finally:
+        store.close()
+        if metrics_writer is not None:
+            metrics_writer.stop()
     print(f"migrated: notes={n_notes} details={n_details} misc={n_misc}")
     return 0
 
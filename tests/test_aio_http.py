@@ -0,0 +1,62 @@
+import asyncio
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from crawler.aio_http import AsyncHttpPool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).connections.add(self.client_address)
+        if self.path.startswith("/chunked"):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for part in (b'{"a": ', b"1}"):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        body = gzip.compress(json.dumps({"path": self.path}).encode("utf-8"))
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_async_http_pool_reuses_connections_and_decodes_bodies():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def run():
+        async with AsyncHttpPool(max_connections_per_host=1) as http:
+            first = await http.get(base + "/notes", params={"since_id": "a b"})
+            second = await http.get(base + "/notes")
+            chunked = await http.get(base + "/chunked")
+        return first, second, chunked
+
+    try:
+        first, second, chunked = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert first.status_code == 200
+    path, _, query = first.json()["path"].partition("?")
+    assert path == "/notes" and parse_qs(query) == {"since_id": ["a b"]}
+    assert second.json() == {"path": "/notes"}
+    assert chunked.json() == {"a": 1}
+    assert len(_Handler.connections) == 1
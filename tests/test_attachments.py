@@ -0,0 +1,85 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from crawler.attachments import AttachmentDownloader, AttachmentStore, attachment_refs
+from crawler.markdown_export import MarkdownExportOptions, export_markdown_from_records
+
+AUDIO = bytes(range(256)) * 400
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    ranges: list = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = AUDIO
+        header = self.headers.get("Range")
+        _RangeHandler.ranges.append(header)
+        if header:
+            start = int(header.removeprefix("bytes=").split("-", 1)[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "audio/mp4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_download_resumes_dedupes_and_links_into_markdown(tmp_path: Path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        note = {
+            "note_id": "n1",
+            "raw": {
+                "note_type": "audio",
+                "title": "Talk",
+                "attachments": [
+                    {"type": "audio", "url": f"{base}/a/talk.m4a", "duration": 1000},
+                    {"type": "audio", "url": f"{base}/mirror/talk.m4a"},
+                    {"type": "image", "url": "data:ignored"},
+                ],
+            },
+        }
+        refs = attachment_refs(note)
+        assert [r.url for r in refs] == [f"{base}/a/talk.m4a", f"{base}/mirror/talk.m4a"]
+
+        store = AttachmentStore(tmp_path / "att")
+        part = store.partial_path(refs[0].url)
+        part.parent.mkdir(parents=True)
+        part.write_bytes(AUDIO[:1000])
+
+        stats = AttachmentDownloader(store, workers=2).download_all(refs + refs)
+        assert (stats.downloaded, stats.skipped, stats.failed) == (2, 0, 0)
+        assert "bytes=1000-" in _RangeHandler.ranges
+
+        sha = hashlib.sha256(AUDIO).hexdigest()
+        objects = list((tmp_path / "att" / "objects").rglob("*.m4a"))
+        assert [p.name for p in objects] == [f"{sha}.m4a"]
+        assert objects[0].read_bytes() == AUDIO
+
+        reopened = AttachmentStore(tmp_path / "att")
+        again = AttachmentDownloader(reopened).download_all(refs)
+        assert (again.downloaded, again.skipped) == (0, 2)
+
+        written = export_markdown_from_records(
+            notes=[note],
+            details_by_note_id={},
+            options=MarkdownExportOptions(
+                out_dir=tmp_path / "md", only_with_details=False, attachments_dir=tmp_path / "att"
+            ),
+        )
+        text = written[0].read_text(encoding="utf-8")
+        assert f'audio_local: "../att/objects/{sha[:2]}/{sha}.m4a"' in text
+        assert f"(<../att/objects/{sha[:2]}/{sha}.m4a>)" in text
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,16 @@
+from pathlib import Path
+
+from benchmarks.bench_micro import CASES, Result, build_fixture, compare, run_case
+
+
+def test_every_case_runs_on_a_small_fixture(tmp_path: Path):
+    fx = build_fixture(200, tmp_path)
+    for case in CASES:
+        result = run_case(case, fx, repeat=1, min_time=0)
+        assert result.records > 0, case.name
+
+
+def test_compare_flags_slowdowns_past_threshold():
+    baseline = {"results": {"a@1": {"seconds": 1.0}, "b@1": {"seconds": 1.0}}}
+    results = [Result("a", 1, 1.2, 10), Result("b", 1, 1.5, 10), Result("c", 1, 9.0, 10)]
+    assert compare(results, baseline, threshold=0.25) == ["b@1"]
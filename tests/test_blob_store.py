@@ -0,0 +1,71 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from crawler.blob_store import BlobStore, is_blob_ref, offload_bodies, resolve_body
+from crawler.markdown_export import MarkdownExportOptions, export_markdown_from_records, render_link_markdown
+from crawler.pipelines.sqlite_pipeline import SqlitePipeline
+from crawler.sqlite_store import SqliteStore
+
+
+def test_offload_dedupes_and_keeps_small_bodies_inline(tmp_path: Path):
+    blobs = BlobStore(tmp_path / "blobs")
+    body = "正文" * 5000
+    note = {"note_id": "n1", "raw": {"title": "t", "content": body, "body_text": "short"}}
+
+    out = offload_bodies(note, blobs, threshold=1024)
+    ref = out["raw"]["content"]
+    assert is_blob_ref(ref) and ref["bytes"] == len(body.encode("utf-8"))
+    assert out["raw"]["body_text"] == "short"
+    assert note["raw"]["content"] == body
+    assert resolve_body(ref, blobs) == body
+
+    again = offload_bodies({"note_id": "n2", "content": body}, blobs, threshold=1024)
+    assert again["content"] == ref
+    assert len(list((tmp_path / "blobs").rglob("*.z"))) == 1
+
+    with pytest.raises(RuntimeError):
+        resolve_body(ref, None)
+
+
+def test_pipeline_offloads_and_export_resolves_lazily(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("BIJI_BLOB_DIR", str(tmp_path / "blobs"))
+    monkeypatch.setenv("BIJI_BLOB_THRESHOLD", "1024")
+    body = "一致性协议与分布式共识。" * 200
+    items = [
+        {"kind": "note", "note_id": "n1", "raw": {"id": "n1", "title": "共识", "note_type": "link"}},
+        {"kind": "link_detail", "note_id": "n1", "title": "共识", "raw": {"content": body}},
+    ]
+    pipeline = SqlitePipeline(tmp_path / "biji.sqlite3")
+    pipeline.save_items("item", items)
+    pipeline.save_items("item", items)
+    pipeline.close()
+    assert pipeline.counts["details"].inserted == 1 and pipeline.counts["details"].unchanged == 1
+
+    store = SqliteStore(tmp_path / "biji.sqlite3", blobs=BlobStore(tmp_path / "blobs"))
+    detail = store.get_detail("n1")
+    assert is_blob_ref(detail["raw"]["content"])
+    assert store.search("分布式共识") == ["n1"]
+
+    note = next(store.iter_notes())
+    assert body in render_link_markdown(note=note, detail=detail, blobs=BlobStore(tmp_path / "blobs"))
+    [path] = export_markdown_from_records(
+        notes=[note],
+        details_by_note_id={"n1": detail},
+        options=MarkdownExportOptions(out_dir=tmp_path / "md", blob_dir=tmp_path / "blobs"),
+    )
+    assert body in path.read_text(encoding="utf-8")
+
+
+def _put(root: Path, body: bytes) -> str:
+    return BlobStore(root).put(body)
+
+
+def test_concurrent_processes_store_one_blob(tmp_path: Path):
+    body = b"x" * 100_000
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        digests = set(pool.map(_put, [tmp_path] * 16, [body] * 16))
+    assert len(digests) == 1
+    assert BlobStore(tmp_path).get(digests.pop()) == body
+    assert [p.suffix for p in tmp_path.rglob("*.*")] == [".z"]
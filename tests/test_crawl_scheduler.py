@@ -0,0 +1,49 @@
+from crawler.crawl_scheduler import PaginationGate, SchedulerConfig
+
+
+def test_gate_parks_pagination_until_details_drain():
+    gate = PaginationGate(SchedulerConfig(prefetch_pages=2, max_pending_details=100))
+
+    gate.details_scheduled("p1", 2)
+    assert gate.offer_page("page2", "p2") == ["page2"]
+    gate.details_scheduled("p2", 1)
+    assert gate.offer_page("page3", "p3") == []
+    assert gate.parked == 1
+
+    assert gate.detail_finished("p1") == []
+    assert gate.detail_finished("p1") == ["page3"]
+    # page3 is ahead from the moment it is released.
+    assert (gate.pages_ahead, gate.pending_details, gate.parked) == (2, 1, 0)
+
+
+def test_gate_caps_outstanding_details():
+    gate = PaginationGate(SchedulerConfig(prefetch_pages=10, max_pending_details=3))
+
+    gate.details_scheduled(None, 3)
+    assert gate.offer_page("a") == []
+    # Parked pages are released in order, never overtaken by a later offer.
+    gate.details_scheduled("p", 0)
+    assert gate.offer_page("b") == []
+    assert gate.detail_finished(None) == ["a", "b"]
+
+
+def test_single_page_prefetch_releases_one_page_at_a_time():
+    gate = PaginationGate(SchedulerConfig(prefetch_pages=1, max_pending_details=100))
+
+    # Both sort passes fetched their first page; each parks its next one.
+    gate.details_scheduled("create:", 1)
+    assert gate.offer_page("create2", "create:2") == []
+    gate.details_scheduled("update:", 1)
+    assert gate.offer_page("update2", "update:2") == []
+
+    assert gate.detail_finished("create:") == []
+    assert gate.detail_finished("update:") == ["create2"]
+    assert gate.pages_ahead == 1
+
+    # create2 has no link notes: it stops being ahead once fetched.
+    assert gate.details_scheduled("create:2", 0) == ["update2"]
+    assert gate.pages_ahead == 1
+    # A page that is given up on stops being ahead too.
+    assert gate.offer_page("update3", "update:3") == []
+    assert gate.page_failed("update:2") == ["update3"]
+    assert (gate.pages_ahead, gate.parked) == (1, 0)
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from crawler.detail_index import DetailVersionIndex, note_version
+from crawler.mongita_io import open_mongita
+from crawler.storage import MongitaStore
+
+
+def test_note_version_prefers_updated_at_and_falls_back_to_fingerprint():
+    assert note_version({"id": "1", "updated_at": "2024-01-01 00:00:00"}) == "2024-01-01 00:00:00"
+    a = note_version({"id": "1", "title": "x"})
+    assert a.startswith("sha1:")
+    assert a == note_version({"title": "x", "id": "1"})
+    assert a != note_version({"id": "1", "title": "y"})
+
+
+def test_detail_version_index_is_current_and_record():
+    index = DetailVersionIndex({"n1": "v1"})
+    assert len(index) == 1
+    assert index.is_current("n1", "v1") is True
+    assert index.is_current("n1", "v2") is False
+    assert index.is_current("n2", "") is False
+
+    index.record("n2", "v9")
+    assert index.is_current("n2", "v9") is True
+
+
+def test_detail_versions_skip_bodies(tmp_path: Path):
+    store = MongitaStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc"))
+    store.upsert_details([{"note_id": f"n{i}", "source_version": f"v{i}", "raw": {"content": "x" * 10_000}} for i in range(3)])
+    store.upsert_details([{"note_id": "n0", "source_version": "v0b"}, {"note_id": "n9"}])
+
+    # Start from an empty document cache, as a new process would.
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    cols.details.database.client.close()
+    assert MongitaStore(cols).detail_versions() == {"n0": "v0b", "n1": "v1", "n2": "v2"}
+    # Only the keys were read; no detail was decoded into Mongita's document cache.
+    assert not cols.details._engine._cache.get(cols.details.full_name)
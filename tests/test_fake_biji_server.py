@@ -0,0 +1,42 @@
+import json
+import threading
+import urllib.request
+
+from benchmarks.fake_biji_server import FakeBijiServer, ServerConfig, make_token
+from benchmarks.synthetic import CorpusConfig
+from crawler.biji_api import link_detail_url, notes_url
+from crawler.biji_auth import refresh_access_token
+from crawler.biji_notes_logic import parse_notes_page
+
+
+def _get(url: str, token: str) -> dict:
+    request = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"})
+    with urllib.request.urlopen(request) as resp:
+        return json.loads(resp.read())
+
+
+def test_fake_server_pages_details_and_refresh(monkeypatch):
+    config = ServerConfig(corpus=CorpusConfig(notes=25, link_ratio=0.5, content_size=100), latency_ms=0)
+    server = FakeBijiServer(("127.0.0.1", 0), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("BIJI_API_BASE", server.base_url)
+    monkeypatch.setenv("BIJI_AUTH_API_BASE", server.base_url)
+    try:
+        token = make_token(ttl=60)
+        seen, since_id = [], ""
+        while True:
+            page = parse_notes_page(_get(f"{notes_url()}?limit=10&since_id={since_id}", token), limit=10)
+            seen.extend(n["id"] for n in page.notes)
+            if not page.should_continue:
+                break
+            since_id = page.next_since_id
+        assert seen == [str(i) for i in range(25, 0, -1)]
+
+        link_id = next(n["id"] for n in server.corpus.page("", 25) if n["note_type"] == "link")
+        assert _get(link_detail_url(link_id), token)["c"]["has_content"] is True
+
+        bundle = refresh_access_token(refresh_token="fake-refresh-token")
+        assert bundle.access_token and bundle.access_token_expire_at
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,22 @@
+import json
+
+from crawler import fastjson
+
+
+def test_round_trip_keeps_unicode_unescaped():
+    item = {"kind": "note", "note_id": "1", "raw": {"title": "笔记 ✓", "n": [1, 2.5, None, True]}}
+    line = fastjson.dumps_line(item)
+    assert line.endswith(b"\n") and line.count(b"\n") == 1
+    assert "笔记 ✓".encode("utf-8") in line
+    assert fastjson.loads(line) == item
+    assert json.loads(line.decode("utf-8")) == item
+
+
+def test_dumps_falls_back_for_values_the_fast_backend_rejects():
+    assert fastjson.loads(fastjson.dumps({"big": 2**70})) == {"big": 2**70}
+
+
+def test_canonical_form_matches_the_stdlib():
+    item = {"b": [1, 2.5, None, True], "a": {"z": "笔记", "y": ""}}
+    expected = json.dumps(item, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    assert fastjson.dumps_canonical(item) == expected
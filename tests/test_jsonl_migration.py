@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import pytest
+
+from crawler import fastjson
+from crawler.jsonl_migration import classify
+from crawler.jsonl_parallel import iter_parsed_chunks, parse_chunk, plan_chunks
+from crawler.jsonl_segments import SegmentPolicy, iter_jsonl_lines
+from crawler.pipelines.notes_jsonl_pipeline import NotesJsonlPipeline
+from crawler.sqlite_store import SqliteStore
+from scripts.migrate_jsonl_to_mongita import default_work_dir, migrate_jsonl, migrate_jsonl_compacted
+
+
+def _write_versions(path: Path, policy: SegmentPolicy) -> None:
+    # Five runs appending every note again, with one field that only the first run had.
+    for run in range(5):
+        pipeline = NotesJsonlPipeline(path, policy)
+        items = []
+        for i in range(60):
+            note = {"kind": "note", "note_id": f"n{i}", "raw": {"title": f"t{i} v{run}"}}
+            if run == 0:
+                note["first_seen_run"] = 0
+            items.append(note)
+            if i % 3 == 0:
+                items.append({"kind": "link_detail", "note_id": f"n{i}", "title": f"d{i} v{run}"})
+        items.append({"kind": "other", "run": run})
+        pipeline.save_items("item", items)
+        pipeline.close()
+
+
+def _docs(store: SqliteStore):
+    strip = lambda d: {k: v for k, v in d.items() if not k.startswith("_")}
+    return (
+        {d["note_id"]: strip(d) for d in store.iter_notes()},
+        {d["note_id"]: strip(d) for d in store.iter_details()},
+        [strip(d) for d in store.iter_misc()],
+    )
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_compacted_migration_matches_plain_migration(tmp_path: Path, compression: str):
+    path = tmp_path / "notes.jsonl"
+    _write_versions(path, SegmentPolicy(compression=compression))
+
+    plain = SqliteStore(tmp_path / "plain.sqlite3")
+    assert migrate_jsonl(path, plain) == (300, 100, 5)
+
+    compacted = SqliteStore(tmp_path / "compacted.sqlite3")
+    # A tiny budget forces several spilled runs.
+    assert migrate_jsonl_compacted(path, compacted, max_records=25) == (300, 100, 5)
+    assert _docs(compacted) == _docs(plain)
+    assert _docs(compacted)[0]["n7"] == {"kind": "note", "note_id": "n7", "raw": {"title": "t7 v4"}, "first_seen_run": 0}
+    assert not default_work_dir(path).exists()
+
+
+def test_interrupted_compacted_migration_resumes_from_checkpoint(tmp_path: Path, monkeypatch):
+    path = tmp_path / "notes.jsonl"
+    _write_versions(path, SegmentPolicy(compression="gzip", rotate_bytes=2048))
+
+    store = SqliteStore(tmp_path / "biji.sqlite3")
+
+    def crash(docs, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(store, "upsert_notes", crash)
+    with pytest.raises(KeyboardInterrupt):
+        migrate_jsonl_compacted(path, store, max_records=40)
+    assert (default_work_dir(path) / "checkpoint.json").exists()
+    monkeypatch.undo()
+
+    assert migrate_jsonl_compacted(path, store, resume=True, max_records=40) == (300, 100, 5)
+    notes, details, misc = _docs(store)
+    assert len(notes) == 60 and notes["n59"]["raw"]["title"] == "t59 v4"
+    assert len(details) == 20 and details["n3"]["title"] == "d3 v4"
+    assert [m["run"] for m in misc] == [0, 1, 2, 3, 4]
+
+
+def test_parallel_parsing_keeps_file_order(tmp_path: Path):
+    path = tmp_path / "notes.jsonl"
+    # A plain file followed by gzip segments, as after switching compression on.
+    _write_versions(path, SegmentPolicy())
+    _write_versions(path, SegmentPolicy(compression="gzip", rotate_bytes=4096))
+
+    chunks = plan_chunks(path, chunk_bytes=1000)
+    assert len([c for c in chunks if c.end is not None]) > 5
+    serial = [classify(fastjson.loads(line)) for line in iter_jsonl_lines(path)]
+    for use_mmap in (True, False):
+        parsed = [r for c in chunks for r in parse_chunk(c, use_mmap=use_mmap).records]
+        assert parsed == serial
+    assert [r for c in iter_parsed_chunks(path, workers=2, chunk_bytes=1000) for r in c.records] == serial
+
+    plain = SqliteStore(tmp_path / "plain.sqlite3")
+    assert migrate_jsonl(path, plain) == (600, 200, 10)
+    parallel = SqliteStore(tmp_path / "parallel.sqlite3")
+    assert migrate_jsonl(path, parallel, workers=2) == (600, 200, 10)
+    compacted = SqliteStore(tmp_path / "compacted.sqlite3")
+    assert migrate_jsonl_compacted(path, compacted, workers=2, max_records=50) == (600, 200, 10)
+    assert _docs(parallel) == _docs(plain) == _docs(compacted)
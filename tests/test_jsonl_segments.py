@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from crawler import fastjson
+from crawler.jsonl_segments import JsonlSegmentWriter, SegmentPolicy, iter_jsonl_lines, read_segment_index
+from crawler.mongita_io import open_mongita
+from crawler.storage import MongitaStore
+from crawler.pipelines.notes_jsonl_pipeline import NotesJsonlPipeline
+from scripts.migrate_jsonl_to_mongita import migrate_jsonl
+
+
+def _items(start, stop):
+    return [{"kind": "note", "note_id": f"n{i}", "raw": {"title": f"t{i}" * 20}} for i in range(start, stop)]
+
+
+def test_rotating_gzip_segments_are_indexed_and_migrated(tmp_path: Path):
+    path = tmp_path / "notes.jsonl"
+    # A plain file left by an older version is read first.
+    legacy = NotesJsonlPipeline(path, SegmentPolicy())
+    legacy.save_items("item", _items(0, 5))
+    legacy.close()
+    policy = SegmentPolicy(compression="gzip", rotate_bytes=4096, fsync="batch")
+
+    pipeline = NotesJsonlPipeline(path, policy)
+    for start in range(5, 200, 50):
+        pipeline.save_items("item", _items(start, start + 50))
+    pipeline.close()
+    pipeline = NotesJsonlPipeline(path, policy)
+    pipeline.save_items("item", [{"kind": "note", "note_id": "n0", "raw": {"title": "new"}}])
+    pipeline.close()
+
+    segments = read_segment_index(path)
+    assert len(segments) >= 3 and all(s["file"].endswith(".jsonl.gz") and s["closed_at"] for s in segments)
+    assert sum(s["records"] for s in segments) == 201
+    assert sum(s["stored_bytes"] for s in segments) < sum(s["bytes"] for s in segments) / 3
+
+    ids = [fastjson.loads(line)["note_id"] for line in iter_jsonl_lines(path)]
+    assert ids == [f"n{i}" for i in range(205)] + ["n0"]
+
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    assert migrate_jsonl(path, MongitaStore(cols)) == (206, 0, 0)
+    assert cols.notes.count_documents({}) == 205
+    assert cols.notes.find_one({"note_id": "n0"})["raw"]["title"] == "new"
+
+
+def test_segment_left_open_by_a_crash_is_recovered(tmp_path: Path):
+    path = tmp_path / "notes.jsonl"
+    policy = SegmentPolicy(compression="gzip", fsync="never")
+    writer = JsonlSegmentWriter(path, policy)
+    writer.write(b"".join(fastjson.dumps_line(item) for item in _items(0, 100)), 100)
+    writer.flush()
+    # Simulate a crash: the gzip trailer is never written.
+    writer._raw.close()
+
+    writer = JsonlSegmentWriter(path, policy)
+    assert read_segment_index(path)[0]["recovered"] is True
+    writer.write(fastjson.dumps_line({"kind": "note", "note_id": "late"}), 1)
+    writer.close()
+
+    ids = [fastjson.loads(line)["note_id"] for line in iter_jsonl_lines(path)]
+    assert ids == [f"n{i}" for i in range(100)] + ["late"]
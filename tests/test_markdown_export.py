@@ -0,0 +1,173 @@
+import os
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from crawler.markdown_export import EXPORT_FILES, MANIFEST_NAME, MarkdownExportOptions, export_markdown_from_records
+from crawler.mongita_io import open_mongita
+from crawler.sqlite_store import SqliteStore
+from crawler.storage import DetailLookup, MongitaStore
+
+
+def _note(note_id, title, content="", updated_at="2024-01-01"):
+    return {"note_id": note_id, "raw": {"title": title, "content": content, "updated_at": updated_at}}
+
+
+def _export(out_dir: Path, notes, **kwargs):
+    options = MarkdownExportOptions(out_dir=out_dir, only_with_details=False, incremental=True, exported_at=1, **kwargs)
+    return [p.name for p in export_markdown_from_records(notes=notes, details_by_note_id={}, options=options)]
+
+
+def test_incremental_export_only_touches_changed_notes(tmp_path: Path):
+    out = tmp_path / "md"
+    notes = [_note("n1", "Same", "a"), _note("n2", "Same", "b"), _note("n3", "Other", "c")]
+    assert _export(out, notes) == ["Same.md", "Same - n2.md", "Other.md"]
+    for path in out.glob("*.md"):
+        os.utime(path, (1000, 1000))
+
+    # Nothing changed: nothing is rendered or written, mtimes stay put.
+    assert _export(out, notes) == []
+    assert {p.stat().st_mtime for p in out.glob("*.md")} == {1000}
+
+    notes = [
+        _note("n1", "Same", "a"),
+        _note("n2", "Renamed", "b", updated_at="2024-02-01"),
+        _note("n4", "New", "d"),
+    ]
+    assert _export(out, notes) == ["Renamed.md", "New.md"]
+    assert sorted(p.name for p in out.glob("*.md")) == ["New.md", "Renamed.md", "Same.md"]
+    assert (out / "Same.md").stat().st_mtime == 1000
+    assert "exported_at: 1\n" in (out / "New.md").read_text(encoding="utf-8")
+
+    # A file deleted by hand is written again.
+    (out / "New.md").unlink()
+    assert _export(out, notes) == ["New.md"]
+
+    # Files of removed notes go; files the export never wrote are left alone.
+    (out / "mine.md").write_text("kept", encoding="utf-8")
+    assert _export(out, notes[:2]) == []
+    assert sorted(p.name for p in out.glob("*.md")) == ["Renamed.md", "Same.md", "mine.md"]
+    assert (out / MANIFEST_NAME).exists()
+
+
+def test_parallel_export_matches_serial(tmp_path: Path):
+    notes = [_note(f"n{i}", f"Title {i % 7}", f"body {i}" * (i + 1)) for i in range(300)]
+    audio = {"title": "Audio", "note_type": "audio", "attachments": [{"type": "audio", "url": "u", "duration": 5}]}
+    notes.append({"note_id": "n-audio", "raw": audio})
+    details = {f"n{i}": {"title": f"Detail {i % 5}", "raw": {"content": f"detail {i}"}} for i in range(0, 300, 3)}
+
+    def export(out_dir: Path, workers: int):
+        options = MarkdownExportOptions(out_dir=out_dir, only_with_details=False, exported_at=1, workers=workers)
+        return [p.name for p in export_markdown_from_records(notes=notes, details_by_note_id=details, options=options)]
+
+    serial = export(tmp_path / "serial", 0)
+    assert export(tmp_path / "parallel", 3) == serial and len(serial) == 301
+    for name in serial:
+        assert (tmp_path / "parallel" / name).read_bytes() == (tmp_path / "serial" / name).read_bytes()
+    assert (tmp_path / "parallel" / MANIFEST_NAME).read_bytes() == (tmp_path / "serial" / MANIFEST_NAME).read_bytes()
+
+
+@pytest.mark.parametrize("backend", ["mongita", "sqlite"])
+def test_streaming_export_from_store_matches_loaded_export(tmp_path: Path, backend: str):
+    if backend == "mongita":
+        store = MongitaStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc"))
+    else:
+        store = SqliteStore(tmp_path / "biji.sqlite3")
+    store.upsert_notes([{"kind": "note", **_note(f"n{i}", f"T{i % 4}", f"c{i}")} for i in range(40)])
+    store.upsert_details([{"kind": "details", "note_id": f"n{i}", "title": f"D{i}"} for i in range(0, 40, 2)])
+    store.upsert_details([{"kind": "details", "note_id": "n0", "title": "D0 again"}])
+
+    loaded = MarkdownExportOptions(out_dir=tmp_path / "loaded", exported_at=1)
+    details = {d["note_id"]: d for d in store.iter_details()}
+    expected = export_markdown_from_records(notes=list(store.iter_notes()), details_by_note_id=details, options=loaded)
+
+    streamed = MarkdownExportOptions(out_dir=tmp_path / "streamed", exported_at=1)
+
+    files_before: list[int] = []
+
+    def notes():
+        for note in store.iter_notes():
+            files_before.append(len(list(streamed.out_dir.glob("*.md"))))
+            yield note
+
+    written = export_markdown_from_records(notes=notes(), details_by_note_id=DetailLookup(store), options=streamed)
+    assert [p.name for p in written] == [p.name for p in expected] and len(written) == 20
+    # Each file is on disk before the next note is read.
+    assert files_before[:4] == [0, 1, 1, 2] and files_before[-1] == 20
+    assert "D0 again" in (streamed.out_dir / "D0 again.md").read_text(encoding="utf-8")
+    for path in expected:
+        assert (streamed.out_dir / path.name).read_bytes() == path.read_bytes()
+
+
+def test_parallel_export_counts_only_files_that_were_written(tmp_path: Path, monkeypatch):
+    write_text = Path.write_text
+
+    def failing_write_text(self, *args, **kwargs):
+        if self.name == "T5.md":
+            raise OSError("disk full")
+        return write_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "write_text", failing_write_text)
+    before = EXPORT_FILES.value()
+    with pytest.raises(OSError, match="disk full"):
+        _export(tmp_path / "md", [_note(f"n{i}", f"T{i}", "x") for i in range(10)], workers=2)
+    assert EXPORT_FILES.value() - before == 5
+
+
+def test_streaming_mongita_export_does_not_hold_the_store_in_memory(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("BIJI_MONGITA_READ_BATCH", "100")
+    body = "x" * 4000
+    store = MongitaStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc"))
+    store.upsert_notes([{"kind": "note", **_note(f"n{i}", f"T{i}", body)} for i in range(1000)])
+    store.upsert_details([{"kind": "details", "note_id": f"n{i}", "title": f"D{i}", "raw": {"content": body}} for i in range(1000)])
+
+    # Nothing cached yet, as in the export script's own process. ~8 MB of bodies.
+    store.cols.notes.database.client.close()
+    options = MarkdownExportOptions(out_dir=tmp_path / "md", exported_at=1)
+    tracemalloc.start()
+    try:
+        written = export_markdown_from_records(notes=store.iter_notes(), details_by_note_id=DetailLookup(store), options=options)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert len(written) == 1000
+    assert peak < 4_000_000
+
+
+def test_same_titled_notes_keep_their_file_names(tmp_path: Path):
+    out = tmp_path / "md"
+    assert _export(out, [_note("a", "Same", "a"), _note("b", "Same", "b")]) == ["Same.md", "Same - b.md"]
+    same_b = (out / "Same - b.md").read_bytes()
+
+    # An updated `a` that now comes after `b` keeps its file name.
+    assert _export(out, [_note("b", "Same", "b"), _note("a", "Same", "a2")]) == ["Same.md"]
+    assert "a2" in (out / "Same.md").read_text(encoding="utf-8")
+    assert (out / "Same - b.md").read_bytes() == same_b
+
+    # A file the export did not write is never overwritten.
+    (out / "mine.md").write_text("kept", encoding="utf-8")
+    assert _export(out, [_note("b", "Same", "b"), _note("a", "Same", "a2"), _note("c", "mine", "c")]) == ["mine - c.md"]
+    assert (out / "mine.md").read_text(encoding="utf-8") == "kept"
+
+
+def test_parallel_reexport_after_update_keeps_sibling_file(tmp_path: Path):
+    store = MongitaStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc"))
+    store.upsert_notes([{"kind": "note", **_note(note_id, "Same", note_id)} for note_id in ("a", "b")])
+    out = tmp_path / "md"
+
+    def export():
+        options = MarkdownExportOptions(out_dir=out, only_with_details=False, incremental=True, exported_at=1, workers=2)
+        return [p.name for p in export_markdown_from_records(notes=store.iter_notes(), details_by_note_id={}, options=options)]
+
+    assert export() == ["Same.md", "Same - b.md"]
+    os.utime(out / "Same - b.md", (1000, 1000))
+    same_b = (out / "Same - b.md").read_bytes()
+
+    # Updated in place, `a` keeps its position in the store.
+    store.upsert_notes([{"kind": "note", **_note("a", "Same", "a2")}])
+    assert [n["note_id"] for n in store.iter_notes()] == ["a", "b"]
+    assert export() == ["Same.md"]
+    assert "a2" in (out / "Same.md").read_text(encoding="utf-8")
+    assert (out / "Same - b.md").read_bytes() == same_b
+    assert (out / "Same - b.md").stat().st_mtime == 1000
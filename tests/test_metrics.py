@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+
+from crawler.metrics import MetricsRegistry, MetricsWriter
+
+
+def test_registry_renders_prometheus_and_json(tmp_path: Path):
+    registry = MetricsRegistry()
+    requests = registry.counter("biji_requests_total", "API requests.")
+    assert registry.counter("biji_requests_total", "API requests.") is requests
+    requests.inc(endpoint="notes", status=200)
+    requests.inc(2, endpoint="notes", status=200)
+    latency = registry.histogram("biji_request_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe(0.05, endpoint="notes")
+    latency.observe(0.5, endpoint="notes")
+
+    text = registry.to_prometheus()
+    assert "# TYPE biji_requests_total counter" in text
+    assert 'biji_requests_total{endpoint="notes",status="200"} 3' in text
+    assert 'biji_request_seconds_bucket{endpoint="notes",le="0.1"} 1' in text
+    assert 'biji_request_seconds_bucket{endpoint="notes",le="+Inf"} 2' in text
+    assert 'biji_request_seconds_count{endpoint="notes"} 2' in text
+
+    path = tmp_path / "metrics.json"
+    MetricsWriter(path, registry=registry).stop()
+    snapshot = json.loads(path.read_text(encoding="utf-8"))
+    sample = snapshot["metrics"]["biji_requests_total"]["samples"][0]
+    assert sample["labels"] == {"endpoint": "notes", "status": "200"}
+    assert sample["value"] == 3 and sample["rate_per_sec"] > 0
+    assert snapshot["metrics"]["biji_request_seconds"]["samples"][0]["avg"] == 0.275
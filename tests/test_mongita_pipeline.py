@@ -1,7 +1,17 @@
 from pathlib import Path
 
-from mongita import MongitaClientDisk
+from bson import ObjectId
 
+from crawler.mongita_io import (
+    NoteIdIndex,
+    UpsertCounts,
+    iter_collection,
+    keys_collection,
+    load_keys,
+    mongita_client,
+    open_mongita,
+    upsert_by_note_id,
+)
 from crawler.pipelines.mongita_pipeline import MongitaConfig, MongitaPipeline
 
 
@@ -24,8 +34,125 @@ def test_mongita_pipeline_writes_two_collections(tmp_path: Path):
         ],
     )
 
-    client = MongitaClientDisk(str(config.dir_path))
-    db = client[config.db_name]
+    db = mongita_client(config.dir_path)[config.db_name]
     assert db[config.notes_collection].count_documents({}) == 1
     assert db[config.link_details_collection].count_documents({}) == 1
     assert db[config.misc_collection].count_documents({}) == 1
+
+
+def test_every_opener_of_a_directory_shares_one_client(tmp_path: Path, monkeypatch):
+    first = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    first.notes.insert_one({"note_id": "n1"})
+    monkeypatch.chdir(tmp_path)
+    second = open_mongita(Path("mongita"), "biji", "notes", "details", "misc")
+    assert second.notes.database.client is first.notes.database.client
+    # Opening it again did not close the engine under the first opener.
+    assert first.notes._engine._cache.get(first.notes.full_name)
+    assert second.notes.find_one({"note_id": "n1"}) is not None
+
+
+def test_bulk_upserts_merge_duplicates_and_survive_reopen(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    index = NoteIdIndex(cols.notes)
+
+    assert index.upsert_many(
+        [
+            {"note_id": "n1", "title": "a", "tags": ["x"]},
+            {"note_id": "n2", "title": "b"},
+            {"note_id": "n1", "title": "a2"},
+        ],
+        now=100,
+    ) == UpsertCounts(inserted=2)
+    assert index.upsert_many([{"note_id": "n1", "title": "a3", "_ts": 200}, {"note_id": "n3"}], now=200) == UpsertCounts(
+        inserted=1, updated=1
+    )
+
+    n1 = cols.notes.find_one({"note_id": "n1"})
+    assert (n1["title"], n1["tags"], n1["_created_at"], n1["_ts"]) == ("a3", ["x"], 100, 200)
+    assert cols.notes.count_documents({}) == 3
+    # Updated in place, and the keys follow.
+    assert [d["note_id"] for d in cols.notes.find({})] == ["n1", "n2", "n3"]
+    assert keys_collection(cols.notes).find_one({"_id": "n1"}) == {"_id": "n1", "doc_id": n1["_id"], "_ts": 200, "_fp": n1["_fp"], "_seen_at": 200}
+
+    # A crash between writing a key and its document leaves the key pending.
+    keys_collection(cols.notes).insert_one({"_id": "n4", "doc_id": ObjectId(), "_ts": 300, "_pending": True})
+    reopened = NoteIdIndex(cols.notes)
+    assert len(reopened) == 3 and "n4" not in reopened
+    assert keys_collection(cols.notes).find_one({"_id": "n4"}) is None
+    assert reopened.upsert_many([{"note_id": "n2", "title": "b2"}, {"note_id": "n4"}]) == UpsertCounts(inserted=1, updated=1)
+    assert [d["title"] for d in cols.notes.find({"note_id": "n2"})] == ["b2"]
+    assert len(NoteIdIndex(cols.notes)) == 4
+
+
+def test_keys_are_built_for_collections_written_without_them(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    cols.details.insert_many(
+        [
+            {"note_id": "n1", "title": "old", "_ts": 50},
+            {"note_id": "n1", "title": "new", "_ts": 60, "source_version": "v1"},
+            {"note_id": "n2", "title": "b", "_ts": 70},
+            {"title": "no note id"},
+        ]
+    )
+    assert load_keys(cols.details).keys() == {"n1", "n2"}
+    assert load_keys(cols.details)["n1"]["source_version"] == "v1"
+    # The older duplicate is dropped on the way.
+    assert sorted(d.get("title") for d in cols.details.find({})) == ["b", "new", "no note id"]
+
+    index = NoteIdIndex(cols.details)
+    assert index.upsert_many([{"note_id": "n1", "title": "newer"}]) == UpsertCounts(updated=1)
+    assert [d["title"] for d in cols.details.find({"note_id": "n1"})] == ["newer"]
+
+
+def test_unchanged_documents_are_not_rewritten(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    index = NoteIdIndex(cols.notes)
+    docs = [{"kind": "note", "note_id": str(i), "raw": {"id": str(i), "title": f"t{i}"}} for i in range(5)]
+    assert index.upsert_many(docs, now=1_000) == UpsertCounts(inserted=5)
+    stored = {d["note_id"]: (d["_id"], d["_ts"]) for d in cols.notes.find({})}
+
+    changed = [*docs[:4], {**docs[4], "raw": {"id": "4", "title": "new"}}]
+    reopened = NoteIdIndex(cols.notes)
+    assert reopened.upsert_many([{**d, "_ts": 2_000} for d in changed], now=2_000) == UpsertCounts(
+        updated=1, unchanged=4
+    )
+    after = {d["note_id"]: (d["_id"], d["_ts"]) for d in cols.notes.find({})}
+    assert [note_id for note_id in stored if after[note_id] != stored[note_id]] == ["4"]
+
+    # Only a stale `_seen_at` is refreshed, in place; content, `_ts`, `_id` and order stay as they were.
+    order = [d["note_id"] for d in cols.notes.find({})]
+    assert reopened.upsert_many(docs[:2], now=1_000 + 2 * 86_400) == UpsertCounts(unchanged=2)
+    doc = cols.notes.find_one({"note_id": "0"})
+    assert (doc["_id"], doc["_ts"], doc["_seen_at"]) == (stored["0"][0], 1_000, 1_000 + 2 * 86_400)
+    assert [d["note_id"] for d in cols.notes.find({})] == order
+    assert reopened.upsert_many(docs[:2], now=1_000 + 2 * 86_400 + 1) == UpsertCounts(unchanged=2)
+    assert reopened.counts == UpsertCounts(inserted=0, updated=1, unchanged=8)
+
+    assert upsert_by_note_id(cols.notes, note_id="1", doc=docs[1]) == "unchanged"
+    assert upsert_by_note_id(cols.notes, note_id="1", doc={**docs[1], "raw": {}}) == "updated"
+    assert upsert_by_note_id(cols.notes, note_id="9", doc={"note_id": "9"}) == "inserted"
+
+
+def test_iter_collection_pages_through_find_without_keeping_the_cache(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    index = NoteIdIndex(cols.details)
+    docs = [
+        {"note_id": f"n{i}", "title": f"t{i}", "score": i / 3, "ok": i % 2 == 0, "tags": ["a", {"b": i}], "none": None}
+        for i in range(20)
+    ]
+    index.upsert_many(docs, now=100)
+    index.upsert_many([{"note_id": "n3", "title": "changed", "body": "x" * 5000}], now=200)
+
+    reopened = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    expected = list(reopened.details.find({}))
+    reopened.details.database.client.close()
+
+    cached = []
+    streamed = []
+    for doc in iter_collection(reopened.details, batch_size=3):
+        streamed.append(doc)
+        cached.append(len(reopened.details._engine._cache.get(reopened.details.full_name, {})))
+    assert streamed == expected and len(streamed) == 20
+    assert next(d for d in streamed if d["note_id"] == "n3")["title"] == "changed"
+    assert max(cached) <= 3
+    assert not reopened.details._engine._cache.get(reopened.details.full_name)
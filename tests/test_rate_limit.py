@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fake_biji_server import make_token
+from crawler.async_engine import AsyncBijiCrawler
+from crawler.rate_limit import AdaptiveLimiter, LimiterConfig, limiter_config_from_env
+
+
+class FakeClock:
+    """Advances a little on every read so the rate gate always opens."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        self.now += 0.01
+        return self.now
+
+
+def test_adaptive_limiter_additive_increase_and_multiplicative_decrease():
+    clock = FakeClock()
+    changes = []
+    limiter = AdaptiveLimiter(
+        LimiterConfig(
+            name="detail",
+            initial_concurrency=4,
+            initial_rate=1000.0,
+            max_rate=2000.0,
+            increase_every=2,
+            decrease_cooldown=10.0,
+        ),
+        on_change=lambda lim, reason: changes.append(reason),
+        clock=clock,
+    )
+
+    for _ in range(2):
+        limiter.release(limiter.acquire(), status=200)
+    assert limiter.concurrency == 5
+    assert changes == ["increase"]
+
+    limiter.release(limiter.acquire(), status=429)
+    assert limiter.concurrency == 2
+    assert limiter.rate == 500.5
+    # A second failure inside the cooldown window does not halve again.
+    limiter.release(limiter.acquire(), status=503)
+    assert limiter.concurrency == 2
+    assert changes == ["increase", "status=429"]
+
+
+def test_adaptive_limiter_treats_slow_responses_as_congestion():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(LimiterConfig(name="notes", initial_concurrency=4, target_latency=1.0), clock=clock)
+    started = limiter.acquire()
+    clock.now += 5
+    limiter.release(started, status=200)
+    assert limiter.concurrency == 2
+    assert limiter.in_flight == 0
+
+
+def test_limiter_config_from_env_clamps_initial_values(monkeypatch):
+    monkeypatch.setenv("BIJI_DETAIL_MAX_CONCURRENCY", "2")
+    monkeypatch.setenv("BIJI_DETAIL_MAX_RPS", "3")
+    config = limiter_config_from_env("detail", initial_concurrency=8, initial_rate=10.0)
+    assert config.max_concurrency == 2
+    assert config.initial_concurrency == 2
+    assert config.max_rate == 3.0
+    assert config.initial_rate == 3.0
+
+
+def test_async_fetch_returns_the_slot_on_any_exception(monkeypatch):
+    monkeypatch.setenv("BIJI_BEARER_TOKEN", make_token(ttl=3600))
+    crawler = AsyncBijiCrawler(pipelines=[], concurrency=4)
+
+    class BrokenPool:
+        async def get(self, url, **kwargs):
+            raise ValueError("malformed response")
+
+    crawler._http = BrokenPool()
+    limiter = crawler._limiters["detail"]
+    for _ in range(10):
+        with pytest.raises(ValueError):
+            # A leaked slot would block `acquire_async` for good once all four are gone.
+            asyncio.run(asyncio.wait_for(crawler._fetch("detail", "http://127.0.0.1/detail"), 5))
+    assert limiter.in_flight == 0
@@ -0,0 +1,35 @@
+import os
+import time
+from pathlib import Path
+
+from crawler.response_cache import DetailResponseCache
+
+
+def test_cache_hits_expires_and_evicts_least_recently_used(tmp_path: Path):
+    cache = DetailResponseCache(tmp_path, max_bytes=10_000)
+    body = b'{"h": {"c": 0}, "c": {"content": "' + os.urandom(2000).hex().encode() + b"x" * 20_000 + b'"}}'
+
+    assert cache.get("n1", "v1") is None
+    cache.put("n1", "v1", body)
+    assert cache.get("n1", "v1") == body
+    assert cache.get("n1", "v2") is None
+    cache.put("n1", "", body)
+    assert cache.get("n1", "") is None
+    assert cache.total_bytes < len(body) / 4
+
+    for i in range(2, 40):
+        cache.put(f"n{i}", "v1", body + str(i).encode())
+        cache.get("n1", "v1")
+    assert cache.total_bytes <= 10_000
+    assert cache.stats.evictions > 0
+    assert cache.get("n1", "v1") == body
+    assert cache.get("n2", "v1") is None
+
+    reopened = DetailResponseCache(tmp_path, max_bytes=10_000, ttl=60)
+    assert len(reopened) == len(cache)
+    assert reopened.get("n1", "v1") == body
+    path = next(tmp_path.glob("*/*.z"))
+    os.utime(path, (time.time() - 3600,) * 2)
+    stale = DetailResponseCache(tmp_path, ttl=1e-9)
+    assert stale.get("n1", "v1") is None
+    assert (stale.stats.hits, stale.stats.misses, stale.stats.expired) == (0, 1, 1)
@@ -0,0 +1,81 @@
+import dataclasses
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_biji_server import FakeBijiServer, ServerConfig, make_token
+from benchmarks.synthetic import CorpusConfig
+from crawler.async_engine import AsyncBijiCrawler
+from crawler.dead_letters import DeadLetterStore
+from crawler.mongita_io import open_mongita
+from crawler.retry_policy import DelayedRetries, RetryPolicy
+
+
+def test_backoff_grows_caps_and_jitters():
+    policy = RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=3.0, jitter=0.5)
+    assert [policy.delay(n, rand=lambda: 1.0) for n in (1, 2, 3, 4)] == [0.5, 1.0, 2.0, 3.0]
+    assert policy.delay(3, rand=lambda: 0.0) == 1.0
+    assert [policy.should_retry(n) for n in (1, 3, 4)] == [True, True, False]
+
+    fired = []
+    timers = DelayedRetries()
+    timers.schedule(0.01, fired.append, "a")
+    timers.schedule(60, fired.append, "b")
+    assert timers.pending == 2
+    time.sleep(0.2)
+    assert (fired, timers.pending) == (["a"], 1)
+    timers.cancel_all()
+    assert timers.pending == 0
+
+
+class _Collector:
+    def __init__(self):
+        self.items = []
+
+    def save_items(self, table, items):
+        self.items.extend(items)
+        return True
+
+    def close(self):
+        pass
+
+
+def test_exhausted_details_are_dead_lettered_then_replayed(tmp_path: Path, monkeypatch):
+    pytest.importorskip("aiohttp")
+    config = ServerConfig(
+        corpus=CorpusConfig(notes=20, link_ratio=0.5, content_size=50), latency_ms=0, p_detail_error=1.0
+    )
+    server = FakeBijiServer(("127.0.0.1", 0), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for key, value in {
+        "BIJI_API_BASE": server.base_url,
+        "BIJI_AUTH_API_BASE": server.base_url,
+        "BIJI_BEARER_TOKEN": make_token(ttl=3600),
+        "BIJI_INCREMENTAL": "0",
+        "BIJI_CHECKPOINT": "0",
+        "BIJI_DETAIL_CONDITIONAL": "0",
+        "BIJI_DETAIL_MAX_ATTEMPTS": "2",
+        "BIJI_DETAIL_RETRY_BASE_DELAY": "0.01",
+    }.items():
+        monkeypatch.setenv(key, value)
+    store = DeadLetterStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc").dead_letters)
+    link_ids = sorted(n["id"] for n in server.corpus.page("", 20) if n["note_type"] == "link")
+    try:
+        first = _Collector()
+        AsyncBijiCrawler(pipelines=[first], concurrency=4, dead_letters=store).start()
+        assert sum(item["kind"] == "note" for item in first.items) == 20
+        assert not any(item["kind"] == "link_detail" for item in first.items)
+        letters = store.list("detail")
+        assert [letter["note_id"] for letter in letters] == link_ids
+        assert {letter["attempts"] for letter in letters} == {2}
+
+        server.config = dataclasses.replace(config, p_detail_error=0.0)
+        replay = _Collector()
+        AsyncBijiCrawler(pipelines=[replay], concurrency=4, dead_letters=store, replay_dead_letters=True).start()
+        assert sorted(item["note_id"] for item in replay.items) == link_ids
+        assert store.list("detail") == []
+    finally:
+        server.shutdown()
+        server.server_close()
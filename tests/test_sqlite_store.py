@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import pytest
+
+from crawler.mongita_io import UpsertCounts, open_mongita
+from crawler.pipelines.sqlite_pipeline import SqlitePipeline
+from crawler.sqlite_store import SqliteStore
+from crawler.storage import MongitaStore, NoteStore
+from scripts.convert_mongita_to_sqlite import convert_store
+
+
+def _note(note_id, title, content="", **raw):
+    return {
+        "kind": "note",
+        "note_id": note_id,
+        "raw": {"id": note_id, "title": title, "content": content, "note_type": "link", **raw},
+    }
+
+
+def test_sqlite_upserts_match_mongita_semantics(tmp_path: Path):
+    store = SqliteStore(tmp_path / "biji.sqlite3")
+    assert store.upsert_notes(
+        [
+            {"note_id": "n1", "title": "a", "tags": ["x"]},
+            {"note_id": "n2", "title": "b"},
+            {"note_id": "n1", "title": "a2"},
+        ],
+        now=100,
+    ) == UpsertCounts(inserted=2)
+    assert store.upsert_notes([{"note_id": "n1", "title": "a3", "_ts": 200}, {"note_id": "n3"}], now=200) == UpsertCounts(
+        inserted=1, updated=1
+    )
+    assert store.upsert_notes([{"note_id": "n2", "title": "b"}], now=300) == UpsertCounts(unchanged=1)
+    store.close()
+
+    store = SqliteStore(tmp_path / "biji.sqlite3")
+    notes = {d["note_id"]: d for d in store.iter_notes()}
+    assert list(notes) == ["n1", "n2", "n3"] and store.count_notes() == 3
+    n1 = notes["n1"]
+    assert (n1["title"], n1["tags"], n1["_created_at"], n1["_ts"], n1["_seen_at"]) == ("a3", ["x"], 100, 200, 200)
+    # Unchanged, and `_seen_at` is not stale yet: nothing was rewritten.
+    assert (notes["n2"]["_ts"], notes["n2"]["_seen_at"]) == (100, 100)
+
+    store.upsert_details([{"kind": "link_detail", "note_id": "n1", "source_version": "v1", "title": "t"}])
+    store.upsert_details([{"kind": "link_detail", "note_id": "n2", "title": "t"}])
+    assert store.detail_versions() == {"n1": "v1"}
+    assert store.get_detail("n1")["title"] == "t" and store.get_detail("nope") is None
+
+
+def test_sqlite_pipeline_search_and_conversion_from_mongita(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    mongita = MongitaStore(cols)
+    mongita.upsert_notes([_note("n1", "读书笔记", "关于分布式系统的思考"), _note("n2", "Recipes", "slow cooked beans")], now=100)
+    mongita.upsert_details([{"kind": "link_detail", "note_id": "n2", "title": "Beans", "raw": {"content": "pinto"}}])
+    mongita.insert_misc([{"kind": "other", "x": 1}])
+
+    store = SqliteStore(tmp_path / "biji.sqlite3")
+    assert convert_store(mongita, store) == (2, 1, 1)
+    assert [d["_created_at"] for d in store.iter_notes()] == [100, 100]
+    assert [d["x"] for d in store.iter_misc()] == [1]
+    assert convert_store(MongitaStore(cols), store)[:2] == (2, 1)
+    assert store.count_notes() == 2 and store.count_details() == 1
+
+    assert store.search("分布式") == ["n1"]
+    assert store.search("读书") == ["n1"]
+    assert store.search("pinto") == ["n2"]
+    assert store.search("missing") == []
+
+    store.close()
+
+    pipeline = SqlitePipeline(tmp_path / "biji.sqlite3")
+    pipeline.save_items("item", [_note("n1", "读书笔记", "改成了一致性协议")])
+    pipeline.close()
+
+    reopened = SqliteStore(tmp_path / "biji.sqlite3")
+    assert reopened.search("分布式") == [] and reopened.search("一致性") == ["n1"]
+    assert {r[0] for r in reopened._conn.execute("SELECT note_type FROM notes")} == {"link"}
+    assert reopened._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_an_incomplete_backend_fails_at_construction():
+    class NotesOnly(NoteStore):
+        def upsert_notes(self, docs, *, now=None):
+            return UpsertCounts()
+
+    with pytest.raises(TypeError, match="abstract"):
+        NotesOnly()
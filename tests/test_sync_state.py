@@ -0,0 +1,229 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_biji_server import FakeBijiServer, ServerConfig, make_token
+from benchmarks.synthetic import CorpusConfig
+from crawler.async_engine import AsyncBijiCrawler
+from crawler.biji_notes_logic import NotesPage
+from crawler.crawl_session import CrawlOptions, CrawlSession
+from crawler.mongita_io import open_mongita
+from crawler.pipelines.write_behind_pipeline import WriteBehindPipeline
+from crawler.sync_state import CrawlCursor, SyncStateStore, Watermark, advance_watermark, is_covered, page_is_covered
+
+
+def _note(note_id, created_at, updated_at=None):
+    return {"id": note_id, "created_at": created_at, "updated_at": updated_at or created_at}
+
+
+def test_advance_watermark_tracks_newest_created_and_updated():
+    wm = advance_watermark(
+        None,
+        [
+            _note("9", "2024-01-02 00:00:00", "2024-03-01 00:00:00"),
+            _note("10", "2024-01-02 00:00:00"),
+            _note("3", "2023-12-31 00:00:00"),
+        ],
+    )
+    assert wm == Watermark(
+        created_at="2024-01-02 00:00:00",
+        created_id="10",
+        updated_at="2024-03-01 00:00:00",
+        updated_id="9",
+    )
+
+
+def test_page_is_covered_only_when_every_note_is_at_or_below_watermark():
+    wm = Watermark(created_at="2024-01-02 00:00:00", created_id="10")
+    old = _note("10", "2024-01-02 00:00:00")
+    new = _note("11", "2024-01-02 00:00:00")
+
+    assert is_covered(old, wm, sort="create_desc") is True
+    assert is_covered(new, wm, sort="create_desc") is False
+    assert page_is_covered([old], wm, sort="create_desc") is True
+    assert page_is_covered([new, old], wm, sort="create_desc") is False
+    assert page_is_covered([old], None, sort="create_desc") is False
+    # No updated_* mark yet, so the update pass must not stop.
+    assert page_is_covered([old], wm, sort="update_desc") is False
+
+
+def test_sync_state_store_roundtrip(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    store = SyncStateStore(cols.misc)
+    assert store.load_watermark("acc") is None
+
+    store.save_watermark("acc", Watermark(created_at="a", created_id="1"))
+    store.save_watermark("acc", Watermark(created_at="b", created_id="2"))
+    assert store.load_watermark("acc") == Watermark(created_at="b", created_id="2")
+    assert cols.misc.count_documents({"kind": "sync_watermark"}) == 1
+
+
+def test_sync_state_store_cursor_roundtrip(tmp_path: Path):
+    cols = open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc")
+    store = SyncStateStore(cols.misc)
+    cursor = CrawlCursor(
+        since_ids={"create_desc": "42", "update_desc": None},
+        pending_details=(("n2", "v2"), ("n1", "")),
+        watermark=Watermark(created_at="a", created_id="1"),
+    )
+    store.save_cursor("acc", cursor)
+
+    loaded = store.load_cursor("acc")
+    assert loaded.since_ids == {"create_desc": "42", "update_desc": None}
+    assert loaded.pending_details == (("n1", ""), ("n2", "v2"))
+    assert loaded.watermark == cursor.watermark
+    assert loaded.is_done is False
+
+    # Checkpoints from before versions were kept list bare note ids.
+    cols.misc.update_one({"kind": "crawl_cursor", "account": "acc"}, {"$set": {"pending_details": ["n3"]}})
+    assert store.load_cursor("acc").pending_details == (("n3", ""),)
+
+    store.clear_cursor("acc")
+    assert store.load_cursor("acc") is None
+
+
+def test_resumed_session_replays_pending_details_with_versions(tmp_path: Path):
+    state = SyncStateStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc").misc)
+    options = CrawlOptions(detail_conditional=False)
+    session = CrawlSession(options, account_id="acc", state_store=state)
+    session.start()
+    notes = [{"id": i, "note_type": "link", "updated_at": f"u{i}"} for i in ("1", "2")]
+    outcome = session.handle_page(sort="create_desc", since_id="", page=NotesPage(notes, "2", True))
+    session.page_done(outcome)
+    session.detail_done("1", "u1")
+    session.finish()
+
+    resumed = CrawlSession(options, account_id="acc", resume=True, state_store=state)
+    assert resumed.start() == ({"create_desc": "2"}, [("2", "u2")])
+
+
+def test_session_stops_checkpointing_after_storage_failed(tmp_path: Path):
+    state = SyncStateStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc").misc)
+    session = CrawlSession(CrawlOptions(fetch_detail=False, incremental=True), account_id="acc", state_store=state)
+    session.start()
+    first = session.handle_page(sort="create_desc", since_id="", page=NotesPage([_note("3", "c3")], "3", True))
+    second = session.handle_page(sort="create_desc", since_id="3", page=NotesPage([_note("2", "c2")], "2", False))
+    session.page_done(first)
+    session.storage_failed()
+    session.page_done(second)
+    session.finish()
+
+    assert state.load_cursor("acc").since_ids == {"create_desc": "3"}
+    assert state.load_watermark("acc") is None
+
+
+def _serve(tmp_path: Path, monkeypatch, **env) -> FakeBijiServer:
+    server = FakeBijiServer(("127.0.0.1", 0), ServerConfig(corpus=CorpusConfig(notes=250, link_ratio=0.3), latency_ms=0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for key, value in {
+        "BIJI_API_BASE": server.base_url,
+        "BIJI_AUTH_API_BASE": server.base_url,
+        "BIJI_BEARER_TOKEN": make_token(ttl=3600),
+        "BIJI_MONGITA_DIR": str(tmp_path / "mongita"),
+        "BIJI_LIMIT": "50",
+        "BIJI_DETAIL_CONDITIONAL": "0",
+        **env,
+    }.items():
+        monkeypatch.setenv(key, value)
+    return server
+
+
+class _NotePipeline:
+    def __init__(self, stored: set[str], fail_calls: tuple[int, ...] = ()):
+        self.stored = stored
+        self.fail_calls = fail_calls
+        self.calls = 0
+
+    def save_items(self, table, items):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            return False
+        self.stored.update(str(item["note_id"]) for item in items if item["kind"] == "note")
+        return True
+
+    def close(self):
+        pass
+
+
+def _check_cursors(monkeypatch, listing: list[str], stored: set[str]) -> list:
+    violations = []
+    save_cursor = SyncStateStore.save_cursor
+
+    def checked_save_cursor(self, account, cursor):
+        since_id = cursor.since_ids.get("create_desc")
+        if since_id:
+            missing = set(listing[: listing.index(since_id) + 1]) - stored
+            if missing:
+                violations.append((since_id, len(missing)))
+        save_cursor(self, account, cursor)
+
+    monkeypatch.setattr(SyncStateStore, "save_cursor", checked_save_cursor)
+    return violations
+
+
+def test_async_checkpoints_never_get_ahead_of_stored_notes(tmp_path: Path, monkeypatch):
+    pytest.importorskip("aiohttp")
+    server = _serve(tmp_path, monkeypatch)
+    listing = [n["id"] for n in server.corpus.page("", 250)]
+    stored: set[str] = set()
+    violations = _check_cursors(monkeypatch, listing, stored)
+    try:
+        AsyncBijiCrawler(pipelines=[_NotePipeline(stored)], concurrency=4).start()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(stored) == 250
+    assert violations == []
+
+
+def test_async_failed_batch_freezes_checkpoint_until_resumed(tmp_path: Path, monkeypatch):
+    pytest.importorskip("aiohttp")
+    server = _serve(tmp_path, monkeypatch, BIJI_INCREMENTAL="1")
+    listing = [n["id"] for n in server.corpus.page("", 250)]
+    stored: set[str] = set()
+    violations = _check_cursors(monkeypatch, listing, stored)
+    try:
+        # One page per batch: batch 2 is lost, batch 3 and later are stored.
+        crawler = AsyncBijiCrawler(pipelines=[_NotePipeline(stored, fail_calls=(2,))], concurrency=4, batch_size=50)
+        crawler.start()
+        assert 0 < len(stored) < 250
+        state = SyncStateStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc").misc)
+        assert state.load_cursor(crawler._session.account_id) is not None
+        assert state.load_watermark(crawler._session.account_id) is None
+
+        AsyncBijiCrawler(pipelines=[_NotePipeline(stored)], concurrency=4, batch_size=50, resume=True).start()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(stored) == 250
+    assert violations == []
+    assert state.load_cursor(crawler._session.account_id) is None
+    assert state.load_watermark(crawler._session.account_id) is not None
+
+
+def test_async_write_behind_checkpoints_wait_for_the_writer(tmp_path: Path, monkeypatch):
+    pytest.importorskip("aiohttp")
+    server = _serve(tmp_path, monkeypatch, BIJI_INCREMENTAL="1")
+    listing = [n["id"] for n in server.corpus.page("", 250)]
+    stored: set[str] = set()
+    violations = _check_cursors(monkeypatch, listing, stored)
+
+    class SlowPipeline(_NotePipeline):
+        def save_items(self, table, items):
+            time.sleep(0.05)
+            return super().save_items(table, items)
+
+    try:
+        pipeline = WriteBehindPipeline(SlowPipeline(stored), batch_size=50, flush_interval=0.05)
+        crawler = AsyncBijiCrawler(pipelines=[pipeline], concurrency=4, batch_size=50)
+        crawler.start()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(stored) == 250
+    assert violations == []
+    state = SyncStateStore(open_mongita(tmp_path / "mongita", "biji", "notes", "details", "misc").misc)
+    assert state.load_cursor(crawler._session.account_id) is None
+    assert state.load_watermark(crawler._session.account_id) is not None
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from crawler.biji_auth import TokenBundle
+from crawler.token_manager import TokenManager
+
+
+def _bundle(token: str, expire_in: int) -> TokenBundle:
+    return TokenBundle(
+        access_token=token,
+        access_token_expire_at=int(time.time()) + expire_in,
+        refresh_token="rt",
+        refresh_token_expire_at=None,
+    )
+
+
+def test_concurrent_refreshes_collapse_into_one():
+    calls = []
+
+    def refresh(bundle):
+        calls.append(bundle.access_token)
+        time.sleep(0.1)
+        return _bundle(f"t{len(calls)}", 3600)
+
+    manager = TokenManager(_bundle("t0", 3600), refresh)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.refresh(stale_token="t0"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == ["t0"]
+    assert {b.access_token for b in results} == {"t1"}
+    # A caller that saw the old token after rotation gets the new one for free.
+    assert manager.refresh(stale_token="t0").access_token == "t1"
+    assert manager.refresh_count == 1
+
+
+def test_background_thread_refreshes_before_expiry():
+    refreshed = threading.Event()
+
+    def refresh(bundle):
+        refreshed.set()
+        return _bundle("fresh", 3600)
+
+    manager = TokenManager(_bundle("old", 60), refresh, refresh_before_seconds=300)
+    manager.start()
+    try:
+        assert refreshed.wait(2)
+    finally:
+        manager.stop()
+    assert manager.access_token() == "fresh"
+
+
+def test_short_lived_tokens_do_not_refresh_back_to_back():
+    calls = []
+
+    def refresh(bundle):
+        calls.append(bundle.access_token)
+        return _bundle(f"t{len(calls)}", 120)
+
+    # Shorter-lived than refresh_before: rotated halfway through its life.
+    manager = TokenManager(_bundle("t0", 120), refresh, refresh_before_seconds=300)
+    for _ in range(1000):
+        manager.access_token()
+    assert len(calls) == 1
+    assert 55 <= manager.refresh_due_at() - time.time() <= 60
+
+    manager.start()
+    try:
+        time.sleep(0.5)
+    finally:
+        manager.stop()
+    assert len(calls) == 1
+
+    # A server handing out already-expired tokens is retried at most every min_refresh_interval.
+    expired = TokenManager(_bundle("e0", -1), lambda b: _bundle("e", -1), min_refresh_interval=0.2)
+    expired.start()
+    try:
+        time.sleep(1)
+    finally:
+        expired.stop()
+    for _ in range(1000):
+        expired.access_token()
+    assert 1 <= expired.refresh_count <= 7
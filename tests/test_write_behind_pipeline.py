@@ -0,0 +1,115 @@
+import threading
+import time
+from pathlib import Path
+
+from feapder.pipelines import BasePipeline
+
+from crawler import fastjson
+from crawler.pipelines import write_behind_pipeline
+from crawler.pipelines.write_behind_pipeline import WriteBehindPipeline, drain_write_behind, run_after_saved
+
+
+class _SlowPipeline(BasePipeline):
+    def __init__(self, delay: float = 0.0, failures: int = 0):
+        self.delay = delay
+        self.failures = failures
+        self.batches = []
+        self.closed = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def save_items(self, table, items):
+        self.release.wait()
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.batches.append((table, [item["i"] for item in items]))
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def test_batches_by_size_and_time_with_backpressure_and_drain_on_close():
+    inner = _SlowPipeline()
+    inner.release.clear()
+    pipe = WriteBehindPipeline(inner, max_queue_items=10, batch_size=4, flush_interval=0.05)
+
+    pipe.save_items("item", [{"i": i} for i in range(4)])
+    time.sleep(0.05)
+    # The writer holds the first batch; the queue can take ten more.
+    pipe.save_items("item", [{"i": i} for i in range(4, 14)])
+    blocked = threading.Thread(target=pipe.save_items, args=("item", [{"i": 14}]))
+    blocked.start()
+    time.sleep(0.1)
+    assert blocked.is_alive() and pipe.pending == 10
+
+    inner.release.set()
+    blocked.join(timeout=5)
+    pipe.flush()
+    assert [b for _, b in inner.batches][:3] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]]
+    assert sorted(i for _, b in inner.batches for i in b) == list(range(15))
+
+    # A lone item goes out once it has waited flush_interval.
+    pipe.save_items("other", [{"i": 99}])
+    time.sleep(0.3)
+    assert inner.batches[-1] == ("other", [99])
+
+    pipe.save_items("item", [{"i": 100}, {"i": 101}])
+    pipe.close()
+    assert inner.batches[-1] == ("item", [100, 101]) and inner.closed
+    assert pipe.save_items("item", [{"i": 102}]) is False
+
+
+def test_failed_writes_are_retried():
+    inner = _SlowPipeline(failures=1)
+    pipe = WriteBehindPipeline(inner, batch_size=2, flush_interval=0)
+    pipe.save_items("item", [{"i": 1}, {"i": 2}])
+    pipe.close()
+    assert inner.batches == [("item", [1, 2])]
+
+
+def test_callbacks_wait_for_the_items_queued_before_them():
+    inner = _SlowPipeline()
+    inner.release.clear()
+    pipe = WriteBehindPipeline(inner, batch_size=3, flush_interval=0)
+    calls = []
+
+    pipe.save_items("item", [{"i": 1}, {"i": 2}, {"i": 3}])
+    run_after_saved([pipe], lambda: calls.append(("first", len(inner.batches))), lambda: calls.append("lost"))
+    pipe.save_items("item", [{"i": 4}])
+    run_after_saved([pipe], lambda: calls.append(("second", len(inner.batches))), lambda: calls.append("lost"))
+    time.sleep(0.1)
+    assert calls == []
+
+    inner.release.set()
+    assert drain_write_behind([pipe]) is True
+    assert calls == [("first", 1), ("second", 2)]
+    pipe.close()
+
+    # Without a write-behind pipeline the callback runs at once.
+    run_after_saved([inner], lambda: calls.append("now"), lambda: calls.append("lost"))
+    assert calls[-1] == "now"
+
+
+def test_given_up_batches_are_kept_and_later_callbacks_report_the_loss(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(write_behind_pipeline, "RETRY_DELAY", 0)
+    inner = _SlowPipeline(failures=write_behind_pipeline.MAX_ATTEMPTS)
+    pipe = WriteBehindPipeline(inner, batch_size=2, flush_interval=0, failed_path=tmp_path / "failed.jsonl")
+    calls = []
+
+    pipe.save_items("item", [{"i": 1}, {"i": 2}])
+    pipe.save_items("item", [{"i": 3}])
+    run_after_saved([pipe], lambda: calls.append("saved"), lambda: calls.append("lost"))
+    assert drain_write_behind([pipe]) is False
+    pipe.close()
+
+    assert inner.batches == [("item", [3])]
+    assert calls == ["lost"] and pipe.lost
+    lines = (tmp_path / "failed.jsonl").read_bytes().splitlines()
+    assert [fastjson.loads(line) for line in lines] == [{"i": 1}, {"i": 2}]
+
+    # After close, callbacks run inline.
+    pipe.after_saved(calls.append)
+    assert calls[-1] is False